@@ -0,0 +1,296 @@
+"""
+Admission control for the inference API, so that a few large or bursty clients
+cannot run the server out of memory or make everyone else wait.
+
+- ``AdmissionMiddleware`` rejects request bodies that are too large while they stream in,
+  and turns requests away with a fast 503 while too many are already in flight.
+- ``parse_upload_form`` rejects requests with too many files, or with a file that is
+  too large, while the multipart body is parsed.
+- ``read_limited`` and ``check_total_pixels`` reject single files and whole requests
+  that are too large, before any image is decoded.
+"""
+
+import json
+import logging
+import math
+import time
+from collections.abc import Callable
+from typing import Any
+
+from fastapi import Request
+from starlette.datastructures import FormData, UploadFile
+from starlette.formparsers import MultiPartException, MultiPartParser
+
+from skysealand import inference
+
+logger = logging.getLogger(__name__)
+
+# How many bytes of an uploaded file to read at once.
+_READ_CHUNK_BYTES = 1024 * 1024
+# How much each finished request moves the average latency that ``Retry-After`` is based on.
+_LATENCY_SMOOTHING = 0.2
+
+_Scope = dict[str, Any]
+_Message = dict[str, Any]
+_Receive = Callable[[], Any]
+_Send = Callable[[_Message], Any]
+
+
+class UploadTooLargeError(ValueError):
+    """An upload is over one of the configured size limits."""
+
+
+async def read_limited(file: UploadFile, max_bytes: int | None) -> bytes:
+    """
+    Reads an uploaded file, stopping as soon as it is larger than the limit.
+
+    Args:
+        file: The uploaded file.
+        max_bytes: The most bytes that the file may have. If None, then there is no limit.
+
+    Returns:
+        The raw bytes of the file.
+    """
+    if max_bytes is None:
+        return await file.read()
+    chunks = []
+    num_bytes = 0
+    while chunk := await file.read(_READ_CHUNK_BYTES):
+        num_bytes += len(chunk)
+        if num_bytes > max_bytes:
+            raise UploadTooLargeError(
+                f"File '{file.filename}' is larger than the limit of {max_bytes} bytes"
+            )
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+class _LimitedMultiPartParser(MultiPartParser):
+    """Stops parsing as soon as there are too many files, or a file is too large."""
+
+    def __init__(self, request: Request, max_files: int | None, max_file_bytes: int | None):
+        super().__init__(request.headers, request.stream(), max_files=math.inf)
+        self._max_files = max_files
+        self._max_file_bytes = max_file_bytes
+        self._num_files = 0
+        self._file_bytes = 0
+
+    def on_headers_finished(self):
+        super().on_headers_finished()
+        file = self._current_part.file
+        if file is None:
+            return
+        self._num_files += 1
+        self._file_bytes = 0
+        if self._max_files is not None and self._num_files > self._max_files:
+            raise UploadTooLargeError(
+                f"More than the limit of {self._max_files} files were uploaded"
+            )
+
+    def on_part_data(self, data: bytes, start: int, end: int):
+        file = self._current_part.file
+        if file is not None and self._max_file_bytes is not None:
+            self._file_bytes += end - start
+            if self._file_bytes > self._max_file_bytes:
+                raise UploadTooLargeError(
+                    f"File '{file.filename}' is larger than the limit of "
+                    f"{self._max_file_bytes} bytes"
+                )
+        super().on_part_data(data, start, end)
+
+
+async def parse_upload_form(
+    request: Request, max_files: int | None, max_file_bytes: int | None
+) -> FormData:
+    """
+    Parses a multipart upload, stopping as soon as it is over the limits.
+
+    The rest of the body is not read, so a request with too many or too large
+    files is turned away without spooling all of it to disk first.
+
+    Args:
+        request: A request with a ``multipart/form-data`` body.
+        max_files: The most files that the request may have. If None, then there is no limit.
+        max_file_bytes: The most bytes that each file may have. If None, then there is no limit.
+
+    Returns:
+        The parsed form, to be closed when done with it.
+    """
+    if request.headers.get("content-type", "").split(";")[0].strip() != "multipart/form-data":
+        raise ValueError("Expected a multipart/form-data upload")
+    try:
+        return await _LimitedMultiPartParser(request, max_files, max_file_bytes).parse()
+    except MultiPartException as e:
+        raise ValueError(f"Invalid upload: {e.message}") from None
+
+
+def check_total_pixels(uploads: list[tuple[str, bytes]], max_total_pixels: int | None):
+    """
+    Rejects uploads whose images have more pixels in total than the limit,
+    reading only their headers.
+
+    Files whose size cannot be read are left for the decoder to reject.
+
+    Args:
+        uploads: Pairs of the name of each file and its raw bytes.
+        max_total_pixels: The most pixels that the images may have together.
+            If None, then there is no limit.
+    """
+    if max_total_pixels is None:
+        return
+    total_pixels = 0
+    for _, data in uploads:
+        size = inference.probe_image_size(data)
+        if size is not None:
+            total_pixels += size[0] * size[1]
+    if total_pixels > max_total_pixels:
+        raise UploadTooLargeError(
+            f"The images have {total_pixels} pixels in total, "
+            f"more than the limit of {max_total_pixels}"
+        )
+
+
+class AdmissionController:
+    """
+    Keeps track of the requests in flight and decides whether to admit more.
+
+    Args:
+        max_in_flight: The most requests to work on at once. Further requests are rejected
+            right away instead of queueing up behind them. If None, then there is no limit.
+        max_request_bytes: The largest request body to accept. If None, then there is no limit.
+        on_reject: Called with the reason whenever a request is rejected,
+            either ``"too_large"`` or ``"saturated"``.
+    """
+
+    def __init__(
+        self,
+        max_in_flight: int | None = None,
+        max_request_bytes: int | None = None,
+        on_reject: Callable[[str], object] | None = None,
+    ):
+        if max_in_flight is not None and max_in_flight < 1:
+            raise ValueError(f"max_in_flight must be positive, got {max_in_flight}")
+        self.max_in_flight = max_in_flight
+        self.max_request_bytes = max_request_bytes
+        self.in_flight = 0
+        self._on_reject = on_reject
+        self._mean_latency_sec = 1.0
+
+    def try_acquire(self) -> bool:
+        """Admits a request if there is room for it."""
+        if self.max_in_flight is not None and self.in_flight >= self.max_in_flight:
+            self.reject("saturated")
+            return False
+        self.in_flight += 1
+        return True
+
+    def release(self, latency_sec: float):
+        """Marks an admitted request as finished after the given number of seconds."""
+        self.in_flight -= 1
+        self._mean_latency_sec += _LATENCY_SMOOTHING * (latency_sec - self._mean_latency_sec)
+
+    def reject(self, reason: str):
+        if self._on_reject is not None:
+            self._on_reject(reason)
+
+    def retry_after_sec(self) -> int:
+        """About how long until a slot frees up, going by how long requests have been taking."""
+        return max(1, math.ceil(self._mean_latency_sec))
+
+
+def _json_response(status: int, detail: str, headers: dict[str, str] | None = None):
+    body = json.dumps({"detail": detail}).encode()
+    raw_headers = [
+        (b"content-type", b"application/json"),
+        (b"content-length", str(len(body)).encode()),
+        *((name.lower().encode(), value.encode()) for name, value in (headers or {}).items()),
+    ]
+    return [
+        {"type": "http.response.start", "status": status, "headers": raw_headers},
+        {"type": "http.response.body", "body": body},
+    ]
+
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware that applies an ``AdmissionController`` to the requests to one path.
+
+    Bodies over ``max_request_bytes`` get a 413, either right away from their
+    ``Content-Length`` or as soon as the streamed body goes over the limit.
+    Requests beyond ``max_in_flight`` get a 503 with a ``Retry-After`` header
+    before their body is read at all.
+
+    Args:
+        app: The ASGI app to wrap.
+        get_controller: Returns the controller to use, so that it can be created lazily.
+        path: The path to control the requests to.
+    """
+
+    def __init__(self, app, get_controller: Callable[[], AdmissionController], path: str):
+        self.app = app
+        self.get_controller = get_controller
+        self.path = path
+
+    async def __call__(self, scope: _Scope, receive: _Receive, send: _Send):
+        if scope["type"] != "http" or scope["path"] != self.path:
+            await self.app(scope, receive, send)
+            return
+
+        controller = self.get_controller()
+        max_bytes = controller.max_request_bytes
+        content_length = dict(scope["headers"]).get(b"content-length", b"")
+        if max_bytes is not None and content_length.isdigit() and int(content_length) > max_bytes:
+            controller.reject("too_large")
+            await self._respond(send, 413, f"The request is larger than {max_bytes} bytes")
+            return
+
+        if not controller.try_acquire():
+            retry_after = controller.retry_after_sec()
+            await self._respond(
+                send,
+                503,
+                "The server is busy, try again later",
+                {"Retry-After": str(retry_after)},
+            )
+            return
+
+        num_bytes = 0
+        responded = False
+
+        async def limited_receive() -> _Message:
+            nonlocal num_bytes, responded
+            message = await receive()
+            if message["type"] != "http.request" or max_bytes is None:
+                return message
+            num_bytes += len(message.get("body", b""))
+            if num_bytes <= max_bytes:
+                return message
+            # Answer now and make the app stop reading, as if the client had gone away.
+            if not responded:
+                responded = True
+                controller.reject("too_large")
+                await self._respond(send, 413, f"The request is larger than {max_bytes} bytes")
+            return {"type": "http.disconnect"}
+
+        async def guarded_send(message: _Message):
+            # Once the request was rejected, drop whatever the app tries to answer.
+            if not responded:
+                await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except Exception:
+            # The app may fail on the body that was cut off, but the client already has its answer.
+            if not responded:
+                raise
+        finally:
+            controller.release(time.perf_counter() - start)
+
+    @staticmethod
+    async def _respond(
+        send: _Send, status: int, detail: str, headers: dict[str, str] | None = None
+    ):
+        logger.warning("Rejected request with %d: %s", status, detail)
+        for message in _json_response(status, detail, headers):
+            await send(message)
@@ -1,49 +1,437 @@
+import asyncio
+import contextlib
+import dataclasses
+import functools
 import logging
 import pathlib
+import secrets
+import time
 
-from fastapi import FastAPI, File, HTTPException, UploadFile
+import numpy as np
+from fastapi import FastAPI, Header, HTTPException, Query, Request, Response
+from fastapi.responses import PlainTextResponse
 from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import UploadFile
 
-from skysealand import inference, logging_setup
+from skysealand import (
+    admission,
+    backends,
+    batching,
+    execution,
+    inference,
+    logging_setup,
+    metrics,
+    registry,
+    serialization,
+    tuning,
+    worker_pool,
+)
 
-app = FastAPI()
+
+@contextlib.asynccontextmanager
+async def _lifespan(_app: FastAPI):
+    tuning.apply_profile(PROFILE)
+    # Load and warm up every model before serving, so that no request waits on them.
+    for name, model_path in MODELS.items():
+        await asyncio.to_thread(_get_registry().load, name, model_path)
+    yield
+    if _retiring:
+        await asyncio.wait(_retiring)
+    for batcher in _batchers.values():
+        await batcher.close()
+    if _execution is not None:
+        _execution.shutdown()
+    if _registry is not None:
+        for version in _registry.versions():
+            _close_model(version.model)
+
+
+app = FastAPI(lifespan=_lifespan)
 logging_setup.setup_logging()
 logger = logging.getLogger(__name__)
 
+# The thread counts, batch size and decode and inference workers, from the file in
+# ``SKYSEALAND_PROFILE`` and ``SKYSEALAND_*`` environment variables, see ``tuning.load_profile``.
+PROFILE = tuning.load_profile()
 # TODO: Make this a config setting.
-MODEL_PATH = pathlib.Path("yolov8n.pt")
+# The models to load at startup, by the name that requests pick them with.
+# Either ``.pt`` models for ultralytics or ``.onnx`` models, see ``backends``.
+# The first one is used for requests that do not pick one.
+MODELS: dict[str, pathlib.Path] = {"default": pathlib.Path("yolov8n.pt")}
+# The sizes of the batches of blank images that each model is warmed up with after loading.
+WARMUP_BATCH_SIZES = (1, 16)
+# The ``/admin`` endpoints are turned off unless this is set.
+# Requests to them must send it in the ``X-Admin-Token`` header.
+ADMIN_TOKEN: str | None = None
+# The most images from concurrent requests to run through the model at once.
+MAX_BATCH_SIZE = PROFILE.batch_size
+# How long a request may wait for others to join its batch.
+MAX_BATCH_WAIT_MS = 10.0
+# The pools that decode uploads and run the model, off of the event loop.
+DECODE_WORKERS = PROFILE.decode_workers
+DECODE_EXECUTOR: execution.ExecutorKind = "thread"
+INFERENCE_WORKERS = 1
+# If positive, each model runs in this many separate worker processes instead of in the API process.
+INFERENCE_PROCESSES = PROFILE.inference_processes
+# Repeated uploads of the same image are answered from a cache of up to this many bytes per model.
+# Set to 0 to turn the cache off.
+CACHE_MAX_BYTES = 64 * 1024 * 1024
+# If set, cached results are also kept on disk here so that they survive restarts.
+CACHE_DIR: pathlib.Path | None = None
+# Uploads over these limits are rejected with a 413 before any image is decoded.
+# Set any of them to None to turn it off.
+MAX_FILES_PER_REQUEST: int | None = 64
+MAX_FILE_BYTES: int | None = 32 * 1024 * 1024
+# Bodies over this are cut off while they stream in.
+MAX_REQUEST_BYTES: int | None = 256 * 1024 * 1024
+# Read from the image headers, so a small file cannot decode into a huge image.
+MAX_TOTAL_PIXELS: int | None = 200_000_000
+# The most ``/infer`` requests to work on at once. Any more are turned away with a 503 and
+# a ``Retry-After`` header instead of queueing up. Set to None to turn it off.
+MAX_IN_FLIGHT_REQUESTS: int | None = 64
 
 
-_model = None
+_registry: registry.ModelRegistry | None = None
+_admission: admission.AdmissionController | None = None
+_execution: execution.ExecutionLayer | None = None
+# The batchers and caches of each loaded model version, by ``ModelVersion.version``.
+_batchers: dict[int, batching.MicroBatcher] = {}
+_caches: dict[int, inference.DetectionCache] = {}
+# Tasks that release replaced model versions once they are no longer in use.
+_retiring: set[asyncio.Task[None]] = set()
 
+# Served in the Prometheus text format at ``/metrics``.
+_metrics = metrics.Registry()
+_request_seconds = _metrics.histogram(
+    "skysealand_request_seconds", "Time taken to answer inference requests.", ("status",)
+)
+_stage_seconds = _metrics.histogram(
+    "skysealand_stage_seconds",
+    "Time taken by each stage of answering inference requests.",
+    ("stage",),
+)
+_requests_in_flight = _metrics.gauge(
+    "skysealand_requests_in_flight", "Inference requests that are being answered."
+)
+_images_total = _metrics.counter("skysealand_images_total", "Images that inference was run on.")
+_batch_size = _metrics.histogram(
+    "skysealand_batch_size",
+    "Number of images in each batch run through the model.",
+    buckets=(1, 2, 4, 8, 16, 32, 64),
+)
+_rejected_total = _metrics.counter(
+    "skysealand_rejected_requests_total",
+    "Inference requests that were turned away by admission control.",
+    ("reason",),
+)
 
-def _get_model():
-    """Lazily load the model so it can be cached."""
-    # Doing this global for simplicity for now.
-    global _model  # noqa: PLW0603
-    if _model is None:
-        logger.info("No model cached. Loading YOLO model from %s", MODEL_PATH)
-        _model = inference.load_ultralytics_yolo_model(MODEL_PATH)
-    return _model
 
+def _load_model(model_path: pathlib.Path, device: str):
+    """Loads a model in this process, or starts worker processes for it."""
+    # Worker processes each get their share of the cores, so that they don't oversubscribe them.
+    num_threads = dataclasses.replace(
+        PROFILE, inference_processes=INFERENCE_PROCESSES
+    ).model_threads()
+    if INFERENCE_PROCESSES > 0:
+        pool = worker_pool.InferenceWorkerPool(
+            model_path,
+            device=device,
+            num_workers=INFERENCE_PROCESSES,
+            model_loader=functools.partial(backends.load_backend, num_threads=num_threads),
+        )
+        pool.start()
+        return pool
+    return backends.load_backend(model_path, device, num_threads=num_threads)
 
-@app.post("/infer")
-async def infer_endpoint(
-    files: list[UploadFile] = File(...),
+
+def _close_model(model):
+    if isinstance(model, worker_pool.InferenceWorkerPool):
+        model.close()
+
+
+def _run_model(
+    model, images: list[np.ndarray], filenames: list[str]
 ) -> inference.InferenceJsonOutput:
-    logger.info("Received inference request with %d file(s)", len(files))
+    if isinstance(model, worker_pool.InferenceWorkerPool):
+        return model.run_with_timing(images, filenames)
+    return inference.run_model_with_timing(model, images, filenames)
+
+
+def _warm_up_model(model, images: list[np.ndarray]):
+    _run_model(model, images, [""] * len(images))
+
+
+def _run_batch(
+    model, images: list[np.ndarray], filenames: list[str]
+) -> inference.InferenceJsonOutput:
+    _batch_size.observe(len(images))
+    return _run_model(model, images, filenames)
+
+
+def _get_registry() -> registry.ModelRegistry:
+    """Lazily create the registry of the served models."""
+    global _registry  # noqa: PLW0603
+    if _registry is None:
+        _registry = registry.ModelRegistry(
+            _load_model, _warm_up_model, warmup_batch_sizes=WARMUP_BATCH_SIZES
+        )
+    return _registry
+
+
+def _get_cache(version: registry.ModelVersion) -> inference.DetectionCache | None:
+    """Lazily create the cache of detections for the given model version."""
+    if CACHE_MAX_BYTES <= 0:
+        return None
+    if version.version not in _caches:
+        _caches[version.version] = inference.DetectionCache(
+            version.fingerprint,
+            max_memory_bytes=CACHE_MAX_BYTES,
+            disk_dir=CACHE_DIR,
+        )
+    return _caches[version.version]
+
+
+async def _retire(version: registry.ModelVersion):
+    """Releases a replaced model version once the requests that are using it have finished."""
+    await asyncio.to_thread(version.drain)
+    batcher = _batchers.pop(version.version, None)
+    if batcher is not None:
+        await batcher.close()
+    _caches.pop(version.version, None)
+    _close_model(version.model)
+    logger.info("Released model %r version %d", version.name, version.version)
+
+
+async def _infer_uploads(
+    version: registry.ModelVersion,
+    uploads: list[tuple[str, bytes]],
+    stage_times: inference.StageTimes,
+) -> inference.InferenceJsonOutput:
+    """Decodes and runs the uploads that are not cached, and answers the rest from the cache."""
+    cache = _get_cache(version)
+    if cache is None:
+        with inference.time_stage(stage_times, "decode"):
+            images, filenames, scales = await _get_execution().decode(uploads)
+        output = await _get_batcher(version).submit(images, filenames)
+        output["results"] = inference.rescale_results(output["results"], scales)
+        return output
+
+    # Looking up the cache is counted as decoding, since it replaces decoding for the hits.
+    with inference.time_stage(stage_times, "decode"):
+        # Hashing and the on-disk tier block, so keep them off of the event loop.
+        batch, misses = await asyncio.to_thread(inference.lookup_cached_batch, cache, uploads)
+        if misses:
+            batch.images, _, batch.scales = await _get_execution().decode(misses)
+    computed = None
+    if misses:
+        computed = await _get_batcher(version).submit(batch.images, batch.image_keys)
+    return inference.complete_cached_batch(cache, batch, computed)
+
+
+async def _infer_tiled_uploads(
+    version: registry.ModelVersion,
+    uploads: list[tuple[str, bytes]],
+    tile_size: int,
+    overlap: int,
+    stage_times: inference.StageTimes,
+) -> inference.InferenceJsonOutput:
+    """Runs the model on overlapping tiles of the full resolution uploads."""
+    with inference.time_stage(stage_times, "decode"):
+        images, filenames, _ = await _get_execution().decode(uploads, target_size=None)
+    tiled = inference.tile_images(images, tile_size, overlap)
+    # Submit the tiles in batch sized parts so that they can share batches with other requests.
+    batcher = _get_batcher(version)
+    tile_outputs = await asyncio.gather(
+        *(
+            batcher.submit(
+                tiled.tiles[start : start + MAX_BATCH_SIZE],
+                [str(i) for i in range(start, min(start + MAX_BATCH_SIZE, len(tiled.tiles)))],
+            )
+            for start in range(0, len(tiled.tiles), MAX_BATCH_SIZE)
+        )
+    )
+    return inference.merge_tile_outputs(tiled, filenames, list(tile_outputs))
+
+
+def _get_execution() -> execution.ExecutionLayer:
+    """Lazily create the executors for decoding and inference."""
+    global _execution  # noqa: PLW0603
+    if _execution is None:
+        _execution = execution.ExecutionLayer(
+            decode_workers=DECODE_WORKERS,
+            decode_executor=DECODE_EXECUTOR,
+            # Each worker process needs a thread in this process to wait on it.
+            inference_workers=max(INFERENCE_WORKERS, INFERENCE_PROCESSES),
+        )
+    return _execution
+
+
+def _get_batcher(version: registry.ModelVersion) -> batching.MicroBatcher:
+    """Lazily create the batcher that sits in front of the given model version."""
+    if version.version not in _batchers:
+        layer = _get_execution()
+        _batchers[version.version] = batching.MicroBatcher(
+            functools.partial(_run_batch, version.model),
+            max_batch_size=MAX_BATCH_SIZE,
+            max_wait_ms=MAX_BATCH_WAIT_MS,
+            executor=layer.inference_executor,
+            max_concurrent_batches=layer.inference_workers,
+        )
+    return _batchers[version.version]
+
+
+def _get_admission() -> admission.AdmissionController:
+    """Lazily create the admission control for ``/infer``."""
+    global _admission  # noqa: PLW0603
+    if _admission is None:
+        _admission = admission.AdmissionController(
+            max_in_flight=MAX_IN_FLIGHT_REQUESTS,
+            max_request_bytes=MAX_REQUEST_BYTES,
+            on_reject=lambda reason: _rejected_total.inc(reason=reason),
+        )
+    return _admission
+
+
+# Added before the metrics middleware, so that the rejected requests are also measured.
+app.add_middleware(admission.AdmissionMiddleware, get_controller=_get_admission, path="/infer")
+
+
+@app.middleware("http")
+async def _record_request_metrics(request: Request, call_next):
+    """Records the latency and outcome of every inference request."""
+    if request.url.path != "/infer":
+        return await call_next(request)
+
+    _requests_in_flight.inc()
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        _requests_in_flight.dec()
+        _request_seconds.observe(time.perf_counter() - start, status=str(status))
 
-    if not files:
-        raise HTTPException(status_code=400, detail="No files uploaded")
 
+def _server_timing(stage_times: inference.StageTimes) -> str:
+    """The stage times as a ``Server-Timing`` header, which browsers show in their dev tools."""
+    return ", ".join(f"{stage};dur={seconds * 1000:.2f}" for stage, seconds in stage_times.items())
+
+
+async def _read_upload_form(request: Request) -> list[tuple[str, bytes]]:
+    """Reads the files uploaded as ``files``, rejecting them while they stream in if too large."""
+    form = await admission.parse_upload_form(request, MAX_FILES_PER_REQUEST, MAX_FILE_BYTES)
     try:
-        images, filenames = inference.load_images(*files)
-        return inference.run_model_with_timing(_get_model(), images, filenames)
+        files = [file for file in form.getlist("files") if isinstance(file, UploadFile)]
+        if not files:
+            raise ValueError("No files uploaded")
+        return await execution.read_uploads(*files)
+    finally:
+        await form.close()
+
+
+# The body is parsed by the endpoint, so that the upload limits apply while it streams in.
+_UPLOAD_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "properties": {
+                        "files": {"type": "array", "items": {"type": "string", "format": "binary"}}
+                    },
+                    "required": ["files"],
+                }
+            }
+        },
+    }
+}
+
+
+@app.post("/infer", response_model=inference.InferenceJsonOutput, openapi_extra=_UPLOAD_BODY)
+async def infer_endpoint(
+    request: Request,
+    accept: str | None = Header(None),
+    tile_size: int | None = Query(None),
+    tile_overlap: int = Query(inference.TILE_OVERLAP),
+    model: str | None = Query(None),
+) -> Response:
+    """
+    Runs inference on the uploaded images with the named model, or the default model.
+
+    The response is json unless the ``Accept`` header asks for one of the binary
+    formats in ``serialization.MEDIA_TYPES``.
+    If ``tile_size`` is given, then the model is run on overlapping tiles of each
+    full resolution image instead, see ``inference.run_tiled_model_with_timing``.
+    Tiled results are not cached.
+
+    Uploads over the ``MAX_*`` limits are rejected with a 413 before they are decoded,
+    and too many files or too large a file are rejected while the upload streams in.
+    While too many requests are in flight, new ones get a 503, see ``admission``.
+    Requests whose inference worker process crashed or hung also get a 503.
+    Requests for a model that is not loaded get a 404.
+
+    The metrics in the response break down how long each stage took,
+    except for encoding the response itself. All of the stages, including
+    serialization, are in the ``Server-Timing`` header and at ``/metrics``.
+    """
+    stage_times: inference.StageTimes = {}
+    try:
+        with inference.time_stage(stage_times, "read"):
+            uploads = await _read_upload_form(request)
+        logger.info("Received inference request with %d file(s)", len(uploads))
+        admission.check_total_pixels(uploads, MAX_TOTAL_PIXELS)
+        # Hold on to this version, so that the request finishes on it even if it is replaced.
+        with _get_registry().acquire(model) as version:
+            if tile_size is not None:
+                output = await _infer_tiled_uploads(
+                    version, uploads, tile_size, tile_overlap, stage_times
+                )
+            else:
+                output = await _infer_uploads(version, uploads, stage_times)
+        stage_times = inference.sum_stage_times(
+            stage_times, output["metrics"].get("stage_times_sec", {})
+        )
+        output["metrics"]["stage_times_sec"] = stage_times
+
+        output_format = serialization.negotiate_format(accept)
+        # Copied so that serialization is not part of its own output.
+        stage_times = {**stage_times}
+        with inference.time_stage(stage_times, "serialize"):
+            content = serialization.encode(output, output_format)
+
+        _images_total.inc(output["metrics"]["num_images"])
+        for stage, seconds in stage_times.items():
+            _stage_seconds.observe(seconds, stage=stage)
+        return Response(
+            content=content,
+            media_type=serialization.MEDIA_TYPES[output_format],
+            headers={"Server-Timing": _server_timing(stage_times)},
+        )
+
+    except admission.UploadTooLargeError as e:
+        _get_admission().reject("too_large")
+        logger.warning("Upload too large: %s", e)
+        raise HTTPException(status_code=413, detail=str(e)) from None
+
+    except registry.UnknownModelError as e:
+        raise HTTPException(status_code=404, detail=str(e)) from None
 
     except ValueError as e:
         logger.warning("Validation error: %s", e, exc_info=True)
         raise HTTPException(status_code=400, detail=str(e)) from None
 
+    except worker_pool.WorkerUnavailableError as e:
+        # The worker is restarted, so the request can be retried.
+        logger.warning("Inference worker unavailable: %s", e)
+        raise HTTPException(
+            status_code=503,
+            detail="The inference worker is restarting, please try again",
+            headers={"Retry-After": str(_get_admission().retry_after_sec())},
+        ) from None
+
     except Exception:
         logger.exception("Unhandled inference error")
         raise HTTPException(
@@ -52,4 +440,74 @@ async def infer_endpoint(
         ) from None
 
 
+@app.get("/batching/stats")
+async def batching_stats_endpoint(model: str | None = Query(None)) -> batching.BatcherStats:
+    try:
+        version = _get_registry().get(model)
+    except registry.UnknownModelError as e:
+        raise HTTPException(status_code=404, detail=str(e)) from None
+    return _get_batcher(version).stats()
+
+
+@app.get("/cache/stats")
+async def cache_stats_endpoint(model: str | None = Query(None)) -> inference.CacheStats:
+    try:
+        version = _get_registry().get(model)
+    except registry.UnknownModelError as e:
+        raise HTTPException(status_code=404, detail=str(e)) from None
+    cache = _get_cache(version)
+    if cache is None:
+        raise HTTPException(status_code=404, detail="The detection cache is turned off")
+    return cache.stats()
+
+
+@app.get("/models")
+async def models_endpoint() -> list[registry.ModelInfo]:
+    """The current version of every served model."""
+    return [version.info() for version in _get_registry().versions()]
+
+
+def _check_admin_token(token: str | None):
+    if ADMIN_TOKEN is None:
+        raise HTTPException(status_code=403, detail="The admin endpoints are turned off")
+    if token is None or not secrets.compare_digest(token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+
+@app.post("/admin/models/{name}")
+async def load_model_endpoint(
+    name: str,
+    model_path: str = Query(...),
+    x_admin_token: str | None = Header(None),
+) -> registry.ModelInfo:
+    """
+    Loads and warms up the model at ``model_path`` on the server, then swaps it in as ``name``.
+
+    Requests keep being answered by the previous version while the new one loads,
+    and requests that already started on the previous version finish on it.
+    """
+    _check_admin_token(x_admin_token)
+    path = pathlib.Path(model_path)
+    if not path.is_file():
+        raise HTTPException(status_code=400, detail=f"No model found at {model_path}")
+
+    try:
+        new, old = await asyncio.to_thread(_get_registry().load, name, path)
+    except Exception:
+        logger.exception("Unable to load model %r from %s", name, path)
+        raise HTTPException(status_code=500, detail="Unable to load model") from None
+
+    if old is not None:
+        task = asyncio.create_task(_retire(old))
+        _retiring.add(task)
+        task.add_done_callback(_retiring.discard)
+    return new.info()
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint() -> PlainTextResponse:
+    """The request, stage and batch metrics in the Prometheus text format."""
+    return PlainTextResponse(_metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
 app.mount("/", StaticFiles(directory="static", html=True), name="static")
@@ -0,0 +1,293 @@
+"""
+Interchangeable engines for running the detection model.
+
+- ``UltralyticsBackend``: The ``.pt`` model run through ``ultralytics.YOLO``.
+- ``OnnxBackend``: A model exported with ``export_onnx`` run directly on ONNX Runtime's
+  CPU engine, with our own NumPy letterbox and NMS instead of ultralytics' pre- and
+  post-processing. This needs the optional ``onnxruntime`` package.
+
+Every backend takes RGB images and returns ``inference.ColumnarDetections`` in the
+coordinates of the given images, see ``inference.detect``.
+"""
+
+import ast
+import logging
+import pathlib
+from typing import Protocol
+
+import cv2
+import numpy as np
+
+from skysealand import boxes, inference
+
+try:
+    import onnxruntime
+except ImportError:  # Optional dependency, only needed for the onnx backend.
+    onnxruntime = None
+
+logger = logging.getLogger(__name__)
+
+# The defaults of ultralytics' predictions, so that both backends find the same boxes.
+CONFIDENCE_THRESHOLD = 0.25
+IOU_THRESHOLD = 0.7
+MAX_DETECTIONS = 300
+
+# The gray that ultralytics pads letterboxed images with.
+_PADDING_VALUE = 114
+
+# Our stages and the names that ultralytics times them under.
+_ULTRALYTICS_STAGES: dict[inference.Stage, str] = {
+    "preprocess": "preprocess",
+    "forward": "inference",
+    "postprocess": "postprocess",
+}
+
+
+class InferenceBackend(Protocol):
+    """Something that runs the detection model on a batch of images."""
+
+    def detect(
+        self, images: list[np.ndarray], stage_times: inference.StageTimes | None = None
+    ) -> list[inference.ColumnarDetections]:
+        """
+        Runs the model on the given RGB images.
+
+        If ``stage_times`` is given, then the time spent in preprocessing,
+        the forward pass and postprocessing is added to it.
+        """
+        ...
+
+
+class UltralyticsBackend:
+    """
+    Runs a model through ``ultralytics.YOLO``.
+
+    Args:
+        model: The loaded YOLO model.
+        confidence_threshold: The lowest confidence of the boxes to keep.
+        iou_threshold: The IoU above which NMS drops the lower confidence box.
+    """
+
+    def __init__(
+        self,
+        model,
+        confidence_threshold: float = CONFIDENCE_THRESHOLD,
+        iou_threshold: float = IOU_THRESHOLD,
+    ):
+        self.model = model
+        self.confidence_threshold = confidence_threshold
+        self.iou_threshold = iou_threshold
+
+    def detect(
+        self, images: list[np.ndarray], stage_times: inference.StageTimes | None = None
+    ) -> list[inference.ColumnarDetections]:
+        """Runs the model on the given RGB images, see ``InferenceBackend.detect``."""
+        # Ultralytics reads numpy images as BGR, like OpenCV.
+        results = self.model(
+            [img[..., ::-1] for img in images],
+            conf=self.confidence_threshold,
+            iou=self.iou_threshold,
+            max_det=MAX_DETECTIONS,
+        )
+        if stage_times is not None and results:
+            # Ultralytics times its own stages, in milliseconds per image.
+            speed = results[0].speed
+            for stage, key in _ULTRALYTICS_STAGES.items():
+                seconds = (speed.get(key) or 0.0) * len(results) / 1000
+                stage_times[stage] = stage_times.get(stage, 0.0) + seconds
+        with inference.time_stage(stage_times, "postprocess"):
+            return inference.process_ultralytics_yolo_batched_detections_columnar(results)
+
+
+def letterbox(
+    image: np.ndarray, shape: tuple[int, int], stride: int | None = None
+) -> tuple[np.ndarray, tuple[float, float], tuple[int, int]]:
+    """
+    Resizes the image to fit in ``shape`` without changing its aspect ratio
+    and pads the rest with gray, the same way as ultralytics.
+
+    Args:
+        image: The (H, W, 3) image.
+        shape: The (height, width) to fit the image in.
+        stride: If given, only pad up to the next multiple of this instead of all the way
+            to ``shape``, for models that accept any multiple of their stride.
+
+    Returns:
+        The letterboxed image, how much its width and height were scaled by,
+        and the (x, y) padding on its left and top.
+    """
+    height, width = image.shape[:2]
+    ratio = min(shape[0] / height, shape[1] / width)
+    new_width, new_height = round(width * ratio), round(height * ratio)
+
+    pad_width, pad_height = shape[1] - new_width, shape[0] - new_height
+    if stride is not None:
+        pad_width, pad_height = pad_width % stride, pad_height % stride
+    left, top = round(pad_width / 2 - 0.1), round(pad_height / 2 - 0.1)
+
+    if (new_width, new_height) != (width, height):
+        image = cv2.resize(image, (new_width, new_height), interpolation=cv2.INTER_LINEAR)
+
+    padded = np.full(
+        (new_height + pad_height, new_width + pad_width, 3), _PADDING_VALUE, dtype=np.uint8
+    )
+    padded[top : top + new_height, left : left + new_width] = image
+    return padded, (new_width / width, new_height / height), (left, top)
+
+
+def _require_onnxruntime():
+    if onnxruntime is None:
+        raise ValueError("The onnx backend requires the `onnxruntime` package.")
+    return onnxruntime
+
+
+class OnnxBackend:
+    """
+    Runs an exported ONNX model on ONNX Runtime's CPU engine.
+
+    Args:
+        model_path: The path to the ``.onnx`` model, see ``export_onnx``.
+        num_threads: The number of threads for ONNX Runtime to use.
+            If None, then ONNX Runtime picks.
+        confidence_threshold: The lowest confidence of the boxes to keep.
+        iou_threshold: The IoU above which NMS drops the lower confidence box.
+    """
+
+    def __init__(
+        self,
+        model_path: pathlib.Path,
+        num_threads: int | None = None,
+        confidence_threshold: float = CONFIDENCE_THRESHOLD,
+        iou_threshold: float = IOU_THRESHOLD,
+    ):
+        self.confidence_threshold = confidence_threshold
+        self.iou_threshold = iou_threshold
+        ort = _require_onnxruntime()
+        options = ort.SessionOptions()
+        if num_threads is not None:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(
+            str(model_path), options, providers=["CPUExecutionProvider"]
+        )
+
+        model_input = self.session.get_inputs()[0]
+        self._input_name = model_input.name
+        metadata = self.session.get_modelmeta().custom_metadata_map
+        self.image_size: tuple[int, int] = tuple(
+            ast.literal_eval(metadata.get("imgsz", "[640, 640]"))
+        )
+        self.stride = int(metadata.get("stride", 32))
+        # Exported with ``dynamic=True``, the model takes any batch size and image shape.
+        self.dynamic_batch = not isinstance(model_input.shape[0], int)
+        self.dynamic_shape = not isinstance(model_input.shape[2], int)
+        if not self.dynamic_shape:
+            self.image_size = (model_input.shape[2], model_input.shape[3])
+
+    def detect(
+        self, images: list[np.ndarray], stage_times: inference.StageTimes | None = None
+    ) -> list[inference.ColumnarDetections]:
+        """Runs the model on the given RGB images, see ``InferenceBackend.detect``."""
+        if not images:
+            return []
+        if not self.dynamic_batch:
+            return [self._detect_batch([img], stage_times)[0] for img in images]
+        return self._detect_batch(images, stage_times)
+
+    def _detect_batch(
+        self, images: list[np.ndarray], stage_times: inference.StageTimes | None
+    ) -> list[inference.ColumnarDetections]:
+        with inference.time_stage(stage_times, "preprocess"):
+            # Like ultralytics, a batch of same sized images is only padded to the stride.
+            same_shapes = len({img.shape for img in images}) == 1
+            stride = self.stride if self.dynamic_shape and same_shapes else None
+            letterboxed = [letterbox(img, self.image_size, stride) for img in images]
+
+            batch = np.stack([padded for padded, _, _ in letterboxed])
+            batch = np.ascontiguousarray(batch.transpose(0, 3, 1, 2), dtype=np.float32) / 255
+
+        with inference.time_stage(stage_times, "forward"):
+            (predictions,) = self.session.run(None, {self._input_name: batch})
+
+        with inference.time_stage(stage_times, "postprocess"):
+            return [
+                self._postprocess(pred, scale, padding, img.shape[:2])
+                for pred, (_, scale, padding), img in zip(
+                    predictions, letterboxed, images, strict=True
+                )
+            ]
+
+    def _postprocess(
+        self,
+        prediction: np.ndarray,
+        scale: tuple[float, float],
+        padding: tuple[int, int],
+        image_shape: tuple[int, ...],
+    ) -> inference.ColumnarDetections:
+        """
+        Turns the raw (4 + classes, anchors) output for one image into the kept detections
+        in the coordinates of the original image.
+        """
+        prediction = prediction.T
+        class_scores = prediction[:, 4:]
+        class_ids = class_scores.argmax(axis=1)
+        scores = class_scores[np.arange(len(class_scores)), class_ids]
+
+        candidates = scores > self.confidence_threshold
+        xyxy = boxes.xywh_to_xyxy(prediction[candidates, :4])
+        scores, class_ids = scores[candidates], class_ids[candidates]
+        keep = boxes.batched_nms(xyxy, scores, class_ids, self.iou_threshold)[:MAX_DETECTIONS]
+        xyxy, scores, class_ids = xyxy[keep], scores[keep], class_ids[keep]
+
+        xyxy = (xyxy - np.array([*padding, *padding])) / np.array([*scale, *scale])
+        height, width = image_shape
+        xyxy = xyxy.clip(0, [width, height, width, height])
+        return {
+            "boxes": xyxy.astype(np.float32),
+            "scores": scores.astype(np.float32),
+            "class_ids": class_ids.astype(np.int64),
+        }
+
+
+def load_backend(
+    model_path: pathlib.Path, device: str = "cpu", num_threads: int | None = None
+) -> InferenceBackend:
+    """
+    Loads the model at the given path with the backend for its file type.
+
+    Args:
+        model_path: The path to the model. ``.onnx`` models are run on ONNX Runtime,
+            and anything else through ultralytics.
+        device: The device to load an ultralytics model onto (defaults to CPU).
+            ONNX models always run on the CPU.
+        num_threads: The number of threads to run the model's operators on,
+            see ``tuning.ExecutionProfile``. If None, then the engine picks.
+
+    Returns:
+        The loaded backend.
+    """
+    if model_path.suffix == ".onnx":
+        logger.info("Loading onnx model: %s ...", model_path)
+        return OnnxBackend(model_path, num_threads=num_threads)
+    return UltralyticsBackend(
+        inference.load_ultralytics_yolo_model(model_path, device, num_threads=num_threads)
+    )
+
+
+def export_onnx(
+    model_path: pathlib.Path, image_size: int = inference.MODEL_IMAGE_SIZE
+) -> pathlib.Path:
+    """
+    Exports a trained ultralytics model to ONNX for the ``OnnxBackend``.
+
+    The exported model accepts any batch size and image shape.
+
+    Args:
+        model_path: The path to the trained ``.pt`` model.
+        image_size: The size of the images that the model was trained on.
+
+    Returns:
+        The path to the exported model, next to the original.
+    """
+    model = inference.load_ultralytics_yolo_model(model_path)
+    logger.info("Exporting %s to onnx ...", model_path)
+    return pathlib.Path(model.export(format="onnx", imgsz=image_size, dynamic=True))
@@ -0,0 +1,270 @@
+"""
+Dynamic micro-batching for the inference API.
+
+Concurrent requests are gathered into a single model call so that many small
+uploads share one forward pass instead of each paying for their own.
+"""
+
+import asyncio
+import concurrent.futures
+import contextlib
+import dataclasses
+import logging
+import time
+from collections.abc import Callable
+from typing import TypedDict
+
+import numpy as np
+
+from skysealand import inference
+
+logger = logging.getLogger(__name__)
+
+RunBatch = Callable[[list[np.ndarray], list[str]], inference.InferenceJsonOutput]
+
+
+class BatcherStats(TypedDict):
+    """Cumulative statistics about the batches that a ``MicroBatcher`` has run."""
+
+    num_batches: int
+    num_requests: int
+    num_images: int
+    mean_batch_fill_ratio: float
+    mean_queue_time_sec: float
+    max_queue_time_sec: float
+
+
+@dataclasses.dataclass
+class _PendingRequest:
+    images: list[np.ndarray]
+    filenames: list[str]
+    future: asyncio.Future[inference.InferenceJsonOutput]
+    enqueued_at: float
+
+
+class MicroBatcher:
+    """
+    Gathers images from concurrent requests into batches for a single model call.
+
+    A batch is dispatched once it holds ``max_batch_size`` images or once the oldest
+    request in it has waited ``max_wait_ms``, whichever happens first.
+    A single request with more images than ``max_batch_size`` is run as its own batch.
+
+    Args:
+        run_batch: The function that runs the model on a batch of images,
+            e.g. ``functools.partial(inference.run_model_with_timing, model)``.
+        max_batch_size: The maximum number of images to put into one batch.
+        max_wait_ms: The maximum time in milliseconds that a request waits
+            for other requests to join its batch.
+        executor: The executor to run ``run_batch`` on so that the event loop is not
+            blocked by the model. If None, then the default executor of the loop is used.
+        max_concurrent_batches: The most batches to run at the same time.
+            While all of them are running, new requests keep filling up the next batch.
+    """
+
+    def __init__(
+        self,
+        run_batch: RunBatch,
+        max_batch_size: int = 16,
+        max_wait_ms: float = 10.0,
+        executor: concurrent.futures.Executor | None = None,
+        max_concurrent_batches: int = 1,
+    ):
+        if max_batch_size < 1:
+            raise ValueError(f"max_batch_size must be positive, got {max_batch_size}")
+        if max_wait_ms < 0:
+            raise ValueError(f"max_wait_ms must not be negative, got {max_wait_ms}")
+        if max_concurrent_batches < 1:
+            raise ValueError(
+                f"max_concurrent_batches must be positive, got {max_concurrent_batches}"
+            )
+
+        self.max_batch_size = max_batch_size
+        self.max_wait_sec = max_wait_ms / 1000
+        self._run_batch = run_batch
+        self._executor = executor
+        self._max_concurrent_batches = max_concurrent_batches
+        self._slots: asyncio.Semaphore | None = None
+        self._running: set[asyncio.Task[None]] = set()
+        self._queue: asyncio.Queue[_PendingRequest] = asyncio.Queue()
+        self._carry: _PendingRequest | None = None
+        self._collecting: list[_PendingRequest] = []
+        self._worker: asyncio.Task[None] | None = None
+
+        self._num_batches = 0
+        self._num_requests = 0
+        self._num_images = 0
+        self._total_fill_ratio = 0.0
+        self._total_queue_time = 0.0
+        self._max_queue_time = 0.0
+
+    async def submit(
+        self, images: list[np.ndarray], filenames: list[str]
+    ) -> inference.InferenceJsonOutput:
+        """
+        Queues the images of one request and waits for their share of a batch.
+
+        Args:
+            images: The images to input to the model.
+            filenames: The names of the files that the images originated from.
+
+        Returns:
+            The inference output for only the given images.
+        """
+        if len(images) != len(filenames):
+            raise ValueError("Each image must have exactly one filename.")
+
+        if self._worker is None:
+            self._slots = asyncio.Semaphore(self._max_concurrent_batches)
+            self._worker = asyncio.create_task(self._process_batches())
+
+        future: asyncio.Future[inference.InferenceJsonOutput] = (
+            asyncio.get_running_loop().create_future()
+        )
+        await self._queue.put(_PendingRequest(images, filenames, future, time.perf_counter()))
+        return await future
+
+    async def close(self):
+        """
+        Stops the batching worker.
+
+        Batches that are already running are allowed to finish,
+        but requests that are still queued are cancelled.
+        """
+        if self._worker is not None:
+            self._worker.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._worker
+            self._worker = None
+        if self._running:
+            await asyncio.wait(self._running)
+
+        pending = [*self._collecting, *([self._carry] if self._carry is not None else [])]
+        while not self._queue.empty():
+            pending.append(self._queue.get_nowait())
+        for request in pending:
+            request.future.cancel()
+        self._carry = None
+        self._collecting = []
+
+    def stats(self) -> BatcherStats:
+        """Returns the cumulative batching statistics."""
+        num_batches = max(self._num_batches, 1)
+        num_requests = max(self._num_requests, 1)
+        return {
+            "num_batches": self._num_batches,
+            "num_requests": self._num_requests,
+            "num_images": self._num_images,
+            "mean_batch_fill_ratio": self._total_fill_ratio / num_batches,
+            "mean_queue_time_sec": self._total_queue_time / num_requests,
+            "max_queue_time_sec": self._max_queue_time,
+        }
+
+    async def _next_request(self, timeout: float | None) -> _PendingRequest | None:
+        if self._carry is not None:
+            request, self._carry = self._carry, None
+            return request
+        if timeout is None:
+            return await self._queue.get()
+        if timeout <= 0:
+            # Out of time to wait, but requests that are already queued can still join.
+            try:
+                return self._queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return None
+        try:
+            return await asyncio.wait_for(self._queue.get(), timeout)
+        except TimeoutError:
+            return None
+
+    async def _collect_batch(self) -> list[_PendingRequest]:
+        first = await self._next_request(timeout=None)
+        assert first is not None
+        batch = self._collecting = [first]
+        num_images = len(first.images)
+        deadline = first.enqueued_at + self.max_wait_sec
+
+        while num_images < self.max_batch_size:
+            request = await self._next_request(timeout=deadline - time.perf_counter())
+            if request is None:
+                break
+            if num_images + len(request.images) > self.max_batch_size:
+                # Keep it for the next batch so that this one stays within the limit.
+                self._carry = request
+                break
+            batch.append(request)
+            num_images += len(request.images)
+
+        self._collecting = []
+        return batch
+
+    async def _process_batches(self):
+        assert self._slots is not None
+        while True:
+            # Wait for a free slot *before* collecting so requests pile into the next batch.
+            await self._slots.acquire()
+            try:
+                batch = await self._collect_batch()
+            except asyncio.CancelledError:
+                self._slots.release()
+                raise
+            task = asyncio.create_task(self._run(batch))
+            self._running.add(task)
+            task.add_done_callback(self._on_batch_done)
+
+    def _on_batch_done(self, task: asyncio.Task[None]):
+        assert self._slots is not None
+        self._running.discard(task)
+        self._slots.release()
+
+    async def _run(self, batch: list[_PendingRequest]):
+        images = [img for request in batch for img in request.images]
+        filenames = [name for request in batch for name in request.filenames]
+        fill_ratio = len(images) / self.max_batch_size
+        started_at = time.perf_counter()
+        queue_times = [started_at - request.enqueued_at for request in batch]
+
+        logger.info(
+            "Running batch | requests=%d | images=%d | fill_ratio=%.2f | max_queue_time=%.3fs",
+            len(batch),
+            len(images),
+            fill_ratio,
+            max(queue_times),
+        )
+
+        self._num_batches += 1
+        self._num_requests += len(batch)
+        self._num_images += len(images)
+        self._total_fill_ratio += fill_ratio
+        self._total_queue_time += sum(queue_times)
+        self._max_queue_time = max(self._max_queue_time, *queue_times)
+
+        try:
+            output = await asyncio.get_running_loop().run_in_executor(
+                self._executor, self._run_batch, images, filenames
+            )
+        except Exception as e:
+            for request in batch:
+                if not request.future.done():
+                    request.future.set_exception(e)
+            return
+
+        stage_times = output["metrics"].get("stage_times_sec")
+        start = 0
+        for request, queue_time in zip(batch, queue_times, strict=True):
+            end = start + len(request.images)
+            if not request.future.done():
+                metrics: inference.InferenceMetaData = {
+                    "num_images": end - start,
+                    "inference_time_sec": output["metrics"]["inference_time_sec"],
+                    "queue_time_sec": queue_time,
+                    "batch_size": len(images),
+                    "batch_fill_ratio": fill_ratio,
+                }
+                if stage_times is not None:
+                    # Every request in the batch shared the same model call.
+                    metrics["stage_times_sec"] = {**stage_times}
+                request.future.set_result(
+                    {"results": output["results"][start:end], "metrics": metrics}
+                )
+            start = end
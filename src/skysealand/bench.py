@@ -0,0 +1,317 @@
+"""
+Throughput and latency benchmarks on synthetic images.
+
+``run_benchmarks`` sweeps the batch size, image resolution, number of decode threads
+and model backend over the hot paths of inference:
+
+- ``load_images``: Decoding JPEG files into images.
+- ``run_model_with_timing``: The model, including its pre- and post-processing.
+- ``process_ultralytics_yolo_batched_detections``: Converting ultralytics results
+  into our API format.
+
+The report is written as json with stable keys, so that the reports of two releases
+can be diffed, or checked for regressions with ``compare``.
+"""
+
+import datetime as dt
+import functools
+import json
+import logging
+import os
+import pathlib
+import platform
+import tempfile
+import time
+from collections.abc import Callable
+from typing import TypedDict
+
+import cv2
+import numpy as np
+import torch
+from PIL import Image
+from ultralytics.engine.results import Results
+
+from skysealand import backends, inference
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZES = (1, 8, 16)
+# The widths of the synthetic images. They are 4:3, like most camera images.
+RESOLUTIONS = (640, 1920)
+DECODE_WORKERS = (1, 4)
+# How many times each configuration is timed, after one untimed warm up run.
+REPEATS = 10
+# How many boxes each synthetic ultralytics result holds.
+DETECTIONS_PER_IMAGE = 20
+NUM_CLASSES = 80
+
+
+class BenchmarkResult(TypedDict):
+    benchmark: str
+    params: dict[str, int | str]
+    images_per_sec: float
+    p50_ms: float
+    p95_ms: float
+    p99_ms: float
+
+
+class BenchmarkReport(TypedDict):
+    environment: dict[str, str | int]
+    results: list[BenchmarkResult]
+
+
+def synthetic_image(resolution: int, rng: np.random.Generator) -> np.ndarray:
+    """
+    Makes a 4:3 RGB image that is ``resolution`` pixels wide.
+
+    The image is smooth blobs of color with some noise, so that it compresses
+    about as well as a real photo instead of as well as pure noise or a flat color.
+    """
+    width, height = resolution, resolution * 3 // 4
+    coarse = rng.integers(0, 256, (max(height // 32, 2), max(width // 32, 2), 3), dtype=np.uint8)
+    image = cv2.resize(coarse, (width, height), interpolation=cv2.INTER_CUBIC)
+    noise = rng.integers(-8, 9, image.shape, dtype=np.int16)
+    return np.clip(image.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+
+
+def write_synthetic_images(
+    directory: pathlib.Path, num_images: int, resolution: int, seed: int = 0
+) -> list[pathlib.Path]:
+    """
+    Writes synthetic JPEG images, see ``synthetic_image``.
+
+    Args:
+        directory: The directory to write the images to.
+        num_images: The number of images to write.
+        resolution: The width of the images.
+        seed: The seed of the random images, so that every run benchmarks the same images.
+
+    Returns:
+        The paths to the images.
+    """
+    rng = np.random.default_rng(seed)
+    directory.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for i in range(num_images):
+        path = directory / f"synthetic_{resolution}_{i}.jpg"
+        Image.fromarray(synthetic_image(resolution, rng)).save(path, quality=90)
+        paths.append(path)
+    return paths
+
+
+def synthetic_results(
+    batch_size: int,
+    resolution: int,
+    detections_per_image: int = DETECTIONS_PER_IMAGE,
+    seed: int = 0,
+) -> list[Results]:
+    """Makes ultralytics results with random boxes, like those of a batch of images."""
+    rng = np.random.default_rng(seed)
+    width, height = resolution, resolution * 3 // 4
+    image = np.zeros((height, width, 3), dtype=np.uint8)
+    names = {i: str(i) for i in range(NUM_CLASSES)}
+    results = []
+    for i in range(batch_size):
+        top_left = rng.uniform(0, [width / 2, height / 2], (detections_per_image, 2))
+        size = rng.uniform(8, [width / 2, height / 2], (detections_per_image, 2))
+        confidence = rng.uniform(0.25, 1, (detections_per_image, 1))
+        class_id = rng.integers(0, NUM_CLASSES, (detections_per_image, 1))
+        data = np.hstack([top_left, top_left + size, confidence, class_id]).astype(np.float32)
+        results.append(Results(image, f"{i}.jpg", names, boxes=torch.from_numpy(data)))
+    return results
+
+
+def time_calls(function: Callable[[], object], repeats: int = REPEATS) -> list[float]:
+    """Times repeated calls of the function in seconds, after one untimed warm up call."""
+    function()
+    durations = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def summarize(
+    benchmark: str, params: dict[str, int | str], durations: list[float], num_images: int
+) -> BenchmarkResult:
+    """
+    Summarizes the timings of a benchmark.
+
+    Args:
+        benchmark: The name of the function that was benchmarked.
+        params: The configuration that it was benchmarked with.
+        durations: How long each call took in seconds.
+        num_images: How many images each call handled.
+
+    Returns:
+        The throughput and latency percentiles of the calls.
+    """
+    p50, p95, p99 = np.percentile(durations, [50, 95, 99]) * 1000
+    result: BenchmarkResult = {
+        "benchmark": benchmark,
+        "params": params,
+        "images_per_sec": num_images * len(durations) / sum(durations),
+        "p50_ms": float(p50),
+        "p95_ms": float(p95),
+        "p99_ms": float(p99),
+    }
+    logger.info(
+        "%s %s | images/sec=%.1f | p50=%.1fms | p99=%.1fms",
+        benchmark,
+        params,
+        result["images_per_sec"],
+        result["p50_ms"],
+        result["p99_ms"],
+    )
+    return result
+
+
+def _environment() -> dict[str, str | int]:
+    return {
+        "created_at": dt.datetime.now(dt.UTC).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count() or 1,
+        "torch_threads": torch.get_num_threads(),
+    }
+
+
+def run_benchmarks(  # noqa: PLR0913
+    model_paths: list[pathlib.Path],
+    *,
+    batch_sizes: tuple[int, ...] = BATCH_SIZES,
+    resolutions: tuple[int, ...] = RESOLUTIONS,
+    decode_workers: tuple[int, ...] = DECODE_WORKERS,
+    repeats: int = REPEATS,
+    model_loader: Callable[[pathlib.Path], object] = backends.load_backend,
+) -> BenchmarkReport:
+    """
+    Benchmarks every combination of the given settings on synthetic images.
+
+    Args:
+        model_paths: The models to benchmark, e.g. the ``.pt`` model and its ``.onnx`` export,
+            to compare their backends.
+        batch_sizes: The numbers of images to handle at once.
+        resolutions: The widths of the images.
+        decode_workers: The numbers of threads to decode images with.
+        repeats: How many times each configuration is timed.
+        model_loader: The function that loads each model.
+
+    Returns:
+        The environment that the benchmarks ran in and their results.
+    """
+    models = {path.name: model_loader(path) for path in model_paths}
+    results: list[BenchmarkResult] = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for resolution in resolutions:
+            paths = write_synthetic_images(
+                pathlib.Path(tmp_dir), max(batch_sizes), resolution, seed=resolution
+            )
+            images, filenames = inference.load_images(*paths)
+
+            for batch_size in batch_sizes:
+                params: dict[str, int | str] = {"batch_size": batch_size, "resolution": resolution}
+                for num_workers in decode_workers:
+                    load = functools.partial(
+                        inference.load_images, *paths[:batch_size], num_workers=num_workers
+                    )
+                    results.append(
+                        summarize(
+                            "load_images",
+                            {**params, "decode_workers": num_workers},
+                            time_calls(load, repeats),
+                            batch_size,
+                        )
+                    )
+
+                for name, model in models.items():
+                    run = functools.partial(
+                        inference.run_model_with_timing,
+                        model,
+                        images[:batch_size],
+                        filenames[:batch_size],
+                    )
+                    results.append(
+                        summarize(
+                            "run_model_with_timing",
+                            {**params, "model": name, "backend": type(model).__name__},
+                            time_calls(run, repeats),
+                            batch_size,
+                        )
+                    )
+
+                process = functools.partial(
+                    inference.process_ultralytics_yolo_batched_detections,
+                    synthetic_results(batch_size, resolution),
+                )
+                results.append(
+                    summarize(
+                        "process_ultralytics_yolo_batched_detections",
+                        {**params, "detections_per_image": DETECTIONS_PER_IMAGE},
+                        time_calls(process, repeats),
+                        batch_size,
+                    )
+                )
+
+    return {"environment": _environment(), "results": results}
+
+
+def save_report(report: BenchmarkReport, path: pathlib.Path):
+    """Writes the report as json that diffs cleanly against other reports."""
+    path.write_text(json.dumps(report, indent=2, sort_keys=True) + "\n")
+
+
+def load_report(path: pathlib.Path) -> BenchmarkReport:
+    return json.loads(path.read_text())
+
+
+def _result_key(result: BenchmarkResult) -> str:
+    return json.dumps([result["benchmark"], result["params"]], sort_keys=True)
+
+
+def compare(
+    baseline: BenchmarkReport, current: BenchmarkReport, tolerance: float = 0.1
+) -> list[str]:
+    """
+    Finds the benchmarks whose throughput dropped compared to a baseline.
+
+    Args:
+        baseline: The report of an earlier run, e.g. of the previous release.
+        current: The report of this run.
+        tolerance: The fraction that the throughput may drop by before it is a regression.
+
+    Returns:
+        A description of each regression. Benchmarks that are only in one report are ignored.
+    """
+    baseline_results = {_result_key(result): result for result in baseline["results"]}
+    regressions = []
+    for result in current["results"]:
+        before = baseline_results.get(_result_key(result))
+        if before is None:
+            continue
+        change = result["images_per_sec"] / before["images_per_sec"] - 1
+        if change < -tolerance:
+            regressions.append(
+                f"{result['benchmark']} {result['params']}: "
+                f"{before['images_per_sec']:.1f} -> {result['images_per_sec']:.1f} images/sec "
+                f"({change:+.0%})"
+            )
+    return regressions
+
+
+def format_report(report: BenchmarkReport) -> str:
+    """Lays out the results as a table."""
+    lines = [
+        (
+            f"{'benchmark':<45} {'params':<80} {'images/sec':>10} "
+            f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"
+        )
+    ]
+    for result in report["results"]:
+        params = ", ".join(f"{key}={value}" for key, value in result["params"].items())
+        lines.append(
+            f"{result['benchmark']:<45} {params:<80} {result['images_per_sec']:>10.1f} "
+            f"{result['p50_ms']:>8.2f} {result['p95_ms']:>8.2f} {result['p99_ms']:>8.2f}"
+        )
+    return "\n".join(lines)
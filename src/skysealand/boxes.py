@@ -0,0 +1,85 @@
+"""
+Vectorized NumPy operations on (N, 4) arrays of ``(x_min, y_min, x_max, y_max)`` boxes.
+"""
+
+import numpy as np
+
+
+def xywh_to_xyxy(boxes: np.ndarray) -> np.ndarray:
+    """Converts ``(x_center, y_center, width, height)`` boxes into corner coordinates."""
+    xy = boxes[:, :2]
+    half_wh = boxes[:, 2:4] / 2
+    return np.concatenate([xy - half_wh, xy + half_wh], axis=1)
+
+
+def box_area(boxes: np.ndarray) -> np.ndarray:
+    """The area of each box."""
+    return (boxes[:, 2] - boxes[:, 0]).clip(0) * (boxes[:, 3] - boxes[:, 1]).clip(0)
+
+
+def pairwise_iou(boxes_a: np.ndarray, boxes_b: np.ndarray) -> np.ndarray:
+    """
+    The intersection over union of every pair of boxes.
+
+    Args:
+        boxes_a: (N, 4) array of boxes.
+        boxes_b: (M, 4) array of boxes.
+
+    Returns:
+        (N, M) array of the IoU of each box in ``boxes_a`` with each box in ``boxes_b``.
+    """
+    top_left = np.maximum(boxes_a[:, None, :2], boxes_b[None, :, :2])
+    bottom_right = np.minimum(boxes_a[:, None, 2:], boxes_b[None, :, 2:])
+    intersection = (bottom_right - top_left).clip(0).prod(axis=2)
+    union = box_area(boxes_a)[:, None] + box_area(boxes_b)[None, :] - intersection
+    return intersection / np.maximum(union, np.finfo(np.float32).eps)
+
+
+def nms(boxes: np.ndarray, scores: np.ndarray, iou_threshold: float) -> np.ndarray:
+    """
+    Greedy non-maximum suppression.
+
+    Boxes are kept from the highest score down, dropping every box that overlaps
+    an already kept box by more than ``iou_threshold``.
+
+    Args:
+        boxes: (N, 4) array of boxes.
+        scores: (N,) array of the score of each box.
+        iou_threshold: The IoU above which the lower scoring box is dropped.
+
+    Returns:
+        The indices of the kept boxes, from the highest score down.
+    """
+    order = np.argsort(-scores, kind="stable")
+    keep: list[int] = []
+    while order.size:
+        best = order[0]
+        keep.append(int(best))
+        rest = order[1:]
+        ious = pairwise_iou(boxes[best : best + 1], boxes[rest])[0]
+        order = rest[ious <= iou_threshold]
+    return np.array(keep, dtype=np.int64)
+
+
+def batched_nms(
+    boxes: np.ndarray, scores: np.ndarray, class_ids: np.ndarray, iou_threshold: float
+) -> np.ndarray:
+    """
+    Non-maximum suppression that only suppresses boxes of the same class.
+
+    Args:
+        boxes: (N, 4) array of boxes.
+        scores: (N,) array of the score of each box.
+        class_ids: (N,) array of the class of each box.
+        iou_threshold: The IoU above which the lower scoring box is dropped.
+
+    Returns:
+        The indices of the kept boxes, from the highest score down.
+    """
+    if boxes.size == 0:
+        return np.empty(0, dtype=np.int64)
+    # Move the boxes of each class far enough apart that different classes never overlap.
+    # In float64 so that the offsets don't cost the boxes any precision.
+    boxes = boxes.astype(np.float64)
+    offsets = class_ids.astype(np.float64)[:, None] * (boxes.max() - boxes.min() + 1)
+    return nms(boxes + offsets, scores, iou_threshold)
@@ -2,15 +2,28 @@
 The command line interface for the project.
 """
 
-import json
+import asyncio
+import functools
 import logging
 import pathlib
 
 import typer
 
-from skysealand import inference, logging_setup
+from skysealand import (
+    backends,
+    bench,
+    inference,
+    loadtest,
+    logging_setup,
+    pipeline,
+    serialization,
+    tuning,
+    video,
+)
 from skysealand.dataset import download as data_download
-from skysealand.dataset import validation
+from skysealand.dataset import index as data_index
+from skysealand.dataset import load, validation
+from skysealand.train import quantize as train_quantize
 from skysealand.train import yolo_baseline
 
 logger = logging.getLogger(__name__)
@@ -20,16 +33,92 @@ app = typer.Typer()
 
 
 @app.command()
-def download():
-    """Download the dataset"""
+def download(
+    jobs: int | None = None,
+    image_check: validation.ImageCheck = validation.ImageCheck.VERIFY,
+):
+    """
+    Download the dataset
+
+    Args:
+        jobs: The number of processes to validate the dataset with. Defaults to one per core.
+        image_check: How thoroughly to check the images, see ``validate``. Defaults to "verify".
+    """
     logging_setup.setup_logging()
 
     data_download.download()
     data_download.extract()
-    validation.validate_all_data()
+    validation.validate_all_data(jobs=jobs, image_check=image_check)
     logger.info("Done with download!")
 
 
+@app.command()
+def validate(
+    dataset_config: str = "data/data.yaml",
+    report_path: str = "data/validation_report.json",
+    jobs: int | None = None,
+    incremental: bool = True,
+    hash_contents: bool = False,
+    image_check: validation.ImageCheck = validation.ImageCheck.VERIFY,
+    deep_sample: float = 1.0,
+):
+    """
+    Validate the images and annotations of every split of the dataset.
+
+    Args:
+        dataset_config: The path to the config summary yaml file for the dataset.
+            Defaults to "data/data.yaml".
+        report_path: The path to write the json validation report to.
+            Defaults to "data/validation_report.json".
+        jobs: The number of processes to validate with. Defaults to one per core.
+        incremental: Whether to only re-validate the files that were added or changed since
+            the last validation, see ``validation.validate_all_data``. Defaults to true.
+        hash_contents: Whether to compare the contents of files whose modification time
+            changed before re-validating them. Defaults to false.
+        image_check: How thoroughly to check the images. "probe" only reads their headers
+            and checks that they are not truncated, "verify" also checks their structure
+            with pillow, and "deep" fully decodes them. Defaults to "verify".
+        deep_sample: With "deep", the fraction of the images to fully decode, e.g. 0.1.
+            The same images are picked on every run. Defaults to 1, every image.
+    """
+    logging_setup.setup_logging()
+
+    validation.validate_all_data(
+        pathlib.Path(dataset_config),
+        pathlib.Path(report_path),
+        jobs=jobs,
+        incremental=incremental,
+        hash_contents=hash_contents,
+        image_check=image_check,
+        deep_sample=deep_sample,
+    )
+    logger.info("Done with validation!")
+
+
+@app.command()
+def index(dataset_config: str = "data/data.yaml", more_boxes_than: int | None = None):
+    """
+    Build or refresh the dataset index, and print a summary of the splits.
+
+    The index is kept next to the dataset config, and only the files that were added or
+    changed since it was last refreshed are read again.
+
+    Args:
+        dataset_config: The path to the config summary yaml file for the dataset.
+            Defaults to "data/data.yaml".
+        more_boxes_than: If given, also print the paths of the images with more boxes than this.
+    """
+    logging_setup.setup_logging()
+
+    config_path = pathlib.Path(dataset_config)
+    class_names = load.load_dataset_config(config_path).get("names")
+    with data_index.open_index(config_path) as dataset_index:
+        typer.echo(data_index.format_summary(dataset_index, class_names))
+        if more_boxes_than is not None:
+            for path in dataset_index.image_paths(more_boxes_than=more_boxes_than):
+                typer.echo(path)
+
+
 @app.command()
 def train():
     """Train the model"""
@@ -39,6 +128,66 @@ def train():
     logger.info("Done with training!")
 
 
+@app.command()
+def export(model_path: str = "yolov8n.pt", image_size: int = inference.MODEL_IMAGE_SIZE):
+    """
+    Export a trained model to ONNX, for faster inference on the CPU.
+
+    Args:
+        model_path: The path to the trained model. Defaults to "yolov8n.pt".
+        image_size: The size of the images that the model was trained on. Defaults to 640.
+    """
+    logging_setup.setup_logging()
+
+    onnx_path = backends.export_onnx(pathlib.Path(model_path), image_size=image_size)
+    logger.info("Done with export! Use it with `skysealand infer --model-path %s`", onnx_path)
+
+
+@app.command()
+def quantize(
+    model_path: str = "yolov8n.pt",
+    mode: train_quantize.QuantizationMode = train_quantize.QuantizationMode.STATIC,
+    dataset_config: str = "data/data.yaml",
+    num_calibration_images: int = 100,
+    report: bool = True,
+):
+    """
+    Quantize a trained model to INT8, for faster inference on CPU-only machines.
+
+    Serve the quantized model by passing it to ``skysealand infer --model-path``.
+
+    Args:
+        model_path: The path to the trained model. Defaults to "yolov8n.pt".
+        mode: Whether to quantize statically (calibrated on the training split)
+            or dynamically. Defaults to static.
+        dataset_config: The path to the config summary yaml file for the dataset.
+            Defaults to "data/data.yaml".
+        num_calibration_images: The number of training images to calibrate with.
+            Defaults to 100.
+        report: Whether to compare the mAP@0.5 and images/sec of the quantized model
+            against the FP32 model on the validation split. Defaults to true.
+    """
+    logging_setup.setup_logging()
+
+    fp32_path = pathlib.Path(model_path)
+    if fp32_path.suffix != ".onnx":
+        fp32_path = backends.export_onnx(fp32_path)
+    int8_path = train_quantize.quantize(
+        fp32_path,
+        mode,
+        dataset_config_path=pathlib.Path(dataset_config),
+        num_calibration_images=num_calibration_images,
+    )
+    logger.info("Done with quantization! Use it with `skysealand infer --model-path %s`", int8_path)
+
+    if report:
+        reports = [
+            train_quantize.evaluate(path, pathlib.Path(dataset_config))
+            for path in (fp32_path, int8_path)
+        ]
+        typer.echo(train_quantize.format_report(reports))
+
+
 def _get_image_paths_from_directory(images_dir: str) -> list[pathlib.Path]:
     dir_path = pathlib.Path(images_dir)
     if not dir_path.is_dir():
@@ -62,6 +211,16 @@ def infer(
     model_path: str = "yolov8n.pt",
     output_path: str = "inference.json",
     skip_image_errors: bool = True,
+    batch_size: int | None = None,
+    prefetch_batches: int = 2,
+    decode_workers: int | None = None,
+    output_format: serialization.OutputFormat = serialization.OutputFormat.JSON,
+    resume: bool = False,
+    cache: bool = False,
+    cache_dir: str | None = None,
+    tile_size: int | None = None,
+    tile_overlap: int = inference.TILE_OVERLAP,
+    profile: str | None = None,
 ):
     """
     Run inference on a batch of image paths.
@@ -69,17 +228,51 @@ def infer(
     Writes the result to the specified ``output_path`` location as a json file.
     This file has the structure of ``{'filename': ..., 'inference': ...}``.
     See ``inference.Detection`` for more details.
+    The same output can be written in a compact binary format instead,
+    see ``serialization`` for more details.
+
+    The images are streamed through the model in batches, so memory use does not
+    grow with the number of images and results are written as each batch finishes.
 
     Args:
         images: A list of image paths to perform inference on.
         images_dir: A directory containing images to perform inference on.
         model_path: The path to the model to use for inference. Defaults to "yolov8n.pt"
             (The result of performing the default training).
+            Models exported with ``skysealand export`` are run on ONNX Runtime.
         output_path: The path to the output file to write. Defaults to "inference.json"
         skip_image_errors: Whether to skip errors with loading images or not. Defaults to true.
+        batch_size: The number of images to run through the model at once.
+            Defaults to the execution profile's, 16 unless it is set.
+        prefetch_batches: The number of batches to decode ahead of the model. Defaults to 2.
+        decode_workers: The number of threads to decode images with.
+            Defaults to the execution profile's, 4 unless it is set.
+        output_format: The format to write the output file in. Defaults to json.
+            Use ndjson for long runs, since it writes each result as soon as it is ready.
+        resume: Whether to continue a previous ndjson run by skipping the images
+            that already have results in the output file. Defaults to false.
+        cache: Whether to run the model only once for images with identical contents.
+            Defaults to false.
+        cache_dir: A directory to keep the cached results in across runs.
+            Implies ``cache``.
+        tile_size: If given, run the model on overlapping tiles of this many pixels
+            of each full resolution image instead of on the downscaled image,
+            to find small objects in very large images. The images are then decoded one
+            at a time, ``batch_size`` counts tiles, and ``prefetch_batches`` counts images.
+        tile_overlap: How many pixels neighbouring tiles overlap by. Defaults to 64.
+        profile: The execution profile to run with, e.g. one written by ``skysealand tune``.
+            Defaults to the file in the ``SKYSEALAND_PROFILE`` environment variable, if any,
+            see ``tuning.load_profile``.
     """
     logging_setup.setup_logging()
 
+    execution_profile = tuning.load_profile(None if profile is None else pathlib.Path(profile))
+    tuning.apply_profile(execution_profile)
+    if batch_size is None:
+        batch_size = execution_profile.batch_size
+    if decode_workers is None:
+        decode_workers = execution_profile.decode_workers
+
     if (images is None) == (images_dir is None):
         raise ValueError("Either `images` or `images_dir` must be provided (not both or neither).")
 
@@ -91,14 +284,280 @@ def infer(
     if not image_paths:
         raise ValueError("No images found to process.")
 
-    image_arrays, names = inference.load_images(*image_paths, skip_errors=skip_image_errors)
-    to_write = inference.run_model_with_timing(
-        inference.load_ultralytics_yolo_model(pathlib.Path(model_path)),
-        image_arrays,
-        names,
+    if resume:
+        if output_format != serialization.OutputFormat.NDJSON:
+            raise ValueError("`--resume` requires `--output-format ndjson`.")
+        completed = pipeline.read_completed_filenames(pathlib.Path(output_path))
+        image_paths = [p for p in image_paths if str(p) not in completed]
+        logger.info("Resuming with %d images left to process.", len(image_paths))
+
+    model = backends.load_backend(
+        pathlib.Path(model_path), num_threads=execution_profile.model_threads()
     )
+    detection_cache = None
+    if cache or cache_dir is not None:
+        # Only hashed when caching, since it reads the whole weights file.
+        fingerprint = inference.model_fingerprint(pathlib.Path(model_path))
+        if tile_size is not None:
+            # Tiling finds different boxes, so don't share cached results with untiled runs.
+            fingerprint = f"{fingerprint}-tiles-{tile_size}-{tile_overlap}"
+        detection_cache = inference.DetectionCache(
+            fingerprint, disk_dir=None if cache_dir is None else pathlib.Path(cache_dir)
+        )
 
-    logger.info("Writing output file @ %s ...", output_path)
-    with pathlib.Path(output_path).open("w") as write_file:
-        json.dump(to_write, write_file, indent=4)
+    logger.info("Writing %s output file @ %s ...", output_format.value, output_path)
+    with pipeline.open_result_writer(
+        pathlib.Path(output_path), output_format, append=resume
+    ) as writer:
+        if tile_size is None:
+            pipeline.run_streaming_inference(
+                functools.partial(inference.run_model_with_timing, model),
+                image_paths,
+                writer,
+                batch_size=batch_size,
+                max_prefetch=prefetch_batches,
+                skip_errors=skip_image_errors,
+                decode_workers=decode_workers,
+                cache=detection_cache,
+            )
+        else:
+            pipeline.run_tiled_streaming_inference(
+                model,
+                image_paths,
+                writer,
+                tile_size=tile_size,
+                overlap=tile_overlap,
+                batch_size=batch_size,
+                max_prefetch=prefetch_batches,
+                skip_errors=skip_image_errors,
+                cache=detection_cache,
+            )
+    if detection_cache is not None:
+        logger.info("Detection cache stats: %s", detection_cache.stats())
     logger.info("Done with inference!")
+
+
+@app.command(name="infer-video")
+def infer_video(
+    video_path: str,
+    model_path: str = "yolov8n.pt",
+    output_path: str = "inference.ndjson",
+    batch_size: int | None = None,
+    stride: int = 1,
+    diff_threshold: float | None = None,
+    max_queued_frames: int = video.MAX_QUEUED_FRAMES,
+    profile: str | None = None,
+):
+    """
+    Run inference on the frames of a video file.
+
+    Writes one ndjson line per frame to ``output_path`` as soon as its detections are known,
+    with the frame's ``frame_index`` and ``timestamp_sec``, followed by a line of metrics.
+
+    Args:
+        video_path: The path to the video file, in any format that OpenCV can read.
+        model_path: The path to the model to use for inference. Defaults to "yolov8n.pt".
+        output_path: The path to the ndjson output file to write. Defaults to "inference.ndjson".
+        batch_size: The number of frames to run through the model at once.
+            Defaults to the execution profile's, 16 unless it is set.
+        stride: Only run every ``stride``-th frame, skipping the others entirely.
+            Defaults to 1, running every frame.
+        diff_threshold: If given, frames whose mean difference from the last frame that was run,
+            from 0 to 1 on a tiny grayscale thumbnail, is below this reuse its detections.
+            E.g. 0.02 for a fixed camera.
+        max_queued_frames: The number of decoded frames that may wait for the model.
+            Defaults to 64.
+        profile: The execution profile to run with, see ``skysealand infer``.
+    """
+    logging_setup.setup_logging()
+
+    execution_profile = tuning.load_profile(None if profile is None else pathlib.Path(profile))
+    tuning.apply_profile(execution_profile)
+    model = backends.load_backend(
+        pathlib.Path(model_path), num_threads=execution_profile.model_threads()
+    )
+
+    logger.info("Writing ndjson output file @ %s ...", output_path)
+    with pathlib.Path(output_path).open("w") as f:
+        metrics = video.run_video_inference(
+            functools.partial(inference.run_model_with_timing, model),
+            pathlib.Path(video_path),
+            pipeline.NdjsonResultWriter(f),
+            batch_size=batch_size if batch_size is not None else execution_profile.batch_size,
+            stride=stride,
+            diff_threshold=diff_threshold,
+            max_queued_frames=max_queued_frames,
+        )
+    logger.info(
+        "Done with inference on %d frames, %d of them reused!",
+        metrics.get("num_frames", 0),
+        metrics.get("reused_frames", 0),
+    )
+
+
+@app.command(name="bench")
+def bench_command(
+    model_path: list[str] = typer.Option(["yolov8n.pt"], help="Models to benchmark"),
+    batch_size: list[int] = typer.Option(list(bench.BATCH_SIZES), help="Batch sizes to sweep"),
+    resolution: list[int] = typer.Option(list(bench.RESOLUTIONS), help="Image widths to sweep"),
+    decode_workers: list[int] = typer.Option(
+        list(bench.DECODE_WORKERS), help="Decode thread counts to sweep"
+    ),
+    repeats: int = bench.REPEATS,
+    output_path: str = "bench.json",
+    baseline: str | None = None,
+    tolerance: float = 0.1,
+):
+    """
+    Benchmark the throughput and latency of decoding, the model and postprocessing
+    on synthetic images.
+
+    Every option that takes a list can be repeated, e.g. ``--batch-size 1 --batch-size 16``.
+
+    Args:
+        model_path: The models to benchmark. Pass a ``.pt`` model and its ``.onnx`` export
+            to compare the backends. Defaults to "yolov8n.pt".
+        batch_size: The numbers of images to handle at once. Defaults to 1, 8 and 16.
+        resolution: The widths of the synthetic 4:3 images. Defaults to 640 and 1920.
+        decode_workers: The numbers of threads to decode images with. Defaults to 1 and 4.
+        repeats: How many times each configuration is timed. Defaults to 10.
+        output_path: The path to write the json report to. Defaults to "bench.json".
+        baseline: The report of an earlier run to check for regressions against.
+            Exits with an error if any benchmark got slower by more than ``tolerance``.
+        tolerance: The fraction that the throughput may drop by before it counts
+            as a regression. Defaults to 0.1.
+    """
+    logging_setup.setup_logging()
+
+    report = bench.run_benchmarks(
+        [pathlib.Path(path) for path in model_path],
+        batch_sizes=tuple(batch_size),
+        resolutions=tuple(resolution),
+        decode_workers=tuple(decode_workers),
+        repeats=repeats,
+    )
+    bench.save_report(report, pathlib.Path(output_path))
+    typer.echo(bench.format_report(report))
+    logger.info("Wrote the benchmark report to %s", output_path)
+
+    if baseline is not None:
+        regressions = bench.compare(
+            bench.load_report(pathlib.Path(baseline)), report, tolerance=tolerance
+        )
+        for regression in regressions:
+            typer.echo(f"Regression: {regression}", err=True)
+        if regressions:
+            raise typer.Exit(code=1)
+        logger.info("No regressions against %s", baseline)
+
+
+@app.command(name="loadtest")
+def loadtest_command(
+    url: str | None = None,
+    model_path: str | None = None,
+    concurrency: list[int] = typer.Option(
+        list(loadtest.CONCURRENCY_LEVELS), help="Concurrency levels to try"
+    ),
+    duration: float = loadtest.DURATION_SEC,
+    rate: float | None = None,
+    images_per_request: int = loadtest.IMAGES_PER_REQUEST,
+    resolution: list[int] = typer.Option(
+        list(loadtest.RESOLUTIONS), help="Widths of the uploaded images"
+    ),
+    unique_images: bool = True,
+    output_path: str = "loadtest.json",
+):
+    """
+    Load test the inference API with concurrent uploads of synthetic images.
+
+    Every option that takes a list can be repeated, e.g. ``--concurrency 1 --concurrency 8``.
+
+    Args:
+        url: The base URL of a running server, e.g. "http://127.0.0.1:8000".
+            Defaults to running the app in this process.
+        model_path: The model to serve when the app runs in this process.
+            Defaults to the models configured in ``skysealand/api.py``.
+        concurrency: The numbers of concurrent requests to try, in increasing order.
+            Defaults to 1, 2, 4, 8 and 16.
+        duration: How many seconds to run each concurrency level for. Defaults to 10.
+        rate: If given, start this many requests per second instead of sending them
+            back to back, and measure latency from when each request was due.
+        images_per_request: How many images to upload in each request. Defaults to 1.
+        resolution: The widths of the synthetic 4:3 images. Defaults to 1280.
+        unique_images: Whether to make every upload unique so that the server's
+            detection cache cannot answer them. Defaults to true.
+        output_path: The path to write the json report to. Defaults to "loadtest.json".
+    """
+    logging_setup.setup_logging()
+
+    report = asyncio.run(
+        loadtest.run_load_test(
+            url,
+            model_path=None if model_path is None else pathlib.Path(model_path),
+            concurrency_levels=tuple(concurrency),
+            duration_sec=duration,
+            rate=rate,
+            images_per_request=images_per_request,
+            resolutions=tuple(resolution),
+            unique_images=unique_images,
+        )
+    )
+    loadtest.save_report(report, pathlib.Path(output_path))
+    typer.echo(loadtest.format_report(report))
+    logger.info("Wrote the load test report to %s", output_path)
+
+
+@app.command()
+def tune(
+    model_path: str = "yolov8n.pt",
+    latency_budget_ms: float = tuning.LATENCY_BUDGET_MS,
+    inference_processes: int = 0,
+    threads: list[int] | None = typer.Option(None, help="Thread counts to try"),
+    batch_size: list[int] = typer.Option(list(tuning.TUNE_BATCH_SIZES), help="Batch sizes to try"),
+    decode_workers: list[int] = typer.Option(
+        list(tuning.TUNE_DECODE_WORKERS), help="Decode thread counts to try"
+    ),
+    resolution: int = tuning.TUNE_RESOLUTION,
+    repeats: int = tuning.TUNE_REPEATS,
+    output_path: str = "profile.json",
+):
+    """
+    Find the execution profile with the highest throughput on this machine
+    within a latency budget, and write it for ``infer --profile`` or the API.
+
+    Every option that takes a list can be repeated, e.g. ``--threads 2 --threads 4``.
+
+    Args:
+        model_path: The model to tune for. Defaults to "yolov8n.pt".
+        latency_budget_ms: The most that the p95 latency of one batch may be. Defaults to 500.
+        inference_processes: The number of worker processes that the model will run in,
+            which share the cores. Defaults to 0, running the model in the serving process.
+        threads: The thread counts to try. Defaults to the powers of two up to
+            each process's share of the cores.
+        batch_size: The batch sizes to try. Defaults to 1, 4, 8 and 16.
+        decode_workers: The numbers of decode threads to try. Defaults to 1, 2, 4 and 8.
+        resolution: The width of the synthetic 4:3 images. Defaults to 1280.
+        repeats: How many times each setting is timed. Defaults to 5.
+        output_path: The path to write the profile to. Defaults to "profile.json".
+    """
+    logging_setup.setup_logging()
+
+    execution_profile, report = tuning.tune(
+        pathlib.Path(model_path),
+        latency_budget_ms=latency_budget_ms,
+        inference_processes=inference_processes,
+        thread_counts=tuple(threads) if threads else None,
+        batch_sizes=tuple(batch_size),
+        decode_workers=tuple(decode_workers),
+        resolution=resolution,
+        repeats=repeats,
+    )
+    tuning.save_profile(execution_profile, pathlib.Path(output_path))
+    typer.echo(tuning.format_report(report))
+    logger.info(
+        "Wrote the execution profile to %s. Use it with `skysealand infer --profile %s` "
+        "or `SKYSEALAND_PROFILE=%s` for the API.",
+        output_path,
+        output_path,
+        output_path,
+    )
@@ -0,0 +1,401 @@
+"""
+A persistent SQLite index of the images and labels of every split of the dataset.
+
+The index is built in a single ``os.scandir`` pass over each split's ``images`` and
+``labels`` directories. Each image is recorded with its label file, its dimensions
+(read from its header, without decoding it) and the number of boxes of each class
+in its label file. Later consumers query the index instead of walking the dataset:
+
+- Validation pairs up the images and labels, and reuses the recorded image sizes.
+- Quantization samples its calibration and evaluation images from it.
+- Training logs a summary of the splits before it starts.
+
+Refreshing an existing index only stats the files, and only re-reads those that
+were added or changed since, going by their size and modification time.
+"""
+
+import collections
+import logging
+import os
+import pathlib
+import sqlite3
+from typing import TypedDict
+
+from PIL import Image
+
+from skysealand.dataset import load
+
+logger = logging.getLogger(__name__)
+
+INDEX_NAME = "dataset_index.sqlite"
+# Bumped whenever the schema or what is recorded changes, so that old indexes are rebuilt.
+INDEX_VERSION = 1
+# Pass as the index path to build a throwaway index that is not written to disk.
+IN_MEMORY = ":memory:"
+
+SPLITS = ("train", "val", "test")
+# The suffixes of the image files, compared case-insensitively.
+IMAGE_EXTENSIONS = frozenset({".jpg", ".jpeg", ".png", ".webp"})
+
+_SCHEMA = """
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE images (
+    id INTEGER PRIMARY KEY,
+    split TEXT NOT NULL,
+    image_path TEXT NOT NULL,
+    image_size INTEGER NOT NULL,
+    image_mtime_ns INTEGER NOT NULL,
+    -- NULL if the image has no label file.
+    label_path TEXT,
+    label_size INTEGER,
+    label_mtime_ns INTEGER,
+    -- NULL if the header of the image could not be read.
+    width INTEGER,
+    height INTEGER,
+    num_boxes INTEGER NOT NULL,
+    UNIQUE (split, image_path)
+);
+CREATE INDEX images_by_num_boxes ON images (split, num_boxes);
+CREATE TABLE class_counts (
+    image_id INTEGER NOT NULL,
+    class_id INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (image_id, class_id)
+) WITHOUT ROWID;
+-- Label files without an image.
+CREATE TABLE orphan_labels (
+    split TEXT NOT NULL,
+    label_path TEXT NOT NULL,
+    PRIMARY KEY (split, label_path)
+) WITHOUT ROWID;
+"""
+
+
+# Limits a query to the rows of the ``split`` parameter, or to every split if it is None.
+_IN_SPLIT = "(:split IS NULL OR split = :split)"
+
+
+class IndexedImage(TypedDict):
+    split: str
+    image_path: pathlib.Path
+    label_path: pathlib.Path | None
+    width: int | None
+    height: int | None
+    num_boxes: int
+
+
+class _FileEntry(TypedDict):
+    path: str
+    size: int
+    mtime_ns: int
+
+
+def _scan(directory: pathlib.Path, suffixes: frozenset[str]) -> list[_FileEntry]:
+    """Lists the files in a directory with the given suffixes, and their sizes and times."""
+    try:
+        with os.scandir(directory) as it:
+            entries = []
+            for entry in it:
+                if os.path.splitext(entry.name)[1].lower() not in suffixes:  # noqa: PTH122
+                    continue
+                if not entry.is_file():
+                    continue
+                stat = entry.stat()
+                entries.append(
+                    {"path": entry.path, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+                )
+    except FileNotFoundError:
+        logger.warning("The dataset directory %s does not exist, skipping it.", directory)
+        return []
+    return entries
+
+
+def _image_dimensions(path: str) -> tuple[int | None, int | None]:
+    try:
+        # Opening only parses the header, the pixels are not decoded.
+        with Image.open(path) as img:
+            return img.size
+    except (OSError, ValueError):
+        return None, None
+
+
+def _count_classes(path: str) -> collections.Counter[int]:
+    """
+    Counts the boxes of each class in a YOLO label file.
+
+    Malformed lines are not counted, they are reported by validation instead.
+    """
+    counts: collections.Counter[int] = collections.Counter()
+    try:
+        text = pathlib.Path(path).read_text()
+    except (OSError, ValueError):
+        return counts
+    for line in text.splitlines():
+        parts = line.split()
+        if len(parts) != 5:
+            continue
+        try:
+            counts[int(float(parts[0]))] += 1
+        except (ValueError, OverflowError):
+            continue
+    return counts
+
+
+def _stem(path: str) -> str:
+    return os.path.splitext(os.path.basename(path))[0]  # noqa: PTH119, PTH122
+
+
+class DatasetIndex:
+    """
+    Queries an index of the dataset. Use ``open_index`` to build or refresh one.
+
+    Paths are returned as they were found, anchored at the split directories
+    of the dataset config. Every query takes an optional split to limit it to.
+    """
+
+    def __init__(self, connection: sqlite3.Connection):
+        self._connection = connection
+
+    def close(self):
+        self._connection.close()
+
+    def __enter__(self) -> "DatasetIndex":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _query(self, sql: str, **params) -> list[tuple]:
+        return self._connection.execute(sql, params).fetchall()
+
+    def num_images(self, split: str | None = None) -> int:
+        return self._query(f"SELECT COUNT(*) FROM images WHERE {_IN_SPLIT}", split=split)[0][0]
+
+    def images(
+        self, split: str | None = None, *, more_boxes_than: int | None = None
+    ) -> list[IndexedImage]:
+        """
+        The indexed images, ordered by split and path.
+
+        Args:
+            split: If given, only the images of this split.
+            more_boxes_than: If given, only the images whose label files have more boxes than this.
+        """
+        rows = self._query(
+            "SELECT split, image_path, label_path, width, height, num_boxes FROM images "
+            f"WHERE {_IN_SPLIT} AND num_boxes > :more_boxes_than ORDER BY split, image_path",
+            split=split,
+            more_boxes_than=-1 if more_boxes_than is None else more_boxes_than,
+        )
+        return [
+            {
+                "split": row[0],
+                "image_path": pathlib.Path(row[1]),
+                "label_path": None if row[2] is None else pathlib.Path(row[2]),
+                "width": row[3],
+                "height": row[4],
+                "num_boxes": row[5],
+            }
+            for row in rows
+        ]
+
+    def image_paths(
+        self, split: str | None = None, *, more_boxes_than: int | None = None
+    ) -> list[pathlib.Path]:
+        """The paths of the images, see ``images``."""
+        return [
+            image["image_path"] for image in self.images(split, more_boxes_than=more_boxes_than)
+        ]
+
+    def pairs(self, split: str | None = None) -> list[tuple[pathlib.Path, pathlib.Path]]:
+        """The (image, label file) pairs, ordered by image path."""
+        rows = self._query(
+            "SELECT image_path, label_path FROM images "
+            f"WHERE {_IN_SPLIT} AND label_path IS NOT NULL ORDER BY split, image_path",
+            split=split,
+        )
+        return [(pathlib.Path(image), pathlib.Path(label)) for image, label in rows]
+
+    def missing_annotation(self, split: str | None = None) -> list[str]:
+        """The paths of the images without a label file."""
+        rows = self._query(
+            f"SELECT image_path FROM images WHERE {_IN_SPLIT} AND label_path IS NULL "
+            "ORDER BY split, image_path",
+            split=split,
+        )
+        return [row[0] for row in rows]
+
+    def missing_image(self, split: str | None = None) -> list[str]:
+        """The paths of the label files without an image."""
+        rows = self._query(
+            f"SELECT label_path FROM orphan_labels WHERE {_IN_SPLIT} ORDER BY split, label_path",
+            split=split,
+        )
+        return [row[0] for row in rows]
+
+    def class_histogram(self, split: str | None = None) -> dict[int, int]:
+        """The number of boxes of each class, by class id."""
+        rows = self._query(
+            "SELECT class_id, SUM(count) FROM class_counts "
+            "JOIN images ON images.id = class_counts.image_id "
+            f"WHERE {_IN_SPLIT} GROUP BY class_id ORDER BY class_id",
+            split=split,
+        )
+        return dict(rows)
+
+
+def _read_version(connection: sqlite3.Connection) -> int | None:
+    try:
+        row = connection.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+    except sqlite3.DatabaseError:
+        return None
+    return None if row is None else int(row[0])
+
+
+def _reset(connection: sqlite3.Connection):
+    tables = [
+        row[0]
+        for row in connection.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'"
+        )
+    ]
+    for table in tables:
+        connection.execute(f"DROP TABLE {table}")
+    connection.executescript(_SCHEMA)
+    connection.execute("INSERT INTO meta VALUES ('version', ?)", (str(INDEX_VERSION),))
+
+
+def _delete_images(connection: sqlite3.Connection, image_ids: list[int]):
+    params = [(image_id,) for image_id in image_ids]
+    connection.executemany("DELETE FROM class_counts WHERE image_id = ?", params)
+    connection.executemany("DELETE FROM images WHERE id = ?", params)
+
+
+def _refresh_split(connection: sqlite3.Connection, split: str, images_dir: pathlib.Path) -> int:
+    """
+    Brings the index of one split up to date with its directories.
+
+    Returns:
+        The number of images that were added, changed or removed.
+    """
+    # Roboflow-style: ../images --> ../labels
+    labels_dir = images_dir.parent / "labels"
+    images = _scan(images_dir, IMAGE_EXTENSIONS)
+    labels = {_stem(label["path"]): label for label in _scan(labels_dir, frozenset({".txt"}))}
+
+    recorded = {
+        row[1]: row
+        for row in connection.execute(
+            "SELECT id, image_path, image_size, image_mtime_ns, label_path, label_size, "
+            "label_mtime_ns FROM images WHERE split = ?",
+            (split,),
+        )
+    }
+    image_stems = set()
+    num_changed = 0
+    for image in images:
+        image_stems.add(_stem(image["path"]))
+        label = labels.get(_stem(image["path"]))
+        state = (
+            image["size"],
+            image["mtime_ns"],
+            None if label is None else label["path"],
+            None if label is None else label["size"],
+            None if label is None else label["mtime_ns"],
+        )
+        row = recorded.pop(image["path"], None)
+        if row is not None:
+            if row[2:] == state:
+                continue
+            _delete_images(connection, [row[0]])
+
+        counts = collections.Counter() if label is None else _count_classes(label["path"])
+        width, height = _image_dimensions(image["path"])
+        image_id = connection.execute(
+            "INSERT INTO images (split, image_path, image_size, image_mtime_ns, label_path, "
+            "label_size, label_mtime_ns, width, height, num_boxes) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (split, image["path"], *state, width, height, counts.total()),
+        ).lastrowid
+        connection.executemany(
+            "INSERT INTO class_counts VALUES (?, ?, ?)",
+            [(image_id, class_id, count) for class_id, count in counts.items()],
+        )
+        num_changed += 1
+
+    # The images that are gone.
+    _delete_images(connection, [row[0] for row in recorded.values()])
+
+    connection.execute("DELETE FROM orphan_labels WHERE split = ?", (split,))
+    connection.executemany(
+        "INSERT INTO orphan_labels VALUES (?, ?)",
+        [(split, label["path"]) for stem, label in labels.items() if stem not in image_stems],
+    )
+    return num_changed + len(recorded)
+
+
+def open_index(
+    dataset_config_path: pathlib.Path = pathlib.Path("data/data.yaml"),
+    index_path: pathlib.Path | str | None = None,
+) -> DatasetIndex:
+    """
+    Builds the index of a dataset, or brings an existing index up to date, and opens it.
+
+    Args:
+        dataset_config_path: The path to the config summary yaml file for the dataset.
+            Defaults to "data/data.yaml".
+        index_path: Where to keep the index. Defaults to ``INDEX_NAME`` next to the config.
+            Pass ``IN_MEMORY`` to build an index that is not kept.
+
+    Returns:
+        The up to date index, to be closed when done, e.g. by using it as a context manager.
+    """
+    dataset_spec = load.load_dataset_config(dataset_config_path)
+    if index_path is None:
+        index_path = dataset_config_path.with_name(INDEX_NAME)
+
+    connection = sqlite3.connect(index_path)
+    try:
+        with connection:
+            if _read_version(connection) != INDEX_VERSION:
+                logger.info("Building the dataset index at %s ...", index_path)
+                _reset(connection)
+            for split in SPLITS:
+                num_changed = _refresh_split(connection, split, dataset_spec[split])
+                if num_changed:
+                    logger.info("Updated %d %s images in the index.", num_changed, split)
+    except BaseException:
+        connection.close()
+        raise
+    return DatasetIndex(connection)
+
+
+def format_summary(dataset_index: DatasetIndex, class_names: list[str] | None = None) -> str:
+    """
+    Lays out the number of images of each split and their boxes of each class as a table.
+
+    Args:
+        dataset_index: The index to summarize.
+        class_names: The names of the classes by id, e.g. the ``names`` of the dataset config.
+            Classes without a name are shown by id.
+    """
+    histograms = {split: dataset_index.class_histogram(split) for split in SPLITS}
+    class_ids = sorted({class_id for histogram in histograms.values() for class_id in histogram})
+
+    def name(class_id: int) -> str:
+        if class_names is not None and 0 <= class_id < len(class_names):
+            return class_names[class_id]
+        return f"class {class_id}"
+
+    rows = [
+        ("images", [dataset_index.num_images(split) for split in SPLITS]),
+        ("missing labels", [len(dataset_index.missing_annotation(split)) for split in SPLITS]),
+        ("missing images", [len(dataset_index.missing_image(split)) for split in SPLITS]),
+        *(
+            (f"{name(class_id)} boxes", [histograms[split].get(class_id, 0) for split in SPLITS])
+            for class_id in class_ids
+        ),
+    ]
+    lines = [f"{'':<24}" + "".join(f"{split:>10}" for split in SPLITS)]
+    lines.extend(f"{label:<24}" + "".join(f"{v:>10}" for v in values) for label, values in rows)
+    return "\n".join(lines)
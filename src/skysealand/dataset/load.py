@@ -1,5 +1,5 @@
 import pathlib
-from typing import TypedDict
+from typing import NotRequired, TypedDict
 
 import yaml
 
@@ -9,6 +9,8 @@ class DatasetSpec(TypedDict):
     val: pathlib.Path
     test: pathlib.Path
     num_classes: int
+    # The name of each class, by class id.
+    names: NotRequired[list[str]]
 
 
 def load_dataset_config(config_path: pathlib.Path) -> DatasetSpec:
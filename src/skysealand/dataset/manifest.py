@@ -0,0 +1,166 @@
+"""
+A manifest of the files that were validated and their results, for incremental validation.
+
+Each (image, label) pair is recorded with the size and modification time of both files,
+and optionally a hash of their contents. A later validation only re-validates the pairs
+whose files were added or changed since, and reuses the recorded results of the rest.
+"""
+
+import hashlib
+import json
+import logging
+import pathlib
+from typing import Any, NotRequired, TypedDict
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = "validation_manifest.json"
+# Bumped whenever the validation checks change, so that old results are not reused.
+MANIFEST_VERSION = 2
+
+_HASH_CHUNK_BYTES = 1024 * 1024
+
+
+class FileState(TypedDict):
+    size: int
+    mtime_ns: int
+    # Only present when contents are hashed.
+    sha256: NotRequired[str]
+
+
+class ManifestEntry(TypedDict):
+    image: FileState
+    label: FileState
+    # The validation results of the pair, see ``validation._validate_pairs``.
+    corrupt: dict[str, str] | None
+    annotation_errors: list[str]
+
+
+class ValidationManifest(TypedDict):
+    version: int
+    # What the files were checked with, e.g. the number of classes.
+    settings: dict[str, Any]
+    hash_contents: bool
+    # By the path of each image.
+    files: dict[str, ManifestEntry]
+
+
+def _hash_file(path: pathlib.Path) -> str:
+    digest = hashlib.sha256()
+    with path.open("rb") as f:
+        while chunk := f.read(_HASH_CHUNK_BYTES):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_state(path: pathlib.Path, hash_contents: bool = False) -> FileState:
+    """Records the size and modification time of a file, and optionally its hash."""
+    stat = path.stat()
+    state: FileState = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    if hash_contents:
+        state["sha256"] = _hash_file(path)
+    return state
+
+
+def _current_state(
+    path: pathlib.Path, recorded: FileState, hash_contents: bool
+) -> FileState | None:
+    """
+    The current state of the file if it is unchanged since it was recorded, or else None.
+
+    Files whose modification time changed, e.g. because they were copied,
+    still count as unchanged if their contents hash the same.
+    """
+    try:
+        stat = path.stat()
+    except OSError:
+        return None
+    state: FileState = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    if state["size"] != recorded["size"]:
+        return None
+    if state["mtime_ns"] == recorded["mtime_ns"]:
+        if "sha256" in recorded:
+            state["sha256"] = recorded["sha256"]
+        return state
+    if hash_contents and "sha256" in recorded and _hash_file(path) == recorded["sha256"]:
+        state["sha256"] = recorded["sha256"]
+        return state
+    return None
+
+
+def reuse_entry(
+    entry: ManifestEntry | None,
+    image_path: pathlib.Path,
+    label_path: pathlib.Path,
+    hash_contents: bool = False,
+) -> ManifestEntry | None:
+    """
+    Checks whether the recorded results of a pair can be reused.
+
+    Args:
+        entry: The recorded entry of the pair, if any.
+        image_path: The path to the image.
+        label_path: The path to its annotation file.
+        hash_contents: Whether to compare the hashes of files whose modification time changed.
+
+    Returns:
+        The entry, updated with the current states of the files, if neither of them changed.
+        Otherwise, None.
+    """
+    if entry is None:
+        return None
+    image_state = _current_state(image_path, entry["image"], hash_contents)
+    if image_state is None:
+        return None
+    label_state = _current_state(label_path, entry["label"], hash_contents)
+    if label_state is None:
+        return None
+    return {**entry, "image": image_state, "label": label_state}
+
+
+def load_manifest(
+    path: pathlib.Path, settings: dict[str, Any], hash_contents: bool
+) -> dict[str, ManifestEntry]:
+    """
+    Loads the entries of a manifest, if they can be reused.
+
+    Args:
+        path: The path to the manifest.
+        settings: What the files are checked with now, e.g. the number of classes.
+        hash_contents: Whether contents are hashed now.
+
+    Returns:
+        The entries by the path of each image. Empty if there is no manifest, or if it
+        was written by other checks, with other settings or without hashes
+        when they are now needed.
+    """
+    if not path.exists():
+        return {}
+    try:
+        manifest: ValidationManifest = json.loads(path.read_text())
+    except (OSError, ValueError) as e:
+        logger.warning("Ignoring the unreadable validation manifest %s: %s", path, e)
+        return {}
+    if (
+        manifest.get("version") != MANIFEST_VERSION
+        or manifest.get("settings") != settings
+        or (hash_contents and not manifest.get("hash_contents"))
+    ):
+        logger.info("The validation manifest %s is outdated, validating everything.", path)
+        return {}
+    return manifest["files"]
+
+
+def save_manifest(
+    path: pathlib.Path,
+    entries: dict[str, ManifestEntry],
+    settings: dict[str, Any],
+    hash_contents: bool,
+):
+    manifest: ValidationManifest = {
+        "version": MANIFEST_VERSION,
+        "settings": settings,
+        "hash_contents": hash_contents,
+        "files": entries,
+    }
+    path.write_text(json.dumps(manifest))
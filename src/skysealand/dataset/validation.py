@@ -1,16 +1,97 @@
+import concurrent.futures
+import contextlib
+import enum
+import functools
+import hashlib
 import json
 import logging
+import os
 import pathlib
-from typing import TypedDict
+import time
+from collections.abc import Callable
+from typing import Any, Literal, TypedDict
 
+import numpy as np
 from PIL import Image
 
-from skysealand.dataset import load
+from skysealand import inference
+from skysealand.dataset import index, load, manifest
 
 logger = logging.getLogger(__name__)
 
 
-def _validate_image(image_path: pathlib.Path) -> tuple[int, int, str]:
+class ImageCheck(enum.StrEnum):
+    # Only reads the header for the size and format, and the end of the file for truncation.
+    PROBE = "probe"
+    # Pillow's ``Image.verify``, which checks the structure of the file without decoding it.
+    VERIFY = "verify"
+    # Fully decodes the image, which finds corrupt data anywhere in the file.
+    DEEP = "deep"
+
+
+# The end of image marker of JPEG files, which may be followed by a trailer, e.g. from a camera.
+_JPEG_END = b"\xff\xd9"
+# The last bytes of complete PNG files, after any null padding.
+_PNG_END = b"IEND\xaeB`\x82"
+# How many bytes at the end of a JPEG may follow its end of image marker.
+_TRAILER_BYTES = 1024
+
+
+def _probe_image(image_path: pathlib.Path, size: tuple[int, int] | None = None) -> tuple[int, int]:
+    """
+    Reads the size of an image from its header, and checks that it is a whole JPEG,
+    PNG or WEBP file from its first and last bytes, without decoding it.
+
+    Args:
+        image_path: The path to the image.
+        size: The width and height of the image, if they are already known, e.g. from the
+            dataset index. Then the header is not parsed again.
+
+    Returns:
+        The width and height of the image.
+    """
+    with image_path.open("rb") as f:
+        header = f.read(12)
+        image_format = inference.sniff_format(header)
+        if image_format is None:
+            raise ValueError(f"Not a {', '.join(sorted(inference.ALLOWED_FORMATS))} image")
+
+        file_size = f.seek(0, os.SEEK_END)
+        f.seek(max(file_size - _TRAILER_BYTES, 0))
+        trailer = f.read().rstrip(b"\x00")
+        if image_format == "WEBP":
+            # The RIFF header holds the size of the rest of the file.
+            truncated = int.from_bytes(header[4:8], "little") + 8 > file_size
+        elif image_format == "JPEG":
+            # Entropy coded data escapes 0xFF bytes, so this can only be a marker.
+            truncated = _JPEG_END not in trailer
+        else:
+            truncated = not trailer.endswith(_PNG_END)
+        if truncated:
+            raise ValueError(f"Truncated {image_format} image")
+        if size is not None:
+            return size
+
+        f.seek(0)
+        # Opening only parses the header, the pixels are not decoded.
+        with Image.open(f) as img:
+            return img.size
+
+
+def _is_sampled(image_path: pathlib.Path, fraction: float) -> bool:
+    """Picks the same ``fraction`` of the images on every run, no matter how they are chunked."""
+    if fraction >= 1:
+        return True
+    digest = hashlib.sha256(str(image_path).encode()).digest()
+    return int.from_bytes(digest[:8], "little") / 2**64 < fraction
+
+
+def _validate_image(
+    image_path: pathlib.Path,
+    check: ImageCheck = ImageCheck.VERIFY,
+    deep_sample: float = 1.0,
+    size: tuple[int, int] | None = None,
+) -> tuple[int, int, str]:
     """
     Validates that the image at the given file path can be opened by pillow.
 
@@ -18,16 +99,27 @@ def _validate_image(image_path: pathlib.Path) -> tuple[int, int, str]:
 
     Args:
         image_path: The path to the image to validate.
+        check: How thoroughly to check the image, see ``ImageCheck``.
+        deep_sample: The fraction of the images to check deeply with ``ImageCheck.DEEP``.
+            The others are only probed.
+        size: The width and height of the image, if already known, which probing then reuses.
 
     Returns:
         A tuple of: the width of the image, the height of the image, and an error string if any occurred.
         (if no error occured this string will be empty string).
     """
     try:
-        with Image.open(image_path) as img:
-            img.verify()
+        if check == ImageCheck.DEEP and not _is_sampled(image_path, deep_sample):
+            check = ImageCheck.PROBE
+        if check == ImageCheck.PROBE:
+            width, height = _probe_image(image_path, size)
+            return width, height, ""
         with Image.open(image_path) as img:
             width, height = img.size
+            if check == ImageCheck.DEEP:
+                img.load()
+            else:
+                img.verify()
         return width, height, ""
     except Exception as e:
         # These int values will not be used.
@@ -59,78 +151,248 @@ def _validate_annotation(
     Returns:
         A list of the encountered bounding box parsing errors for the given file.
     """
-    errors = []
-    with ann_path.open() as f:
-        lines = f.readlines()
+    return _validate_annotations([ann_path], [img_width], [img_height], num_classes)[0]
 
-    for i, line in enumerate(lines):
-        parts = line.strip().split()
-        if len(parts) != _NUM_ANNOTATION_VALS:
-            errors.append(f"Line {i}: malformed")
-            continue
 
-        class_id, x, y, w, h = map(float, parts)
-        if not (0 <= class_id < num_classes):
-            errors.append(f"Line {i}: invalid class {class_id}")
-        if w <= 0 or h <= 0:
-            errors.append(f"Line {i}: zero or negative area")
+def _validate_annotations(
+    ann_paths: list[pathlib.Path],
+    img_widths: list[int],
+    img_heights: list[int],
+    num_classes: int,
+) -> list[list[str]]:
+    """
+    Validates many annotation files at once, with the same checks as ``_validate_annotation``.
+
+    Only the lines are split one at a time, to find the malformed ones. Every well formed line
+    of every file is parsed into a single array with one (class, x, y, w, h) row per box,
+    and the checks run on all of the boxes at once against the size of each box's image.
 
-        x_min = (x - w / 2) * img_width
-        y_min = (y - h / 2) * img_height
-        x_max = (x + w / 2) * img_width
-        y_max = (y + h / 2) * img_height
+    Args:
+        ann_paths: The paths to the annotation files to validate.
+        img_widths: The width of the image of each annotation file in pixels.
+        img_heights: The height of the image of each annotation file in pixels.
+        num_classes: The max number of classes in the dataset.
 
-        if x_min < 0 or y_min < 0 or x_max > img_width or y_max > img_height:
-            errors.append(f"Line {i}: bbox out of bounds")
+    Returns:
+        The encountered bounding box parsing errors of each file, in the same order as the files.
+    """
+    # (file index, line, message) of each error.
+    line_errors: list[tuple[int, int, str]] = []
+    file_indices: list[int] = []
+    line_numbers: list[int] = []
+    values: list[str] = []
+    for file_index, ann_path in enumerate(ann_paths):
+        with ann_path.open() as f:
+            lines = f.readlines()
+        for i, line in enumerate(lines):
+            parts = line.split()
+            if len(parts) != _NUM_ANNOTATION_VALS:
+                line_errors.append((file_index, i, "malformed"))
+                continue
+            file_indices.append(file_index)
+            line_numbers.append(i)
+            values.extend(parts)
+
+    boxes = np.array(values, dtype=np.float64).reshape(-1, _NUM_ANNOTATION_VALS)
+    class_ids, x, y, w, h = boxes.T
+    widths = np.asarray(img_widths, dtype=np.float64)[file_indices]
+    heights = np.asarray(img_heights, dtype=np.float64)[file_indices]
+
+    invalid_class = ~((class_ids >= 0) & (class_ids < num_classes))
+    no_area = (w <= 0) | (h <= 0)
+    out_of_bounds = (
+        ((x - w / 2) * widths < 0)
+        | ((y - h / 2) * heights < 0)
+        | ((x + w / 2) * widths > widths)
+        | ((y + h / 2) * heights > heights)
+    )
+    for row in np.flatnonzero(invalid_class | no_area | out_of_bounds):
+        file_index, i = file_indices[row], line_numbers[row]
+        if invalid_class[row]:
+            line_errors.append((file_index, i, f"invalid class {float(class_ids[row])}"))
+        if no_area[row]:
+            line_errors.append((file_index, i, "zero or negative area"))
+        if out_of_bounds[row]:
+            line_errors.append((file_index, i, "bbox out of bounds"))
+
+    # The sort is stable, so the errors of each line stay in the order they were checked in.
+    line_errors.sort(key=lambda error: error[:2])
+    errors: list[list[str]] = [[] for _ in ann_paths]
+    for file_index, i, message in line_errors:
+        errors[file_index].append(f"Line {i}: {message}")
     return errors
 
 
-def _validate_split(
-    split_dir: pathlib.Path, num_classes: int
-) -> tuple[list[str], list[str], list[dict[str, str]], dict[str, list[str]]]:
-    """
-    Run a validation check for every (image, label) pair in a given directory.
+# An image, its annotation file, and the size of the image if the dataset index knows it.
+_Pair = tuple[pathlib.Path, pathlib.Path, tuple[int, int] | None]
+# The corrupt image entry, if the image is corrupt, and the errors in its annotation file.
+_PairResult = tuple[dict[str, str] | None, list[str]]
 
-    Asumes that the directory contains a sub-folder full of images, called ``images``,
-    and another sub-folder of corresponding labels, called ``labels``.
+# How many (image, label) pairs each worker process validates at a time.
+CHUNK_SIZE = 64
+# The shortest time between progress logs.
+_PROGRESS_LOG_INTERVAL_SEC = 5.0
 
-    Args:
-        split_dir: The path to the *images* directory.
-        num_classes: The expected number of object classes to find in the dataset.
 
-    Returns:
-        A tuple of the missing annotation, missing image, corrupt images,
-        and annotation errors that were encountered with the given directory.
-    """
-    images_dir = split_dir
-    # Roboflow-style: ../images --> ../labels/images
-    ann_dir = split_dir.parent / "labels"
-
-    missing_annotation = []
-    missing_image = []
-    corrupt_images = []
-    annotation_errors = {}
-    for img_path in images_dir.glob("*.jpg"):
-        ann_path = ann_dir / (img_path.stem + ".txt")
-        if not ann_path.exists():
-            missing_annotation.append(str(img_path))
-            continue
+def _validate_pairs(
+    pairs: list[_Pair],
+    num_classes: int,
+    image_check: ImageCheck = ImageCheck.VERIFY,
+    deep_sample: float = 1.0,
+) -> list[_PairResult]:
+    """
+    Validates a chunk of pairs, in a worker process.
 
-        w, h, err = _validate_image(img_path)
+    The images are validated first, and then the annotation files of the images
+    that are not corrupt are validated together, see ``_validate_annotations``.
+    """
+    results: list[_PairResult] = []
+    valid_indices, ann_paths, widths, heights = [], [], [], []
+    for img_path, ann_path, size in pairs:
+        w, h, err = _validate_image(img_path, image_check, deep_sample, size)
         if err != "":
-            corrupt_images.append({"image": str(img_path), "error": err})
+            results.append(({"image": str(img_path), "error": err}, []))
             continue
+        valid_indices.append(len(results))
+        results.append((None, []))
+        ann_paths.append(ann_path)
+        widths.append(w)
+        heights.append(h)
+
+    for i, errors in zip(
+        valid_indices,
+        _validate_annotations(ann_paths, widths, heights, num_classes),
+        strict=True,
+    ):
+        results[i] = (None, errors)
+    return results
+
+
+def _chunks(pairs: list[_Pair], chunk_size: int) -> list[list[_Pair]]:
+    return [pairs[start : start + chunk_size] for start in range(0, len(pairs), chunk_size)]
+
+
+def _validate_all_pairs(
+    pairs: list[_Pair],
+    validate_chunk: Callable[[list[_Pair]], list[_PairResult]],
+    jobs: int,
+    chunk_size: int = CHUNK_SIZE,
+) -> list[_PairResult]:
+    """
+    Validates every pair on a pool of ``jobs`` processes, or in this process if ``jobs`` is 1.
 
-        errors = _validate_annotation(ann_path, w, h, num_classes)
-        if errors:
-            annotation_errors[str(ann_path)] = errors
+    Args:
+        pairs: The pairs to validate.
+        validate_chunk: Validates a chunk of pairs, e.g. ``_validate_pairs`` with its settings.
+            It must be picklable.
+        jobs: The number of processes to validate on.
+        chunk_size: The number of pairs that each process validates at a time.
 
-    for ann_path in ann_dir.glob("*.txt"):
-        img_path = images_dir / (ann_path.stem + ".jpg")
-        if not img_path.exists():
-            missing_image.append(str(ann_path))
+    Returns:
+        The result of each pair, in the same order as the pairs.
+    """
+    chunks = _chunks(pairs, chunk_size)
+    start = last_log = time.perf_counter()
+    results: list[_PairResult] = []
+
+    with contextlib.ExitStack() as stack:
+        if jobs == 1:
+            chunk_results = map(validate_chunk, chunks)
+        else:
+            executor = stack.enter_context(concurrent.futures.ProcessPoolExecutor(jobs))
+            chunk_results = executor.map(validate_chunk, chunks)
+
+        for chunk_result in chunk_results:
+            results.extend(chunk_result)
+            now = time.perf_counter()
+            if now - last_log >= _PROGRESS_LOG_INTERVAL_SEC:
+                logger.info(
+                    "Validated %d/%d images (%.0f images/sec)",
+                    len(results),
+                    len(pairs),
+                    len(results) / (now - start),
+                )
+                last_log = now
+
+    elapsed = time.perf_counter() - start
+    logger.info(
+        "Validated %d images in %.1fs (%.0f images/sec) with %d jobs",
+        len(pairs),
+        elapsed,
+        len(pairs) / elapsed if elapsed > 0 else 0.0,
+        jobs,
+    )
+    return results
+
+
+def _validate_changed_pairs(  # noqa: PLR0913
+    pairs: list[_Pair],
+    validate_chunk: Callable[[list[_Pair]], list[_PairResult]],
+    jobs: int,
+    *,
+    manifest_path: pathlib.Path,
+    settings: dict[str, Any],
+    hash_contents: bool,
+) -> list[_PairResult]:
+    """
+    Validates only the pairs that changed since the manifest was written,
+    reuses the recorded results of the rest, and updates the manifest.
 
-    return missing_annotation, missing_image, corrupt_images, annotation_errors
+    Args:
+        pairs: The pairs to validate.
+        validate_chunk: Validates a chunk of pairs, see ``_validate_all_pairs``.
+        jobs: The number of processes to validate on.
+        manifest_path: The path to the manifest.
+        settings: The settings that ``validate_chunk`` checks with. Recorded results
+            are only reused if they were checked with the same settings.
+        hash_contents: Whether to record and compare the hashes of the files.
+
+    Returns:
+        The result of each pair, in the same order as the pairs.
+    """
+    recorded = manifest.load_manifest(manifest_path, settings, hash_contents)
+    entries: dict[str, manifest.ManifestEntry] = {}
+    changed: list[_Pair] = []
+    for pair in pairs:
+        img_path, ann_path, _ = pair
+        entry = manifest.reuse_entry(recorded.get(str(img_path)), img_path, ann_path, hash_contents)
+        if entry is None:
+            changed.append(pair)
+        else:
+            entries[str(img_path)] = entry
+    logger.info(
+        "Reusing the results of %d unchanged images, validating %d added or changed images "
+        "(%d removed)",
+        len(entries),
+        len(changed),
+        len(set(recorded) - {str(img_path) for img_path, _, _ in pairs}),
+    )
+
+    # Record the files as they were before they were validated, so that any change
+    # while they are being validated makes the next validation check them again.
+    states = [
+        (
+            manifest.file_state(img_path, hash_contents),
+            manifest.file_state(ann_path, hash_contents),
+        )
+        for img_path, ann_path, _ in changed
+    ]
+    changed_results = _validate_all_pairs(changed, validate_chunk, jobs) if changed else []
+    for (img_path, _, _), (image_state, label_state), (corrupt, errors) in zip(
+        changed, states, changed_results, strict=True
+    ):
+        entries[str(img_path)] = {
+            "image": image_state,
+            "label": label_state,
+            "corrupt": corrupt,
+            "annotation_errors": errors,
+        }
+
+    manifest.save_manifest(manifest_path, entries, settings, hash_contents)
+    return [
+        (entries[str(img_path)]["corrupt"], entries[str(img_path)]["annotation_errors"])
+        for img_path, _, _ in pairs
+    ]
 
 
 class ValidationErrorResults(TypedDict):
@@ -142,20 +404,31 @@ class ValidationErrorResults(TypedDict):
     annotation_errors: dict[str, list[str]]
 
 
+SplitName = Literal["train", "test", "val"]
+
+
 class ValidationReport(TypedDict):
     train: ValidationErrorResults
     test: ValidationErrorResults
     val: ValidationErrorResults
 
 
-def validate_all_data(
+def validate_all_data(  # noqa: PLR0913
     dataset_config_path: pathlib.Path = pathlib.Path("data/data.yaml"),
     report_path: pathlib.Path | None = pathlib.Path("data/validation_report.json"),
+    jobs: int | None = 1,
+    incremental: bool = True,
+    hash_contents: bool = False,
+    *,
+    image_check: ImageCheck = ImageCheck.VERIFY,
+    deep_sample: float = 1.0,
 ) -> ValidationReport:
     """
     Validates all splits in the given dataset config yaml file path.
 
-    The results are dumped to a json file at the given report path.
+    The results are dumped to a json file at the given report path. The images and
+    annotations, and the sizes of the images, come from the dataset index next to the
+    dataset config, see ``dataset.index``.
 
     Args:
         dataset_config_path: The path to the config summary yaml file for the dataset.
@@ -166,7 +439,29 @@ def validate_all_data(
             Defaults to ``data/validation_report.json``
             (within the downloaded dataset directory).
             If None is given, then no dump will occur.
+        jobs: The number of processes to validate the images of all splits on, in chunks.
+            The report is the same no matter how many are used.
+            Defaults to 1, validating in this process. If None, then one per core.
+        incremental: Whether to only re-validate the images and annotations that were added
+            or changed since the last validation, going by the manifest that is kept next to
+            the report. Needs a ``report_path``. Defaults to true.
+        hash_contents: Whether to also record the hashes of the files in the manifest, so that
+            files whose modification time changed but whose contents did not are not
+            re-validated. Defaults to false.
+        image_check: How thoroughly to check each image, see ``ImageCheck``.
+            Defaults to verifying their structure with pillow. ``ImageCheck.PROBE`` is
+            faster, but only finds images that are truncated or not images at all.
+        deep_sample: With ``ImageCheck.DEEP``, the fraction of the images to fully decode.
+            The same images are picked on every run, and the others are only probed.
+            Defaults to 1, decoding every image.
     """
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    if jobs < 1:
+        raise ValueError(f"jobs must be positive, got {jobs}")
+    if not 0 < deep_sample <= 1:
+        raise ValueError(f"deep_sample must be in (0, 1], got {deep_sample}")
+
     dataset_spec = load.load_dataset_config(dataset_config_path)
     num_classes = dataset_spec["num_classes"]
     full_report: ValidationReport = {
@@ -189,16 +484,59 @@ def validate_all_data(
             "annotation_errors": {},
         },
     }
-    for split_name in ("train", "test", "val"):
-        split_dir = dataset_spec[split_name]
-        logger.info("Validating %s split at %s...", split_name, split_dir)
-        missing_annotation, missing_image, corrupt_images, annotation_errors = _validate_split(
-            split_dir, num_classes
+    splits: list[SplitName] = ["train", "test", "val"]
+    split_pairs = {}
+    with index.open_index(dataset_config_path) as dataset_index:
+        for split_name in splits:
+            split_pairs[split_name] = [
+                (
+                    image["image_path"],
+                    image["label_path"],
+                    None if image["width"] is None else (image["width"], image["height"]),
+                )
+                for image in dataset_index.images(split_name)
+                if image["label_path"] is not None
+            ]
+            full_report[split_name]["missing_annotation"] = dataset_index.missing_annotation(
+                split_name
+            )
+            full_report[split_name]["missing_image"] = dataset_index.missing_image(split_name)
+
+    # Validate every split's pairs together, so that small splits don't leave processes idle.
+    all_pairs = [pair for split_name in splits for pair in split_pairs[split_name]]
+    manifest_path = (
+        report_path.with_name(manifest.MANIFEST_NAME)
+        if incremental and report_path is not None
+        else None
+    )
+    settings = {"num_classes": num_classes, "image_check": str(image_check)}
+    if image_check == ImageCheck.DEEP:
+        settings["deep_sample"] = deep_sample
+    logger.info("Validating with %s", settings)
+    validate_chunk = functools.partial(
+        _validate_pairs, num_classes=num_classes, image_check=image_check, deep_sample=deep_sample
+    )
+    if manifest_path is None:
+        results = _validate_all_pairs(all_pairs, validate_chunk, jobs)
+    else:
+        results = _validate_changed_pairs(
+            all_pairs,
+            validate_chunk,
+            jobs,
+            manifest_path=manifest_path,
+            settings=settings,
+            hash_contents=hash_contents,
         )
-        full_report[split_name]["missing_annotation"] = missing_annotation
-        full_report[split_name]["missing_image"] = missing_image
-        full_report[split_name]["corrupt_images"] = corrupt_images
-        full_report[split_name]["annotation_errors"] = annotation_errors
+    offset = 0
+    for split_name in splits:
+        pairs = split_pairs[split_name]
+        split_results = results[offset : offset + len(pairs)]
+        offset += len(pairs)
+        for (_, ann_path, _), (corrupt, errors) in zip(pairs, split_results, strict=True):
+            if corrupt is not None:
+                full_report[split_name]["corrupt_images"].append(corrupt)
+            elif errors:
+                full_report[split_name]["annotation_errors"][str(ann_path)] = errors
 
     if report_path is not None:
         with report_path.open("w") as f:
@@ -0,0 +1,129 @@
+"""
+Executors that keep blocking decode and inference work off of the asyncio event loop.
+"""
+
+import asyncio
+import concurrent.futures
+import functools
+import logging
+from typing import Literal
+
+import numpy as np
+from starlette.datastructures import UploadFile
+
+from skysealand import admission, inference
+
+logger = logging.getLogger(__name__)
+
+ExecutorKind = Literal["thread", "process"]
+
+
+async def read_uploads(
+    *files: UploadFile, max_file_bytes: int | None = None
+) -> list[tuple[str, bytes]]:
+    """
+    Reads every uploaded file with the async ``UploadFile.read`` API.
+
+    Args:
+        files: The uploaded files to read.
+        max_file_bytes: If given, raise ``admission.UploadTooLargeError`` as soon as
+            a file turns out to be larger than this.
+
+    Returns:
+        Pairs of the name of each file and its raw bytes.
+    """
+    return [
+        (
+            f.filename if f.filename is not None else "<unknown-filename>",
+            await admission.read_limited(f, max_file_bytes),
+        )
+        for f in files
+    ]
+
+
+def _make_executor(kind: ExecutorKind, max_workers: int, name: str) -> concurrent.futures.Executor:
+    if max_workers < 1:
+        raise ValueError(f"The {name} executor needs at least one worker, got {max_workers}")
+    if kind == "thread":
+        return concurrent.futures.ThreadPoolExecutor(max_workers, thread_name_prefix=name)
+    if kind == "process":
+        return concurrent.futures.ProcessPoolExecutor(max_workers)
+    raise ValueError(f"Unknown executor kind: {kind}")
+
+
+class ExecutionLayer:
+    """
+    Dedicated executors for image decoding and model inference.
+
+    Decoding can use threads (Pillow releases the GIL while decoding) or processes.
+    Inference always runs on threads since the model cannot be shared across processes;
+    only use more than one inference worker if the model is safe to call concurrently.
+    The batchers run the model on ``inference_executor``, see ``batching.MicroBatcher``.
+
+    Args:
+        decode_workers: The number of workers that decode images.
+        decode_executor: Whether to decode images on a ``"thread"`` or ``"process"`` pool.
+        inference_workers: The number of threads that run the model.
+    """
+
+    def __init__(
+        self,
+        decode_workers: int = 4,
+        decode_executor: ExecutorKind = "thread",
+        inference_workers: int = 1,
+    ):
+        logger.info(
+            "Starting execution layer | decode=%s x%d | inference=thread x%d",
+            decode_executor,
+            decode_workers,
+            inference_workers,
+        )
+        self.inference_workers = inference_workers
+        self.decode_executor = _make_executor(decode_executor, decode_workers, "decode")
+        self.inference_executor = _make_executor("thread", inference_workers, "inference")
+
+    async def decode(
+        self,
+        named_data: list[tuple[str, bytes]],
+        skip_errors: bool = False,
+        target_size: int | None = inference.MODEL_IMAGE_SIZE,
+    ) -> tuple[list[np.ndarray], list[str], list[inference.ImageScale]]:
+        """
+        Decodes the given image bytes concurrently on the decode executor.
+
+        Args:
+            named_data: Pairs of the name of the file and its raw bytes.
+            skip_errors: Whether to skip errors with decoding images
+                and just log a warning instead. Defaults to false.
+            target_size: The size that the images are going to be resized to by the model.
+                See ``inference.decode_reduced_images``.
+                If None, then the images are decoded at full resolution.
+
+        Returns:
+            A tuple of the image arrays, the names of the files that they came from,
+            and how much each image was scaled down by, in the same order as the given data.
+        """
+        loop = asyncio.get_running_loop()
+        decoded = await asyncio.gather(
+            *(
+                loop.run_in_executor(
+                    self.decode_executor,
+                    functools.partial(
+                        inference.decode_reduced_images,
+                        item,
+                        target_size=target_size,
+                        skip_errors=skip_errors,
+                    ),
+                )
+                for item in named_data
+            )
+        )
+        images = [img for imgs, _, _ in decoded for img in imgs]
+        names = [name for _, names, _ in decoded for name in names]
+        scales = [scale for _, _, scales in decoded for scale in scales]
+        return images, names, scales
+
+    def shutdown(self):
+        """Shuts down both executors, waiting for any running work to finish."""
+        self.decode_executor.shutdown()
+        self.inference_executor.shutdown()
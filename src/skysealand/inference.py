@@ -1,30 +1,47 @@
+import collections
+import concurrent.futures
+import contextlib
+import dataclasses
+import functools
+import hashlib
 import io
+import json
 import logging
+import mmap
+import os
 import pathlib
+import threading
 import time
-from typing import TypedDict
+from typing import Literal, NotRequired, TypedDict, get_args
 
 import numpy as np
+import torch
 from fastapi import UploadFile
 from PIL import Image
-
-# TODO: Decouple from ultralytics here?
 from ultralytics import YOLO  # pyright: ignore [reportPrivateImportUsage]
 
+from skysealand import boxes
+
 logger = logging.getLogger(__name__)
 
 
-def load_ultralytics_yolo_model(model_path: pathlib.Path, device: str = "cpu") -> YOLO:
+def load_ultralytics_yolo_model(
+    model_path: pathlib.Path, device: str = "cpu", num_threads: int | None = None
+) -> YOLO:
     """
     Load a ultralytics YOLO model at the given path and put it on the specified device.
 
     Args:
         model_path: The path to the serialized YOLO model.
         device: The device to load the model onto (defaults to CPU).
+        num_threads: The number of threads for PyTorch to run operators on on the CPU.
+            This is shared by every model in the process. If None, then it is left as is.
 
     Returns:
         The loaded model.
     """
+    if num_threads is not None:
+        torch.set_num_threads(num_threads)
     logger.info("Loading model: %s ...", model_path)
     model = YOLO(model_path)
     logger.info("Model loaded. Sending to device: %s ...", device)
@@ -34,21 +51,190 @@ def load_ultralytics_yolo_model(model_path: pathlib.Path, device: str = "cpu") -
 
 ALLOWED_FORMATS = {"JPEG", "PNG", "WEBP"}
 
+# The side length, in pixels, of the square images that the model is run on.
+MODEL_IMAGE_SIZE = 640
 
-def _load_and_verify_image_data(data: bytes) -> np.ndarray:
-    """Verifies that the image bytes data can be loaded and converts it to a numpy array."""
-    image = Image.open(io.BytesIO(data))
-    image.verify()
-    image = Image.open(io.BytesIO(data))
+# How much the width and height of a decoded image were scaled down from the original.
+ImageScale = tuple[float, float]
+
+
+def sniff_format(header: bytes) -> str | None:
+    """Identifies the allowed image formats from the first few bytes of the file."""
+    if header.startswith(b"\xff\xd8\xff"):
+        return "JPEG"
+    if header.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "PNG"
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "WEBP"
+    return None
+
+
+def _open_image(data: bytes | mmap.mmap) -> Image.Image:
+    if isinstance(data, mmap.mmap):
+        data.seek(0)
+        return Image.open(data)
+    return Image.open(io.BytesIO(data))
+
+
+def probe_image_size(data: bytes | mmap.mmap) -> tuple[int, int] | None:
+    """
+    Reads the (width, height) of an image from its header, without decoding it.
 
-    if image.format not in ALLOWED_FORMATS:
+    Returns:
+        The size, or None if the data is not an image that can be opened.
+    """
+    try:
+        with _open_image(data) as img:
+            return img.size
+    except Exception:
+        return None
+
+
+def _decode_image(
+    data: bytes | mmap.mmap, target_size: int | None = None
+) -> tuple[np.ndarray, ImageScale]:
+    """
+    Checks and decodes the image bytes data into an RGB numpy array in a single pass.
+
+    The format is checked from the header before anything is decoded,
+    and truncated or corrupt data fails while decoding.
+
+    Args:
+        data: The raw bytes of the image.
+        target_size: If given, JPEGs are decoded at the smallest DCT scale (1/2, 1/4 or 1/8)
+            that still keeps both sides at least this many pixels.
+            Other formats are always decoded at full resolution.
+
+    Returns:
+        The decoded image and how much its width and height were scaled down by.
+    """
+    image = _open_image(data)
+    if sniff_format(bytes(data[:12])) != image.format or image.format not in ALLOWED_FORMATS:
         raise ValueError(f"Unsupported format: {image.format}")
 
-    return np.array(image.convert("RGB"))
+    original_width, original_height = image.size
+    if target_size is not None and image.format == "JPEG":
+        image.draft("RGB", (target_size, target_size))
+
+    # Converting (or loading) is what actually decodes the data.
+    if image.mode == "RGB":
+        image.load()
+    else:
+        image = image.convert("RGB")
+
+    # A copy rather than a read-only view of the image, so that callers can edit it in place.
+    return np.array(image), (original_width / image.width, original_height / image.height)
+
+
+def _load_and_verify_image_data(data: bytes | mmap.mmap) -> np.ndarray:
+    """Verifies that the image bytes data can be loaded and converts it to a numpy array."""
+    return _decode_image(data)[0]
+
+
+def _get_filename(to_load: pathlib.Path | UploadFile) -> str:
+    if isinstance(to_load, pathlib.Path):
+        # The path as given rather than its name, so that images with the same name
+        # in different directories can be told apart, e.g. when resuming a run.
+        return str(to_load)
+    # Should be FastAPI file upload.
+    return to_load.filename if to_load.filename is not None else "<unknown-filename>"
+
+
+def _load_image(
+    to_load: pathlib.Path | UploadFile, use_mmap: bool, target_size: int | None
+) -> tuple[np.ndarray, ImageScale] | Exception:
+    """Loads a single image, returning the error instead of raising it."""
+    try:
+        if not isinstance(to_load, pathlib.Path):
+            return _decode_image(to_load.file.read(), target_size)
+        if not use_mmap:
+            return _decode_image(to_load.read_bytes(), target_size)
+        with (
+            to_load.open("rb") as f,
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped,
+        ):
+            return _decode_image(mapped, target_size)
+    except Exception as e:
+        return e
+
+
+def _collect_loaded(
+    filenames: list[str],
+    loaded: list[tuple[np.ndarray, ImageScale] | Exception],
+    skip_errors: bool,
+) -> tuple[list[np.ndarray], list[str], list[ImageScale]]:
+    images: list[np.ndarray] = []
+    names: list[str] = []
+    scales: list[ImageScale] = []
+
+    for filename, result in zip(filenames, loaded, strict=True):
+        if isinstance(result, Exception):
+            if skip_errors:
+                logger.warning("Unable to load image due to error: %s", str(result))
+                continue
+            raise ValueError(f"Invalid image '{filename}': {result}") from result
+
+        images.append(result[0])
+        names.append(filename)
+        scales.append(result[1])
+
+    return images, names, scales
+
+
+def load_reduced_images(
+    *paths: pathlib.Path | UploadFile,
+    target_size: int | None = MODEL_IMAGE_SIZE,
+    skip_errors: bool = False,
+    num_workers: int = 1,
+    use_mmap: bool = False,
+) -> tuple[list[np.ndarray], list[str], list[ImageScale]]:
+    """
+    Loads all of the given image paths into numpy arrays at close to the model's resolution.
+
+    Decoding a large JPEG straight to about the size that the model resizes it to anyway
+    is several times cheaper in CPU and memory than decoding it at full resolution.
+    Pass the returned scales to ``rescale_results`` to get bounding boxes in the
+    coordinates of the original images.
+
+    Args:
+        paths: The path to all of the images to load.
+        target_size: The size that the images are going to be resized to by the model.
+            If None, then the images are decoded at full resolution.
+        skip_errors: Whether to skip errors with loading images
+            and just log a warning instead. Defaults to false.
+        num_workers: The number of threads to decode the images with.
+            Pillow releases the GIL while decoding, so this scales with the number of cores.
+            Defaults to 1 (decode one image after another).
+        use_mmap: Whether to memory map local files instead of reading them into memory.
+            Defaults to false.
+
+    Returns:
+        A tuple of the image arrays, the names of the files that they came from,
+        and how much each image was scaled down by, for all of the images that were
+        successfully loaded. These are in the same order as the given paths.
+    """
+    logger.info("Loading %d images ...", len(paths))
+
+    load = functools.partial(_load_image, use_mmap=use_mmap, target_size=target_size)
+    if num_workers > 1 and len(paths) > 1:
+        with concurrent.futures.ThreadPoolExecutor(min(num_workers, len(paths))) as pool:
+            loaded = list(pool.map(load, paths))
+    else:
+        loaded = [load(to_load) for to_load in paths]
+
+    images, names, scales = _collect_loaded(
+        [_get_filename(to_load) for to_load in paths], loaded, skip_errors
+    )
+
+    logger.info("Successfully loaded %d images.", len(images))
+    return images, names, scales
 
 
 def load_images(
-    *paths: pathlib.Path | UploadFile, skip_errors: bool = False
+    *paths: pathlib.Path | UploadFile,
+    skip_errors: bool = False,
+    num_workers: int = 1,
+    use_mmap: bool = False,
 ) -> tuple[list[np.ndarray], list[str]]:
     """
     Loads all of the given image paths into numpy arrays.
@@ -57,36 +243,80 @@ def load_images(
         paths: The path to all of the images to load.
         skip_errors: Whether to skip errors with loading images
             and just log a warning instead. Defaults to false.
+        num_workers: The number of threads to decode the images with.
+            Pillow releases the GIL while decoding, so this scales with the number of cores.
+            Defaults to 1 (decode one image after another).
+        use_mmap: Whether to memory map local files instead of reading them into memory.
+            Defaults to false.
 
     Returns:
         A tuple of the image arrays and the names of the files that
         they came from for all of the images that were successfully loaded.
+        These are in the same order as the given paths.
     """
-    logger.info("Loading %d images ...", len(paths))
+    images, names, _ = load_reduced_images(
+        *paths,
+        target_size=None,
+        skip_errors=skip_errors,
+        num_workers=num_workers,
+        use_mmap=use_mmap,
+    )
+    return images, names
 
-    images: list[np.ndarray] = []
-    names: list[str] = []
 
-    for to_load in paths:
-        filename = "<unknown-filename>"
+def decode_reduced_images(
+    *named_data: tuple[str, bytes],
+    target_size: int | None = MODEL_IMAGE_SIZE,
+    skip_errors: bool = False,
+) -> tuple[list[np.ndarray], list[str], list[ImageScale]]:
+    """
+    Decodes image bytes that have already been read into numpy arrays
+    at close to the model's resolution.
+
+    This is the counterpart of ``load_reduced_images`` for callers that read the raw bytes
+    themselves, e.g. asynchronously, and want to decode them somewhere else.
+
+    Args:
+        named_data: Pairs of the name of the file and its raw bytes.
+        target_size: The size that the images are going to be resized to by the model.
+            If None, then the images are decoded at full resolution.
+        skip_errors: Whether to skip errors with decoding images
+            and just log a warning instead. Defaults to false.
+
+    Returns:
+        A tuple of the image arrays, the names of the files that they came from,
+        and how much each image was scaled down by, for all of the images that were
+        successfully decoded.
+    """
+    loaded: list[tuple[np.ndarray, ImageScale] | Exception] = []
+    for _, data in named_data:
         try:
-            if isinstance(to_load, pathlib.Path):
-                filename = to_load.name
-                data = to_load.read_bytes()
-            else:  # Should be FastAPI file upload.
-                filename = to_load.filename if to_load.filename is not None else filename
-                data = to_load.file.read()
-            img = _load_and_verify_image_data(data)
+            loaded.append(_decode_image(data, target_size))
         except Exception as e:
-            if skip_errors:
-                logger.warning("Unable to load image due to error: %s", str(e))
-                continue
-            raise ValueError(f"Invalid image '{filename}': {e}") from e
+            loaded.append(e)
 
-        images.append(img)
-        names.append(filename)
+    return _collect_loaded([filename for filename, _ in named_data], loaded, skip_errors)
 
-    logger.info("Successfully loaded %d images.", len(images))
+
+def decode_images(
+    *named_data: tuple[str, bytes], skip_errors: bool = False
+) -> tuple[list[np.ndarray], list[str]]:
+    """
+    Decodes image bytes that have already been read into numpy arrays.
+
+    This is the counterpart of ``load_images`` for callers that read the raw bytes
+    themselves, e.g. asynchronously, and want to decode them somewhere else.
+
+    Args:
+        named_data: Pairs of the name of the file and its raw bytes.
+        skip_errors: Whether to skip errors with decoding images
+            and just log a warning instead. Defaults to false.
+
+    Returns:
+        A tuple of the image arrays and the names of the files that
+        they came from for all of the images that were successfully decoded.
+    """
+    images, names, _ = decode_reduced_images(*named_data, target_size=None, skip_errors=skip_errors)
     return images, names
 
 
@@ -98,35 +328,171 @@ class Detection(TypedDict):
     bbox: tuple[float, float, float, float]
 
 
-def process_ultralytics_yolo_batched_detections(results) -> list[list[Detection]]:
+class ColumnarDetections(TypedDict):
     """
-    Reformats the output of the ultralytics YOLO model into a json friendly format.
+    The bounding box predictions for one image with one array per field,
+    for callers that don't need a ``Detection`` per box.
+    """
+
+    # (N, 4) float32 array of the corners of each box: x_min, y_min, x_max, y_max.
+    boxes: np.ndarray
+    # (N,) float32 array of the confidence of each box.
+    scores: np.ndarray
+    # (N,) int64 array of the class of each box.
+    class_ids: np.ndarray
+
+
+def _to_numpy(values) -> np.ndarray:
+    """Transfers a (possibly torch) array to numpy in one go."""
+    if hasattr(values, "cpu"):
+        values = values.cpu().numpy()
+    return np.asarray(values)
+
+
+def process_ultralytics_yolo_batched_detections_columnar(results) -> list[ColumnarDetections]:
+    """
+    Converts the output of the ultralytics YOLO model into arrays of boxes, scores and classes.
+
+    Each field is moved off of the model's device with a single transfer per image
+    instead of one per box.
 
     Args:
         results: The output of an ultralytics YOLO model.
 
     Returns:
-        The output processed into our app's API format.
+        The detections for each image as columnar arrays.
     """
-
-    logger.info("Recieved %s results to process.", len(results))
-    batch_detections: list[list[Detection]] = []
+    batch_detections: list[ColumnarDetections] = []
 
     for r in results:
-        detections: list[Detection] = []
-        for box in r.boxes:
-            detections.append(
+        boxes = r.boxes
+        if boxes is None:
+            batch_detections.append(
                 {
-                    "class_id": int(box.cls.item()),
-                    "confidence": float(box.conf.item()),
-                    "bbox": tuple(box.xyxy[0].tolist()),
+                    "boxes": np.empty((0, 4), dtype=np.float32),
+                    "scores": np.empty(0, dtype=np.float32),
+                    "class_ids": np.empty(0, dtype=np.int64),
                 }
             )
-        batch_detections.append(detections)
+            continue
+        batch_detections.append(
+            {
+                "boxes": _to_numpy(boxes.xyxy).astype(np.float32, copy=False).reshape(-1, 4),
+                "scores": _to_numpy(boxes.conf).astype(np.float32, copy=False).reshape(-1),
+                "class_ids": _to_numpy(boxes.cls).astype(np.int64).reshape(-1),
+            }
+        )
 
     return batch_detections
 
 
+def columnar_to_detections(columnar: ColumnarDetections) -> list[Detection]:
+    """
+    Converts the columnar detections for one image into our app's API format.
+
+    Args:
+        columnar: The detections for one image as columnar arrays.
+
+    Returns:
+        A json friendly ``Detection`` for each box.
+    """
+    return [
+        {"class_id": class_id, "confidence": score, "bbox": tuple(box)}
+        for box, score, class_id in zip(
+            columnar["boxes"].tolist(),
+            columnar["scores"].tolist(),
+            columnar["class_ids"].tolist(),
+            strict=True,
+        )
+    ]
+
+
+def process_ultralytics_yolo_batched_detections(results) -> list[list[Detection]]:
+    """
+    Reformats the output of the ultralytics YOLO model into a json friendly format.
+
+    Args:
+        results: The output of an ultralytics YOLO model.
+
+    Returns:
+        The output processed into our app's API format.
+    """
+
+    logger.info("Recieved %s results to process.", len(results))
+    return [
+        columnar_to_detections(columnar)
+        for columnar in process_ultralytics_yolo_batched_detections_columnar(results)
+    ]
+
+
+Stage = Literal["read", "decode", "preprocess", "forward", "postprocess", "serialize"]
+
+
+class StageTimes(TypedDict, total=False):
+    """How many seconds each stage of handling some images took. Stages that did not run are left out."""
+
+    # Reading the uploaded files.
+    read: float
+    # Decoding the files into images.
+    decode: float
+    # Letterboxing and normalizing the images for the model.
+    preprocess: float
+    # The forward pass of the model.
+    forward: float
+    # NMS and converting the model output into ``Detection``s.
+    postprocess: float
+    # Encoding the response.
+    serialize: float
+
+
+@contextlib.contextmanager
+def time_stage(stage_times: StageTimes | None, stage: Stage):
+    """Adds the time spent in the ``with`` block to the given stage, if ``stage_times`` is given."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if stage_times is not None:
+            stage_times[stage] = stage_times.get(stage, 0.0) + time.perf_counter() - start
+
+
+def sum_stage_times(*stage_times: StageTimes) -> StageTimes:
+    """Adds up the time of each stage across several runs."""
+    total: StageTimes = {}
+    for times in stage_times:
+        for stage in get_args(Stage):
+            if stage in times:
+                total[stage] = total.get(stage, 0.0) + times[stage]
+    return total
+
+
+def detect(
+    model, images: list[np.ndarray], stage_times: StageTimes | None = None
+) -> list[list[Detection]]:
+    """
+    Runs the model on the given images and reformats its output into a json friendly format.
+
+    Args:
+        model: A backend from ``skysealand.backends``,
+            or anything that is called like an ultralytics YOLO model.
+        images: The images to input to the model.
+        stage_times: If given, the time spent in each stage is added to it.
+            Backends break down their own time, but a plain callable model
+            is counted entirely as the forward pass.
+
+    Returns:
+        The detections for each image in our app's API format.
+    """
+    if hasattr(model, "detect"):
+        columnar = model.detect(images, stage_times=stage_times)
+        with time_stage(stage_times, "postprocess"):
+            return [columnar_to_detections(c) for c in columnar]
+    with time_stage(stage_times, "forward"):
+        results = model(images)
+    with time_stage(stage_times, "postprocess"):
+        return process_ultralytics_yolo_batched_detections(results)
+
+
 class SingleInferenceJsonOutput(TypedDict):
     filename: str
     inference: list[Detection]
@@ -135,6 +501,19 @@ class SingleInferenceJsonOutput(TypedDict):
 class InferenceMetaData(TypedDict):
     num_images: int
     inference_time_sec: float
+    # Only present when the images were run as part of a micro-batch.
+    queue_time_sec: NotRequired[float]
+    batch_size: NotRequired[int]
+    batch_fill_ratio: NotRequired[float]
+    # Only present for tiled inference, see ``run_tiled_model_with_timing``.
+    num_tiles: NotRequired[int]
+    # Only present when a ``DetectionCache`` was used.
+    cache_hits: NotRequired[int]
+    # Only present for video inference, where ``num_images`` counts the frames that were run.
+    num_frames: NotRequired[int]
+    reused_frames: NotRequired[int]
+    # How long each stage took. The model stages are shared by everything in the batch.
+    stage_times_sec: NotRequired[StageTimes]
 
 
 class InferenceJsonOutput(TypedDict):
@@ -142,18 +521,95 @@ class InferenceJsonOutput(TypedDict):
     metrics: InferenceMetaData
 
 
+def make_inference_output(
+    filenames: list[str],
+    detections: list[list[Detection]],
+    inference_time: float,
+    stage_times: StageTimes | None = None,
+) -> InferenceJsonOutput:
+    """
+    Pairs up the detections for each image with its filename
+    and adds the metadata about the inference.
+
+    Args:
+        filenames: The names of the files that the images originated from.
+        detections: The detections for each image, in the same order as ``filenames``.
+        inference_time: How long the inference took in seconds.
+        stage_times: How long each stage of the inference took, see ``detect``.
+
+    Returns:
+        A json object containing the results of the inference
+        and metadata about this inference.
+    """
+    response: list[SingleInferenceJsonOutput] = [
+        {"filename": name, "inference": output}
+        for name, output in zip(filenames, detections, strict=True)
+    ]
+
+    logger.info(
+        "Inference complete | images=%d | inference_time=%.3fs",
+        len(filenames),
+        inference_time,
+    )
+
+    metrics: InferenceMetaData = {
+        "num_images": len(filenames),
+        "inference_time_sec": inference_time,
+    }
+    if stage_times is not None:
+        metrics["stage_times_sec"] = stage_times
+    return {"results": response, "metrics": metrics}
+
+
+def rescale_results(
+    results: list[SingleInferenceJsonOutput], scales: list[ImageScale]
+) -> list[SingleInferenceJsonOutput]:
+    """
+    Maps the bounding boxes of images that were decoded at a reduced resolution
+    back into the coordinates of the original images.
+
+    Args:
+        results: The inference results for the reduced images.
+        scales: How much each image was scaled down by,
+            as returned by ``load_reduced_images``.
+
+    Returns:
+        The results with the bounding boxes in original image coordinates.
+    """
+    rescaled: list[SingleInferenceJsonOutput] = []
+    for result, (scale_x, scale_y) in zip(results, scales, strict=True):
+        if scale_x == 1 and scale_y == 1:
+            rescaled.append(result)
+            continue
+        detections: list[Detection] = [
+            {
+                "class_id": det["class_id"],
+                "confidence": det["confidence"],
+                "bbox": (
+                    det["bbox"][0] * scale_x,
+                    det["bbox"][1] * scale_y,
+                    det["bbox"][2] * scale_x,
+                    det["bbox"][3] * scale_y,
+                ),
+            }
+            for det in result["inference"]
+        ]
+        rescaled.append({"filename": result["filename"], "inference": detections})
+    return rescaled
+
+
 def run_model_with_timing(
-    model: YOLO, images: list[np.ndarray], filenames: list[str]
+    model, images: list[np.ndarray], filenames: list[str]
 ) -> InferenceJsonOutput:
     """
     Runs the given model on the given images and outputs
     the results in a json friendly format.
 
     The output also contains metadata about this inference,
-    e.g. how long it took, how many images were analyzed, etc.
+    e.g. how long it took and in which stages, how many images were analyzed, etc.
 
     Args:
-        model: The YOLO model to run
+        model: The model to run, see ``detect``.
         images: The images to input to the model
         filenames: The names of the files that the images
             originated from.
@@ -163,26 +619,533 @@ def run_model_with_timing(
         and metadata about this inference.
     """
     logger.info("Running inference. This may take a minute ...")
+    stage_times: StageTimes = {}
     inference_start = time.perf_counter()
-    raw_outputs = model(images)
-    outputs = process_ultralytics_yolo_batched_detections(raw_outputs)
+    outputs = detect(model, images, stage_times)
     inference_time = time.perf_counter() - inference_start
 
-    response: list[SingleInferenceJsonOutput] = [
-        {"filename": name, "inference": output}
-        for name, output in zip(filenames, outputs, strict=True)
-    ]
+    return make_inference_output(filenames, outputs, inference_time, stage_times)
 
-    logger.info(
-        "Inference complete | images=%d | inference_time=%.3fs",
-        len(images),
-        inference_time,
+
+def hash_image_data(data: bytes) -> str:
+    """A fast content hash of the raw bytes of an image."""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def model_fingerprint(model_path: pathlib.Path) -> str:
+    """
+    Hashes the weights file of a model so that cached results are tied to those exact weights.
+
+    Args:
+        model_path: The path to the serialized model.
+            If there is no such file, e.g. for a model that ultralytics downloads by name,
+            then the path itself is hashed instead.
+
+    Returns:
+        The fingerprint of the model.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    if not model_path.is_file():
+        digest.update(str(model_path).encode())
+        return digest.hexdigest()
+    with model_path.open("rb") as f:
+        while chunk := f.read(1 << 20):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# Rough in-memory sizes of a cache entry and of each of its detections, in bytes.
+_CACHE_ENTRY_BYTES = 200
+_CACHE_DETECTION_BYTES = 400
+
+
+class CacheStats(TypedDict):
+    hits: int
+    misses: int
+    evictions: int
+    memory_entries: int
+    memory_bytes: int
+
+
+class DetectionCache:
+    """
+    A content addressed cache of the detections for each image.
+
+    Entries are keyed by a hash of the raw image bytes together with the fingerprint
+    of the model, so identical uploads skip both decoding and the model,
+    and changing the weights never returns stale results.
+    Recently used entries are kept in memory up to ``max_memory_bytes``,
+    and every entry is also written to ``disk_dir``, if given,
+    so that the cache survives restarts.
+    The cache is safe to use from several threads.
+
+    Args:
+        fingerprint: The fingerprint of the model, see ``model_fingerprint``.
+        max_memory_bytes: The most (approximate) bytes of detections to keep in memory.
+        disk_dir: The directory of the on-disk tier. If None, then only memory is used.
+    """
+
+    def __init__(
+        self,
+        fingerprint: str,
+        max_memory_bytes: int = 64 * 1024 * 1024,
+        disk_dir: pathlib.Path | None = None,
+    ):
+        self.fingerprint = fingerprint
+        self.max_memory_bytes = max_memory_bytes
+        self.disk_dir = disk_dir
+        if disk_dir is not None:
+            (disk_dir / fingerprint).mkdir(parents=True, exist_ok=True)
+
+        self._entries: collections.OrderedDict[str, tuple[list[Detection], int]] = (
+            collections.OrderedDict()
+        )
+        self._memory_bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._lock = threading.Lock()
+
+    def key(self, data: bytes) -> str:
+        """The cache key of the given raw image bytes."""
+        return hash_image_data(data)
+
+    def get(self, key: str) -> list[Detection] | None:
+        """
+        Looks up the detections for an image, first in memory and then on disk.
+
+        Args:
+            key: The cache key of the image, see ``key``.
+
+        Returns:
+            The cached detections, or None if the image has not been seen before.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return entry[0]
+
+        detections = self._read_disk(key)
+        with self._lock:
+            if detections is None:
+                self._misses += 1
+                return None
+            self._hits += 1
+            self._put_memory(key, detections)
+        return detections
+
+    def put(self, key: str, detections: list[Detection]):
+        """
+        Stores the detections for an image.
+
+        Args:
+            key: The cache key of the image, see ``key``.
+            detections: The detections for the image, in original image coordinates.
+        """
+        with self._lock:
+            self._put_memory(key, detections)
+        self._write_disk(key, detections)
+
+    def record_hit(self):
+        """Counts a duplicate image that was answered without running the model."""
+        with self._lock:
+            self._hits += 1
+
+    def stats(self) -> CacheStats:
+        """The hit and miss counters and the size of the in-memory tier."""
+        with self._lock:
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "memory_entries": len(self._entries),
+                "memory_bytes": self._memory_bytes,
+            }
+
+    def _put_memory(self, key: str, detections: list[Detection]):
+        """Adds an entry to the in-memory tier. The lock must be held."""
+        if key in self._entries:
+            self._memory_bytes -= self._entries.pop(key)[1]
+        size = _CACHE_ENTRY_BYTES + len(detections) * _CACHE_DETECTION_BYTES
+        self._entries[key] = (detections, size)
+        self._memory_bytes += size
+        while self._memory_bytes > self.max_memory_bytes and self._entries:
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self._memory_bytes -= evicted_size
+            self._evictions += 1
+
+    def _disk_path(self, key: str) -> pathlib.Path:
+        assert self.disk_dir is not None
+        return self.disk_dir / self.fingerprint / f"{key}.json"
+
+    def _read_disk(self, key: str) -> list[Detection] | None:
+        if self.disk_dir is None:
+            return None
+        try:
+            records = json.loads(self._disk_path(key).read_bytes())
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError):
+            logger.warning("Ignoring unreadable cache entry %s", key, exc_info=True)
+            return None
+        return [
+            {"class_id": r["class_id"], "confidence": r["confidence"], "bbox": tuple(r["bbox"])}
+            for r in records
+        ]
+
+    def _write_disk(self, key: str, detections: list[Detection]):
+        if self.disk_dir is None:
+            return
+        path = self._disk_path(key)
+        # Write then rename so that readers never see a partially written entry.
+        tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            tmp_path.write_text(json.dumps(detections))
+            tmp_path.replace(path)
+        except OSError:
+            logger.warning("Unable to write cache entry %s", key, exc_info=True)
+
+
+@dataclasses.dataclass
+class CachedBatch:
+    """
+    A batch of images split into the ones that were found in a ``DetectionCache``
+    and the ones that still need to be run through the model.
+
+    Made by ``prepare_cached_batch`` and finished by ``complete_cached_batch``.
+    """
+
+    # The name and cache key of every image in the batch that was decoded or cached, in order.
+    filenames: list[str] = dataclasses.field(default_factory=list)
+    keys: list[str] = dataclasses.field(default_factory=list)
+    # The cached detections of each image, or None if it still needs to be run.
+    detections: list[list[Detection] | None] = dataclasses.field(default_factory=list)
+    # One decoded image per distinct key that needs to be run, named by its key.
+    images: list[np.ndarray] = dataclasses.field(default_factory=list)
+    image_keys: list[str] = dataclasses.field(default_factory=list)
+    scales: list[ImageScale] = dataclasses.field(default_factory=list)
+    # The number of images that don't need to be run, from the cache or duplicates.
+    cache_hits: int = 0
+
+
+def lookup_cached_batch(
+    cache: DetectionCache, named_data: list[tuple[str, bytes]]
+) -> tuple[CachedBatch, list[tuple[str, bytes]]]:
+    """
+    Looks up the given images in the cache without decoding anything.
+
+    Images with the same bytes only need to be run once, even within a single batch.
+
+    Args:
+        cache: The cache of detections.
+        named_data: Pairs of the name of the file and its raw bytes.
+
+    Returns:
+        The batch without any decoded images, and the name and bytes of one image
+        per distinct key in ``image_keys`` that still needs to be decoded and run.
+        Once decoded, fill in ``images`` and ``scales`` in the same order.
+    """
+    batch = CachedBatch()
+    misses: list[tuple[str, bytes]] = []
+    missing_keys: set[str] = set()
+    for filename, data in named_data:
+        key = cache.key(data)
+        if key in missing_keys:
+            cached = None
+            cache.record_hit()
+        else:
+            cached = cache.get(key)
+            if cached is None:
+                missing_keys.add(key)
+                batch.image_keys.append(key)
+                misses.append((filename, data))
+        batch.filenames.append(filename)
+        batch.keys.append(key)
+        batch.detections.append(cached)
+
+    batch.cache_hits = len(batch.filenames) - len(batch.image_keys)
+    return batch, misses
+
+
+def prepare_cached_batch(
+    cache: DetectionCache,
+    named_data: list[tuple[str, bytes]],
+    target_size: int | None = MODEL_IMAGE_SIZE,
+    skip_errors: bool = False,
+    num_workers: int = 1,
+) -> CachedBatch:
+    """
+    Looks up the given images in the cache and decodes only the ones that are missing.
+
+    Args:
+        cache: The cache of detections.
+        named_data: Pairs of the name of the file and its raw bytes.
+        target_size: The size that the images are going to be resized to by the model.
+            See ``decode_reduced_images``.
+        skip_errors: Whether to skip errors with decoding images
+            and just log a warning instead. Defaults to false.
+        num_workers: The number of threads to decode the missing images with.
+            Defaults to 1.
+
+    Returns:
+        The batch, with the images to run through the model.
+    """
+    batch, misses = lookup_cached_batch(cache, named_data)
+
+    def decode(data: bytes) -> tuple[np.ndarray, ImageScale] | Exception:
+        try:
+            return _decode_image(data, target_size)
+        except Exception as e:
+            return e
+
+    if num_workers > 1 and len(misses) > 1:
+        with concurrent.futures.ThreadPoolExecutor(min(num_workers, len(misses))) as pool:
+            decoded = list(pool.map(decode, [data for _, data in misses]))
+    else:
+        decoded = [decode(data) for _, data in misses]
+
+    failed: set[str] = set()
+    image_keys = batch.image_keys
+    batch.image_keys = []
+    for key, (filename, _), result in zip(image_keys, misses, decoded, strict=True):
+        if isinstance(result, Exception):
+            if not skip_errors:
+                raise ValueError(f"Invalid image '{filename}': {result}") from result
+            logger.warning("Unable to load image due to error: %s", str(result))
+            failed.add(key)
+            continue
+        batch.images.append(result[0])
+        batch.image_keys.append(key)
+        batch.scales.append(result[1])
+
+    if failed:
+        kept = [i for i, key in enumerate(batch.keys) if key not in failed]
+        batch.filenames = [batch.filenames[i] for i in kept]
+        batch.keys = [batch.keys[i] for i in kept]
+        batch.detections = [batch.detections[i] for i in kept]
+    batch.cache_hits = len(batch.filenames) - len(batch.images)
+    return batch
+
+
+def complete_cached_batch(
+    cache: DetectionCache, batch: CachedBatch, computed: InferenceJsonOutput | None
+) -> InferenceJsonOutput:
+    """
+    Stores the newly computed detections in the cache and puts together the whole batch.
+
+    Args:
+        cache: The cache of detections.
+        batch: The batch from ``prepare_cached_batch``.
+        computed: The output of running the model on ``batch.images``
+            named by ``batch.image_keys``, or None if there were no images to run.
+
+    Returns:
+        The results for every image in the batch, in order, in original image coordinates.
+        The metrics are those of ``computed``, with the number of images in the whole batch
+        and how many of them were answered from the cache.
+    """
+    computed_detections: dict[str, list[Detection]] = {}
+    if computed is not None:
+        for result in rescale_results(computed["results"], batch.scales):
+            cache.put(result["filename"], result["inference"])
+            computed_detections[result["filename"]] = result["inference"]
+
+    results: list[SingleInferenceJsonOutput] = [
+        {
+            "filename": filename,
+            "inference": cached if cached is not None else computed_detections[key],
+        }
+        for filename, key, cached in zip(batch.filenames, batch.keys, batch.detections, strict=True)
+    ]
+    metrics: InferenceMetaData = (
+        {**computed["metrics"]}
+        if computed is not None
+        else {"num_images": 0, "inference_time_sec": 0.0}
     )
+    metrics["num_images"] = len(results)
+    metrics["cache_hits"] = batch.cache_hits
+    return {"results": results, "metrics": metrics}
+
+
+# How much neighbouring tiles overlap by default, in pixels, so that objects cut by
+# the edge of one tile are whole in the next.
+TILE_OVERLAP = 64
+# The IoU above which detections of the same object from overlapping tiles are merged.
+TILE_IOU_THRESHOLD = 0.5
+
+
+def _tile_starts(length: int, tile_size: int, overlap: int) -> list[int]:
+    """Where each tile starts along one side, with the last tile flush with the end."""
+    if length <= tile_size:
+        return [0]
+    starts = list(range(0, length - tile_size, tile_size - overlap))
+    starts.append(length - tile_size)
+    return starts
+
+
+@dataclasses.dataclass
+class TiledImages:
+    """
+    Overlapping square tiles cut out of a batch of images, made by ``tile_images``.
+
+    The tiles are views into the original images, not copies.
+    """
+
+    tiles: list[np.ndarray] = dataclasses.field(default_factory=list)
+    # The (x, y) of the top left corner of each tile in its image.
+    offsets: list[tuple[int, int]] = dataclasses.field(default_factory=list)
+    # The index of the image that each tile was cut out of.
+    image_indices: list[int] = dataclasses.field(default_factory=list)
+    num_images: int = 0
+
+
+def tile_images(
+    images: list[np.ndarray], tile_size: int, overlap: int = TILE_OVERLAP
+) -> TiledImages:
+    """
+    Cuts each image into overlapping tiles of at most ``tile_size`` by ``tile_size`` pixels.
+
+    Args:
+        images: The images to cut up.
+        tile_size: The side length of the tiles in pixels.
+            Images that are smaller than this are kept whole.
+        overlap: How many pixels neighbouring tiles share.
+
+    Returns:
+        The tiles of all of the images, in order.
+    """
+    if tile_size < 1:
+        raise ValueError(f"tile_size must be positive, got {tile_size}")
+    if not 0 <= overlap < tile_size:
+        raise ValueError(f"The tile overlap must be in [0, {tile_size}), got {overlap}")
+
+    tiled = TiledImages(num_images=len(images))
+    for image_index, image in enumerate(images):
+        height, width = image.shape[:2]
+        for y in _tile_starts(height, tile_size, overlap):
+            for x in _tile_starts(width, tile_size, overlap):
+                tiled.tiles.append(image[y : y + tile_size, x : x + tile_size])
+                tiled.offsets.append((x, y))
+                tiled.image_indices.append(image_index)
+    return tiled
+
+
+def merge_tile_detections(
+    tiled: TiledImages,
+    tile_detections: list[list[Detection]],
+    iou_threshold: float = TILE_IOU_THRESHOLD,
+) -> list[list[Detection]]:
+    """
+    Maps the detections in each tile back into the coordinates of its image
+    and merges the duplicates from where the tiles overlap.
+
+    Args:
+        tiled: The tiles that the detections were found in.
+        tile_detections: The detections for each tile.
+        iou_threshold: The IoU above which two detections of the same class
+            are taken to be the same object, keeping the more confident one.
+
+    Returns:
+        The detections for each of the original images.
+    """
+    counts = [len(dets) for dets in tile_detections]
+    flat = [det for dets in tile_detections for det in dets]
+    tile_of_box = np.repeat(np.arange(len(tile_detections)), counts)
+
+    offsets = np.array(tiled.offsets, dtype=np.float64).reshape(-1, 2)
+    xyxy = np.array([det["bbox"] for det in flat], dtype=np.float64).reshape(-1, 4)
+    xyxy += np.tile(offsets[tile_of_box], 2)
+    scores = np.array([det["confidence"] for det in flat], dtype=np.float64)
+    class_ids = np.array([det["class_id"] for det in flat], dtype=np.int64)
+    image_of_box = np.array(tiled.image_indices, dtype=np.int64)[tile_of_box]
+
+    merged: list[list[Detection]] = []
+    for image_index in range(tiled.num_images):
+        (in_image,) = np.nonzero(image_of_box == image_index)
+        keep = in_image[
+            boxes.batched_nms(xyxy[in_image], scores[in_image], class_ids[in_image], iou_threshold)
+        ]
+        merged.append(
+            columnar_to_detections(
+                {"boxes": xyxy[keep], "scores": scores[keep], "class_ids": class_ids[keep]}
+            )
+        )
+    return merged
+
+
+def merge_tile_outputs(
+    tiled: TiledImages, filenames: list[str], tile_outputs: list[InferenceJsonOutput]
+) -> InferenceJsonOutput:
+    """
+    Puts together the outputs of running the model on the tiles of some images,
+    see ``merge_tile_detections``.
+
+    Args:
+        tiled: The tiles that the model was run on.
+        filenames: The names of the files that the original images came from.
+        tile_outputs: The outputs of running the model on all of the tiles, in order,
+            in as many parts as they were run in.
 
+    Returns:
+        The results for each of the original images, and the total inference time.
+    """
+    detections = merge_tile_detections(
+        tiled, [result["inference"] for output in tile_outputs for result in output["results"]]
+    )
     return {
-        "results": response,
+        "results": [
+            {"filename": name, "inference": dets}
+            for name, dets in zip(filenames, detections, strict=True)
+        ],
         "metrics": {
-            "num_images": len(images),
-            "inference_time_sec": inference_time,
+            "num_images": len(filenames),
+            "inference_time_sec": sum(o["metrics"]["inference_time_sec"] for o in tile_outputs),
+            "num_tiles": len(tiled.tiles),
+            "stage_times_sec": sum_stage_times(
+                *(o["metrics"].get("stage_times_sec", {}) for o in tile_outputs)
+            ),
         },
     }
+
+
+def run_tiled_model_with_timing(  # noqa: PLR0913
+    model,
+    images: list[np.ndarray],
+    filenames: list[str],
+    *,
+    tile_size: int,
+    overlap: int = TILE_OVERLAP,
+    max_tiles_per_batch: int = 16,
+) -> InferenceJsonOutput:
+    """
+    Runs the model on overlapping tiles of each image instead of the whole image,
+    so that small objects in very large images keep enough pixels to be found.
+
+    The tiles of all of the images are run through the model together,
+    ``max_tiles_per_batch`` at a time. The images should be decoded at full resolution.
+
+    Args:
+        model: The model to run, see ``detect``.
+        images: The images to input to the model.
+        filenames: The names of the files that the images originated from.
+        tile_size: The side length of the tiles in pixels.
+        overlap: How many pixels neighbouring tiles share.
+        max_tiles_per_batch: The most tiles to run through the model at once.
+
+    Returns:
+        A json object containing the results of the inference
+        and metadata about this inference.
+    """
+    tiled = tile_images(images, tile_size, overlap)
+    logger.info("Running inference on %d tiles of %d images ...", len(tiled.tiles), len(images))
+    tile_outputs = [
+        run_model_with_timing(
+            model,
+            tiled.tiles[start : start + max_tiles_per_batch],
+            [str(i) for i in range(start, min(start + max_tiles_per_batch, len(tiled.tiles)))],
+        )
+        for start in range(0, len(tiled.tiles), max_tiles_per_batch)
+    ]
+    return merge_tile_outputs(tiled, filenames, tile_outputs)
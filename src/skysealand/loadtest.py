@@ -0,0 +1,378 @@
+"""
+Load tests for the inference API, to find out how many concurrent requests it can take.
+
+Requests with synthetic JPEG uploads are sent to either the ASGI app in this process,
+so that no server needs to be started, or to a server at a URL, e.g. one started with
+``uvicorn skysealand.api:app``. Each concurrency level is run for a fixed duration and
+reports latency percentiles, error rates and throughput. ``saturation_point`` finds the
+level beyond which more concurrency stops adding throughput.
+
+This needs the optional ``httpx`` package.
+"""
+
+import asyncio
+import collections
+import contextlib
+import io
+import itertools
+import json
+import logging
+import os
+import pathlib
+import time
+from typing import TypedDict
+
+import numpy as np
+from PIL import Image
+
+from skysealand import bench
+
+try:
+    import httpx
+except ImportError:  # Optional dependency, only needed for load testing.
+    httpx = None
+
+logger = logging.getLogger(__name__)
+
+CONCURRENCY_LEVELS = (1, 2, 4, 8, 16)
+DURATION_SEC = 10.0
+IMAGES_PER_REQUEST = 1
+# The widths of the uploaded images, see ``bench.synthetic_image``.
+RESOLUTIONS = (1280,)
+# How many distinct images to make for each resolution.
+NUM_DISTINCT_IMAGES = 8
+# A level whose throughput is less than this fraction higher than the previous level's is saturated.
+SATURATION_MIN_GAIN = 0.1
+REQUEST_TIMEOUT_SEC = 60.0
+
+
+class LevelResult(TypedDict):
+    concurrency: int
+    # The target number of requests per second, or None if every worker sent requests back to back.
+    rate: float | None
+    num_requests: int
+    num_errors: int
+    error_rate: float
+    # The number of responses with each status code, or exception name for failed requests.
+    statuses: dict[str, int]
+    requests_per_sec: float
+    images_per_sec: float
+    # Latencies of the successful requests.
+    p50_ms: float
+    p95_ms: float
+    p99_ms: float
+    max_ms: float
+
+
+class LoadTestReport(TypedDict):
+    target: str
+    images_per_request: int
+    resolutions: list[int]
+    duration_sec: float
+    levels: list[LevelResult]
+    # The concurrency level at which the server was saturated, if it was.
+    saturation_concurrency: int | None
+
+
+def _require_httpx():
+    if httpx is None:
+        raise ValueError("Load testing requires the `httpx` package.")
+    return httpx
+
+
+def synthetic_uploads(
+    resolutions: tuple[int, ...] = RESOLUTIONS, num_images: int = NUM_DISTINCT_IMAGES
+) -> list[bytes]:
+    """Encodes synthetic images of the given widths as JPEGs, see ``bench.synthetic_image``."""
+    rng = np.random.default_rng(0)
+    uploads = []
+    for resolution in resolutions:
+        for _ in range(num_images):
+            buffer = io.BytesIO()
+            Image.fromarray(bench.synthetic_image(resolution, rng)).save(
+                buffer, format="JPEG", quality=90
+            )
+            uploads.append(buffer.getvalue())
+    return uploads
+
+
+class _Payloads:
+    """Hands out the files of each request, cycling through the uploads."""
+
+    def __init__(self, uploads: list[bytes], images_per_request: int, unique: bool):
+        self._uploads = itertools.cycle(uploads)
+        self.images_per_request = images_per_request
+        self._unique = unique
+        self._count = itertools.count()
+
+    def next(self) -> list[tuple[str, tuple[str, bytes, str]]]:
+        files = []
+        for _ in range(self.images_per_request):
+            data = next(self._uploads)
+            if self._unique:
+                # Decoders ignore anything after the end of a JPEG, but it changes the hash,
+                # so that the server's detection cache cannot answer the request.
+                data += os.urandom(16)
+            files.append(("files", (f"load_{next(self._count)}.jpg", data, "image/jpeg")))
+        return files
+
+
+def summarize_level(  # noqa: PLR0913
+    latencies: list[float],
+    statuses: dict[str, int],
+    *,
+    concurrency: int,
+    rate: float | None,
+    elapsed_sec: float,
+    images_per_request: int,
+) -> LevelResult:
+    """
+    Summarizes the requests of one concurrency level.
+
+    Args:
+        latencies: How long each successful request took in seconds.
+        statuses: The number of responses with each status code or exception name.
+        concurrency: The most requests that were in flight at once.
+        rate: The target number of requests per second, if any.
+        elapsed_sec: How long the level ran for.
+        images_per_request: How many images each request uploaded.
+
+    Returns:
+        The throughput, error rate and latency percentiles of the level.
+    """
+    num_requests = sum(statuses.values())
+    num_errors = num_requests - len(latencies)
+    p50, p95, p99, max_latency = (
+        np.percentile(latencies, [50, 95, 99, 100]) * 1000 if latencies else [float("nan")] * 4
+    )
+    result: LevelResult = {
+        "concurrency": concurrency,
+        "rate": rate,
+        "num_requests": num_requests,
+        "num_errors": num_errors,
+        "error_rate": num_errors / max(num_requests, 1),
+        "statuses": dict(sorted(statuses.items())),
+        "requests_per_sec": len(latencies) / elapsed_sec,
+        "images_per_sec": len(latencies) * images_per_request / elapsed_sec,
+        "p50_ms": float(p50),
+        "p95_ms": float(p95),
+        "p99_ms": float(p99),
+        "max_ms": float(max_latency),
+    }
+    logger.info(
+        "Concurrency %d | requests/sec=%.2f | p50=%.0fms | p99=%.0fms | errors=%d",
+        concurrency,
+        result["requests_per_sec"],
+        result["p50_ms"],
+        result["p99_ms"],
+        num_errors,
+    )
+    return result
+
+
+async def run_level(
+    client,
+    payloads: _Payloads,
+    *,
+    concurrency: int,
+    duration_sec: float,
+    rate: float | None = None,
+) -> LevelResult:
+    """
+    Sends requests to ``/infer`` for a fixed duration.
+
+    Without a ``rate``, each of the ``concurrency`` workers sends its next request as soon
+    as its last one is answered. With a ``rate``, requests are started on a fixed schedule
+    no matter how fast they are answered, with up to ``concurrency`` in flight, and their
+    latency is measured from when they were scheduled, so that waiting for a free slot counts.
+
+    Args:
+        client: The ``httpx.AsyncClient`` to send the requests with.
+        payloads: The files to upload.
+        concurrency: The most requests to have in flight at once.
+        duration_sec: How long to send requests for. Requests that are in flight at the end
+            are waited for.
+        rate: The number of requests to start per second, if any.
+
+    Returns:
+        The summary of the requests.
+    """
+    latencies: list[float] = []
+    statuses: collections.Counter[str] = collections.Counter()
+
+    async def send(scheduled_at: float):
+        try:
+            response = await client.post("/infer", files=payloads.next())
+        except httpx.HTTPError as e:  # pyright: ignore [reportOptionalMemberAccess]
+            statuses[type(e).__name__] += 1
+            return
+        statuses[str(response.status_code)] += 1
+        if response.is_success:
+            latencies.append(time.perf_counter() - scheduled_at)
+
+    start = time.perf_counter()
+    deadline = start + duration_sec
+
+    if rate is None:
+
+        async def worker():
+            while time.perf_counter() < deadline:
+                await send(time.perf_counter())
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+    else:
+        slots = asyncio.Semaphore(concurrency)
+
+        async def scheduled(scheduled_at: float):
+            async with slots:
+                await send(scheduled_at)
+
+        tasks = []
+        for i in itertools.count():
+            scheduled_at = start + i / rate
+            if scheduled_at >= deadline:
+                break
+            await asyncio.sleep(max(scheduled_at - time.perf_counter(), 0))
+            tasks.append(asyncio.create_task(scheduled(scheduled_at)))
+        await asyncio.gather(*tasks)
+
+    return summarize_level(
+        latencies,
+        statuses,
+        concurrency=concurrency,
+        rate=rate,
+        elapsed_sec=time.perf_counter() - start,
+        images_per_request=payloads.images_per_request,
+    )
+
+
+def saturation_point(
+    levels: list[LevelResult], min_gain: float = SATURATION_MIN_GAIN
+) -> int | None:
+    """
+    Finds the concurrency at which the throughput stopped growing.
+
+    Args:
+        levels: The results of increasing concurrency levels.
+        min_gain: The fraction by which the throughput must grow from one level
+            to the next for the server to not yet be saturated.
+
+    Returns:
+        The concurrency of the last level that still added enough throughput,
+        or None if every level did.
+    """
+    for previous, level in itertools.pairwise(levels):
+        if level["requests_per_sec"] < previous["requests_per_sec"] * (1 + min_gain):
+            return previous["concurrency"]
+    return None
+
+
+@contextlib.asynccontextmanager
+async def _client(url: str | None, model_path: pathlib.Path | None):
+    client_type = _require_httpx()
+    timeout = client_type.Timeout(REQUEST_TIMEOUT_SEC)
+    if url is not None:
+        async with client_type.AsyncClient(base_url=url, timeout=timeout) as client:
+            yield client
+        return
+
+    # Imported here so that load testing a remote server does not load the app's models.
+    from skysealand import api  # noqa: PLC0415
+
+    if model_path is not None:
+        api.MODELS = {"default": model_path}
+    # The ASGI transport does not run the app's startup and shutdown, so run them here.
+    async with (
+        api.app.router.lifespan_context(api.app),
+        client_type.AsyncClient(
+            transport=client_type.ASGITransport(app=api.app),
+            base_url="http://loadtest",
+            timeout=timeout,
+        ) as client,
+    ):
+        yield client
+
+
+async def run_load_test(  # noqa: PLR0913
+    url: str | None = None,
+    *,
+    model_path: pathlib.Path | None = None,
+    concurrency_levels: tuple[int, ...] = CONCURRENCY_LEVELS,
+    duration_sec: float = DURATION_SEC,
+    rate: float | None = None,
+    images_per_request: int = IMAGES_PER_REQUEST,
+    resolutions: tuple[int, ...] = RESOLUTIONS,
+    unique_images: bool = True,
+) -> LoadTestReport:
+    """
+    Load tests the inference API at increasing concurrency levels.
+
+    Args:
+        url: The base URL of a running server, e.g. ``http://127.0.0.1:8000``.
+            If None, then ``api.app`` is run in this process.
+        model_path: The model for ``api.app`` to serve when it is run in this process.
+            If None, then the app's own ``MODELS`` are served.
+        concurrency_levels: The numbers of concurrent requests to try, in increasing order.
+        duration_sec: How long to run each level for.
+        rate: If given, start this many requests per second instead of sending them
+            back to back, see ``run_level``.
+        images_per_request: How many images each request uploads.
+        resolutions: The widths of the uploaded images. Requests cycle through them.
+        unique_images: Whether to make every upload unique,
+            so that the server's detection cache cannot answer them.
+
+    Returns:
+        The results of every level and the saturation point.
+    """
+    if images_per_request < 1:
+        raise ValueError(f"images_per_request must be positive, got {images_per_request}")
+    uploads = synthetic_uploads(resolutions)
+    levels = []
+    async with _client(url, model_path) as client:
+        # Warm up the connection and the server, so that the first level is not penalized.
+        await client.post("/infer", files=_Payloads(uploads, images_per_request, True).next())
+        for concurrency in concurrency_levels:
+            levels.append(
+                await run_level(
+                    client,
+                    _Payloads(uploads, images_per_request, unique_images),
+                    concurrency=concurrency,
+                    duration_sec=duration_sec,
+                    rate=rate,
+                )
+            )
+    return {
+        "target": url or "in-process",
+        "images_per_request": images_per_request,
+        "resolutions": list(resolutions),
+        "duration_sec": duration_sec,
+        "levels": levels,
+        "saturation_concurrency": saturation_point(levels),
+    }
+
+
+def save_report(report: LoadTestReport, path: pathlib.Path):
+    path.write_text(json.dumps(report, indent=2) + "\n")
+
+
+def format_report(report: LoadTestReport) -> str:
+    """Lays out the levels as a table, followed by the saturation point."""
+    lines = [
+        (
+            f"{'concurrency':>11} {'requests':>8} {'errors':>7} {'req/sec':>8} "
+            f"{'img/sec':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"
+        )
+    ]
+    for level in report["levels"]:
+        lines.append(
+            f"{level['concurrency']:>11} {level['num_requests']:>8} {level['num_errors']:>7} "
+            f"{level['requests_per_sec']:>8.2f} {level['images_per_sec']:>8.2f} "
+            f"{level['p50_ms']:>8.0f} {level['p95_ms']:>8.0f} {level['p99_ms']:>8.0f}"
+        )
+    saturation = report["saturation_concurrency"]
+    lines.append(
+        f"Saturated at a concurrency of {saturation}."
+        if saturation is not None
+        else "Not saturated, try higher concurrency levels."
+    )
+    return "\n".join(lines)
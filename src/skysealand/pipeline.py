@@ -0,0 +1,513 @@
+"""
+A streaming decode -> batch -> infer -> write pipeline for running inference on many images.
+
+Images are decoded in batches on a background thread while the model runs on the previous
+batch, and the results are written out as soon as each batch finishes. Only a bounded
+number of decoded batches are held in memory at once, no matter how many images there are.
+"""
+
+import contextlib
+import functools
+import json
+import logging
+import os
+import pathlib
+import queue
+import textwrap
+import threading
+import time
+from collections.abc import Callable, Iterable, Iterator
+from typing import IO, Any, Protocol, TypeVar
+
+import numpy as np
+
+from skysealand import inference, serialization
+
+logger = logging.getLogger(__name__)
+
+_T = TypeVar("_T")
+
+RunBatch = Callable[[list[np.ndarray], list[str]], inference.InferenceJsonOutput]
+
+
+def iter_batches(items: Iterable[_T], batch_size: int) -> Iterator[list[_T]]:
+    """
+    Groups the given items into lists of at most ``batch_size`` items.
+
+    Args:
+        items: The items to group.
+        batch_size: The maximum number of items in each batch.
+
+    Yields:
+        The batches of items, in order.
+    """
+    if batch_size < 1:
+        raise ValueError(f"batch_size must be positive, got {batch_size}")
+
+    batch: list[_T] = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def prefetch(items: Iterable[_T], max_prefetch: int = 2) -> Iterator[_T]:
+    """
+    Produces the given items on a background thread, staying at most ``max_prefetch`` ahead.
+
+    Any exception raised while producing the items is re-raised by the consumer.
+
+    Args:
+        items: The items to produce in the background.
+        max_prefetch: The maximum number of produced items waiting to be consumed.
+
+    Yields:
+        The items, in order.
+    """
+    if max_prefetch < 1:
+        raise ValueError(f"max_prefetch must be positive, got {max_prefetch}")
+
+    buffer: queue.Queue[tuple[str, Any]] = queue.Queue(maxsize=max_prefetch)
+    stop = threading.Event()
+
+    def put(kind: str, value: Any) -> bool:
+        while not stop.is_set():
+            try:
+                buffer.put((kind, value), timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in items:
+                if not put("item", item):
+                    return
+        except BaseException as e:
+            put("error", e)
+        else:
+            put("done", None)
+
+    producer = threading.Thread(target=produce, name="prefetch", daemon=True)
+    producer.start()
+    try:
+        while True:
+            kind, value = buffer.get()
+            if kind == "done":
+                return
+            if kind == "error":
+                raise value
+            yield value
+    finally:
+        stop.set()
+        producer.join()
+
+
+def decode_batches(
+    paths: Iterable[pathlib.Path],
+    batch_size: int,
+    skip_errors: bool = True,
+    num_workers: int = 1,
+    target_size: int | None = inference.MODEL_IMAGE_SIZE,
+) -> Iterator[tuple[list[np.ndarray], list[str], list[inference.ImageScale]]]:
+    """
+    Lazily loads the images at the given paths at close to the model's resolution,
+    one batch at a time.
+
+    Args:
+        paths: The paths to the images to load.
+        batch_size: The number of paths to load per batch.
+        skip_errors: Whether to skip errors with loading images. Defaults to true.
+        num_workers: The number of threads to decode each batch with. Defaults to 1.
+        target_size: The size that the images are going to be resized to by the model.
+            If None, then the images are decoded at full resolution.
+
+    Yields:
+        A tuple of the image arrays, their filenames,
+        and how much each image was scaled down by for each batch.
+    """
+    for batch_paths in iter_batches(paths, batch_size):
+        yield inference.load_reduced_images(
+            *batch_paths, target_size=target_size, skip_errors=skip_errors, num_workers=num_workers
+        )
+
+
+def _read_named_data(paths: list[pathlib.Path], skip_errors: bool) -> list[tuple[str, bytes]]:
+    named_data: list[tuple[str, bytes]] = []
+    for path in paths:
+        try:
+            named_data.append((str(path), path.read_bytes()))
+        except OSError as e:
+            if not skip_errors:
+                raise ValueError(f"Invalid image '{path.name}': {e}") from e
+            logger.warning("Unable to load image due to error: %s", str(e))
+    return named_data
+
+
+def cached_batches(  # noqa: PLR0913
+    paths: Iterable[pathlib.Path],
+    batch_size: int,
+    cache: inference.DetectionCache,
+    *,
+    skip_errors: bool = True,
+    num_workers: int = 1,
+    target_size: int | None = inference.MODEL_IMAGE_SIZE,
+) -> Iterator[inference.CachedBatch]:
+    """
+    The counterpart of ``decode_batches`` that only decodes the images
+    that are not already in the cache.
+
+    Args:
+        paths: The paths to the images to load.
+        batch_size: The number of paths to load per batch.
+        cache: The cache of detections to look the images up in.
+        skip_errors: Whether to skip errors with loading images. Defaults to true.
+        num_workers: The number of threads to decode each batch with. Defaults to 1.
+        target_size: The size that the images are going to be resized to by the model.
+            If None, then the images are decoded at full resolution.
+
+    Yields:
+        Each batch, see ``inference.prepare_cached_batch``.
+    """
+    for batch_paths in iter_batches(paths, batch_size):
+        yield inference.prepare_cached_batch(
+            cache,
+            _read_named_data(batch_paths, skip_errors),
+            target_size=target_size,
+            skip_errors=skip_errors,
+            num_workers=num_workers,
+        )
+
+
+class ResultWriter(Protocol):
+    """Somewhere that the results of each batch are written to as they finish."""
+
+    def write(self, results: list[inference.SingleInferenceJsonOutput]):
+        """Writes the given results."""
+
+    def close(self, metrics: inference.InferenceMetaData):
+        """Finishes the output with the metrics for the whole run."""
+
+
+class JsonResultWriter:
+    """
+    Incrementally writes inference results as a single ``InferenceJsonOutput`` json object.
+
+    The written file is identical to ``json.dump(output, f, indent=4)``,
+    but the results are written out as they arrive instead of all at the end.
+
+    Args:
+        file: The text file to write to.
+    """
+
+    def __init__(self, file: IO[str]):
+        self._file = file
+        self._num_written = 0
+
+    def write(self, results: list[inference.SingleInferenceJsonOutput]):
+        """Writes the given results to the file."""
+        for result in results:
+            self._file.write('{\n    "results": [\n' if self._num_written == 0 else ",\n")
+            self._file.write(textwrap.indent(json.dumps(result, indent=4), " " * 8))
+            self._num_written += 1
+
+    def close(self, metrics: inference.InferenceMetaData):
+        """Finishes the json object with the metrics for the whole run."""
+        if self._num_written == 0:
+            self._file.write('{\n    "results": [],\n')
+        else:
+            self._file.write("\n    ],\n")
+        metrics_json = textwrap.indent(json.dumps(metrics, indent=4), " " * 4).lstrip()
+        self._file.write(f'    "metrics": {metrics_json}\n}}')
+
+
+class NdjsonResultWriter:
+    """
+    Appends inference results to a file as ndjson, one line per image.
+
+    Every result is written as soon as its batch finishes, and the file is flushed
+    at least every ``flush_interval_sec`` so that a crashed run loses little work.
+    See ``read_completed_filenames`` for resuming a run.
+
+    Args:
+        file: The text file to write to.
+        flush_interval_sec: The longest time to go without flushing the file.
+    """
+
+    def __init__(self, file: IO[str], flush_interval_sec: float = 5.0):
+        self._file = file
+        self._flush_interval_sec = flush_interval_sec
+        self._last_flush = time.monotonic()
+
+    def write(self, results: list[inference.SingleInferenceJsonOutput]):
+        """Writes one line per result, flushing the file if it has been a while."""
+        self._file.write(serialization.encode_ndjson_lines(results))
+        if time.monotonic() - self._last_flush >= self._flush_interval_sec:
+            self._flush()
+
+    def close(self, metrics: inference.InferenceMetaData):
+        """Writes the metrics for this run as the final line."""
+        self._file.write(json.dumps({"metrics": metrics}) + "\n")
+        self._flush()
+
+    def _flush(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._last_flush = time.monotonic()
+
+
+def read_completed_filenames(output_path: pathlib.Path) -> set[str]:
+    """
+    Finds the images that already have results in an ndjson output file.
+
+    If the run that wrote the file crashed part way through a line,
+    then that partial line is removed so that the file can be appended to.
+
+    Args:
+        output_path: The path to the ndjson output file.
+
+    Returns:
+        The filenames of all of the images that have results in the file.
+    """
+    if not output_path.exists():
+        return set()
+
+    completed: set[str] = set()
+    complete_length = 0
+    with output_path.open("r+b") as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                logger.warning(
+                    "Removing %d bytes of a partially written line from %s.",
+                    len(line),
+                    output_path,
+                )
+                f.truncate(complete_length)
+                break
+            complete_length += len(line)
+            if line.strip():
+                record = json.loads(line)
+                if "filename" in record:
+                    completed.add(record["filename"])
+
+    logger.info("Found %d completed images in %s.", len(completed), output_path)
+    return completed
+
+
+class EncodedResultWriter:
+    """
+    Writes inference results in one of the formats of ``serialization.OutputFormat``.
+
+    These formats can only be encoded once all of the results are known,
+    so the results (but not the images) are kept in memory until ``close``.
+
+    Args:
+        file: The binary file to write to.
+        output_format: The format to encode the output in.
+    """
+
+    def __init__(self, file: IO[bytes], output_format: serialization.OutputFormat):
+        self._file = file
+        self._output_format = output_format
+        self._results: list[inference.SingleInferenceJsonOutput] = []
+
+    def write(self, results: list[inference.SingleInferenceJsonOutput]):
+        """Holds onto the given results until the output is closed."""
+        self._results.extend(results)
+
+    def close(self, metrics: inference.InferenceMetaData):
+        """Encodes all of the results and the metrics and writes them to the file."""
+        self._file.write(
+            serialization.encode(
+                {"results": self._results, "metrics": metrics}, self._output_format
+            )
+        )
+
+
+@contextlib.contextmanager
+def open_result_writer(
+    output_path: pathlib.Path, output_format: serialization.OutputFormat, append: bool = False
+) -> Iterator[ResultWriter]:
+    """
+    Opens the output file and a writer for the given format.
+
+    Args:
+        output_path: The path to the output file to write.
+        output_format: The format to write the output file in.
+        append: Whether to append to the output file instead of overwriting it.
+            Only the ndjson format can be appended to.
+
+    Yields:
+        The writer for the output file, which is closed on exit.
+    """
+    if append and output_format != serialization.OutputFormat.NDJSON:
+        raise ValueError(f"Only ndjson output can be appended to, not {output_format.value}.")
+
+    if output_format == serialization.OutputFormat.NDJSON:
+        with output_path.open("a" if append else "w") as f:
+            yield NdjsonResultWriter(f)
+    elif output_format == serialization.OutputFormat.JSON:
+        with output_path.open("w") as f:
+            yield JsonResultWriter(f)
+    else:
+        with output_path.open("wb") as f:
+            yield EncodedResultWriter(f, output_format)
+
+
+def run_streaming_inference(  # noqa: PLR0913
+    run_batch: RunBatch,
+    paths: Iterable[pathlib.Path],
+    writer: ResultWriter,
+    *,
+    batch_size: int = 16,
+    max_prefetch: int = 2,
+    skip_errors: bool = True,
+    decode_workers: int = 1,
+    cache: inference.DetectionCache | None = None,
+    target_size: int | None = inference.MODEL_IMAGE_SIZE,
+) -> inference.InferenceMetaData:
+    """
+    Runs inference on the images at the given paths, one batch at a time.
+
+    Decoding of the next batches overlaps with inference on the current one,
+    and each batch's results are written as soon as it finishes.
+
+    Args:
+        run_batch: The function that runs the model on a batch of images,
+            e.g. ``functools.partial(inference.run_model_with_timing, model)``.
+        paths: The paths to the images to perform inference on.
+        writer: Where to write the results of each batch.
+        batch_size: The number of images to run through the model at once.
+        max_prefetch: The number of decoded batches that may wait for the model.
+        skip_errors: Whether to skip errors with loading images. Defaults to true.
+        decode_workers: The number of threads to decode each batch with. Defaults to 1.
+        cache: If given, images whose detections are in this cache are not decoded or run,
+            and the new detections are added to it.
+        target_size: The size that the images are going to be resized to by the model.
+            If None, e.g. for tiled inference, then the images are decoded at full resolution.
+
+    Returns:
+        The metadata about the inference over all of the batches.
+    """
+    if cache is not None:
+        return _run_cached_streaming_inference(
+            run_batch,
+            prefetch(
+                cached_batches(
+                    paths,
+                    batch_size,
+                    cache,
+                    skip_errors=skip_errors,
+                    num_workers=decode_workers,
+                    target_size=target_size,
+                ),
+                max_prefetch,
+            ),
+            writer,
+            cache,
+        )
+
+    metrics: inference.InferenceMetaData = {"num_images": 0, "inference_time_sec": 0.0}
+
+    for images, filenames, scales in prefetch(
+        decode_batches(
+            paths,
+            batch_size,
+            skip_errors=skip_errors,
+            num_workers=decode_workers,
+            target_size=target_size,
+        ),
+        max_prefetch,
+    ):
+        if not images:
+            continue
+        output = run_batch(images, filenames)
+        writer.write(inference.rescale_results(output["results"], scales))
+        metrics["num_images"] += output["metrics"]["num_images"]
+        metrics["inference_time_sec"] += output["metrics"]["inference_time_sec"]
+        logger.info("Processed %d images so far.", metrics["num_images"])
+
+    writer.close(metrics)
+    return metrics
+
+
+def run_tiled_streaming_inference(  # noqa: PLR0913
+    model,
+    paths: Iterable[pathlib.Path],
+    writer: ResultWriter,
+    *,
+    tile_size: int,
+    overlap: int = inference.TILE_OVERLAP,
+    batch_size: int = 16,
+    max_prefetch: int = 2,
+    skip_errors: bool = True,
+    cache: inference.DetectionCache | None = None,
+) -> inference.InferenceMetaData:
+    """
+    Runs the model on overlapping tiles of the images at the given paths,
+    see ``inference.run_tiled_model_with_timing``.
+
+    The images are decoded at full resolution one at a time, and the tiles of each are
+    run through the model ``batch_size`` at a time. So at most ``max_prefetch + 2``
+    images are held in memory at once, no matter how large the scenes are.
+
+    Args:
+        model: The model to run, see ``inference.detect``.
+        paths: The paths to the images to perform inference on.
+        writer: Where to write the results of each image.
+        tile_size: The side length of the tiles in pixels.
+        overlap: How many pixels neighbouring tiles share.
+        batch_size: The number of tiles to run through the model at once.
+        max_prefetch: The number of decoded images that may wait for the model.
+        skip_errors: Whether to skip errors with loading images. Defaults to true.
+        cache: If given, images whose detections are in this cache are not decoded or run,
+            and the new detections are added to it. It must not be shared with untiled runs.
+
+    Returns:
+        The metadata about the inference over all of the images.
+    """
+    return run_streaming_inference(
+        functools.partial(
+            inference.run_tiled_model_with_timing,
+            model,
+            tile_size=tile_size,
+            overlap=overlap,
+            max_tiles_per_batch=batch_size,
+        ),
+        paths,
+        writer,
+        batch_size=1,
+        max_prefetch=max_prefetch,
+        skip_errors=skip_errors,
+        cache=cache,
+        target_size=None,
+    )
+
+
+def _run_cached_streaming_inference(
+    run_batch: RunBatch,
+    batches: Iterable[inference.CachedBatch],
+    writer: ResultWriter,
+    cache: inference.DetectionCache,
+) -> inference.InferenceMetaData:
+    metrics: inference.InferenceMetaData = {
+        "num_images": 0,
+        "inference_time_sec": 0.0,
+        "cache_hits": 0,
+    }
+
+    for batch in batches:
+        computed = run_batch(batch.images, batch.image_keys) if batch.images else None
+        output = inference.complete_cached_batch(cache, batch, computed)
+        writer.write(output["results"])
+        metrics["num_images"] += output["metrics"]["num_images"]
+        metrics["inference_time_sec"] += output["metrics"]["inference_time_sec"]
+        metrics["cache_hits"] += batch.cache_hits
+        logger.info("Processed %d images so far.", metrics["num_images"])
+
+    writer.close(metrics)
+    return metrics
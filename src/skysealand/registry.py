@@ -0,0 +1,222 @@
+"""
+A registry of named, warmed up models that can be swapped while they are being used.
+
+Requests ``acquire`` the current version of a model for as long as they use it.
+``load`` swaps in a new version atomically, so that new requests go to it right away,
+while requests that already hold the old version finish on it. Once the old version
+is ``drain``ed, its resources can be released.
+"""
+
+import contextlib
+import dataclasses
+import logging
+import pathlib
+import threading
+import time
+from collections.abc import Callable, Iterator
+from typing import Any, TypedDict
+
+import numpy as np
+
+from skysealand import backends, inference
+
+logger = logging.getLogger(__name__)
+
+ModelLoader = Callable[[pathlib.Path, str], Any]
+WarmUp = Callable[[Any, list[np.ndarray]], object]
+
+# The batch sizes to run through a newly loaded model before it serves requests,
+# so that the slow first forward passes and allocations do not happen on a real request.
+WARMUP_BATCH_SIZES = (1, 8)
+
+
+class UnknownModelError(ValueError):
+    """No model is loaded under the requested name."""
+
+
+class ModelInfo(TypedDict):
+    name: str
+    model_path: str
+    version: int
+    loaded_at: float
+    in_flight: int
+
+
+@dataclasses.dataclass(eq=False)
+class ModelVersion:
+    """One loaded version of a named model."""
+
+    name: str
+    model_path: pathlib.Path
+    model: Any
+    # Increases with every model that the registry loads.
+    version: int
+    # The hash of the weights, see ``inference.model_fingerprint``.
+    fingerprint: str
+    loaded_at: float = dataclasses.field(default_factory=time.time)
+    in_flight: int = 0
+    _idle: threading.Condition = dataclasses.field(default_factory=threading.Condition)
+
+    def drain(self, timeout: float | None = None) -> bool:
+        """
+        Waits until no requests are using this version.
+
+        Args:
+            timeout: The most seconds to wait. If None, then wait for as long as it takes.
+
+        Returns:
+            Whether this version is no longer in use.
+        """
+        with self._idle:
+            return self._idle.wait_for(lambda: self.in_flight == 0, timeout)
+
+    def info(self) -> ModelInfo:
+        return {
+            "name": self.name,
+            "model_path": str(self.model_path),
+            "version": self.version,
+            "loaded_at": self.loaded_at,
+            "in_flight": self.in_flight,
+        }
+
+
+def warm_up(
+    model,
+    run: WarmUp = inference.detect,
+    batch_sizes: tuple[int, ...] = WARMUP_BATCH_SIZES,
+    image_size: int = inference.MODEL_IMAGE_SIZE,
+):
+    """
+    Runs the model on batches of blank images of the given sizes.
+
+    Args:
+        model: The model to warm up.
+        run: The function that runs the model on a batch of images.
+        batch_sizes: The sizes of the batches to run, e.g. the typical and largest batches.
+        image_size: The side length of the blank images.
+    """
+    image = np.zeros((image_size, image_size, 3), dtype=np.uint8)
+    for batch_size in batch_sizes:
+        start = time.perf_counter()
+        run(model, [image] * batch_size)
+        logger.info(
+            "Warm up batch | batch_size=%d | time=%.3fs", batch_size, time.perf_counter() - start
+        )
+
+
+class ModelRegistry:
+    """
+    Holds the current version of each named model.
+
+    Args:
+        loader: The function that loads a model from its path onto a device.
+        run: The function that runs a model on a batch of images, for warming it up.
+        warmup_batch_sizes: The sizes of the batches to warm each model up with.
+            If empty, then models are not warmed up.
+        device: The device to load the models onto.
+    """
+
+    def __init__(
+        self,
+        loader: ModelLoader = backends.load_backend,
+        run: WarmUp = inference.detect,
+        warmup_batch_sizes: tuple[int, ...] = WARMUP_BATCH_SIZES,
+        device: str = "cpu",
+    ):
+        self._loader = loader
+        self._run = run
+        self._warmup_batch_sizes = warmup_batch_sizes
+        self._device = device
+        self._lock = threading.Lock()
+        self._models: dict[str, ModelVersion] = {}
+        self._default_name: str | None = None
+        self._num_loaded = 0
+
+    @property
+    def default_name(self) -> str | None:
+        """The name of the first model that was loaded, used when a request does not pick one."""
+        return self._default_name
+
+    def load(self, name: str, model_path: pathlib.Path) -> tuple[ModelVersion, ModelVersion | None]:
+        """
+        Loads and warms up a model, then makes it the current version of ``name``.
+
+        Requests keep using the previous version until the new one is ready.
+        This blocks for as long as loading takes, so run it off of the event loop.
+
+        Args:
+            name: The name that requests pick the model by.
+            model_path: The path to the model.
+
+        Returns:
+            The new version, and the version that it replaced, if any.
+            The replaced version may still be in use, see ``ModelVersion.drain``.
+        """
+        logger.info("Loading model %r from %s ...", name, model_path)
+        model = self._loader(model_path, self._device)
+        if self._warmup_batch_sizes:
+            warm_up(model, self._run, self._warmup_batch_sizes)
+        # Hashed here rather than by the first request, since it reads the whole weights file.
+        fingerprint = inference.model_fingerprint(model_path)
+
+        with self._lock:
+            self._num_loaded += 1
+            new = ModelVersion(
+                name, model_path, model, version=self._num_loaded, fingerprint=fingerprint
+            )
+            old = self._models.get(name)
+            self._models[name] = new
+            if self._default_name is None:
+                self._default_name = name
+        logger.info("Model %r is now version %d from %s", name, new.version, model_path)
+        return new, old
+
+    def get(self, name: str | None = None) -> ModelVersion:
+        """
+        The current version of the named model.
+
+        Args:
+            name: The name of the model. If None, then the default model.
+
+        Returns:
+            The current version.
+        """
+        with self._lock:
+            return self._get(name)
+
+    def _get(self, name: str | None) -> ModelVersion:
+        if name is None:
+            name = self._default_name
+        if name is None or name not in self._models:
+            raise UnknownModelError(
+                f"Unknown model {name!r}. Available models: {sorted(self._models)}"
+            )
+        return self._models[name]
+
+    @contextlib.contextmanager
+    def acquire(self, name: str | None = None) -> Iterator[ModelVersion]:
+        """
+        Uses the current version of the named model for the duration of the ``with`` block,
+        even if another version is loaded in the meantime.
+
+        Args:
+            name: The name of the model. If None, then the default model.
+
+        Yields:
+            The version to use.
+        """
+        with self._lock:
+            version = self._get(name)
+            with version._idle:
+                version.in_flight += 1
+        try:
+            yield version
+        finally:
+            with version._idle:
+                version.in_flight -= 1
+                version._idle.notify_all()
+
+    def versions(self) -> list[ModelVersion]:
+        """The current version of every model."""
+        with self._lock:
+            return list(self._models.values())
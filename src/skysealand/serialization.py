@@ -0,0 +1,240 @@
+"""
+Encodings of ``InferenceJsonOutput`` besides json.
+
+- ``ndjson``: One json object per line: one ``SingleInferenceJsonOutput`` per image,
+  followed by a ``{"metrics": ...}`` line. A file that was appended to by several runs
+  has one metrics line per run, which are summed up when decoding.
+- ``msgpack``: The same structure as the json, encoded as MessagePack.
+  This needs the optional ``msgpack`` package.
+- ``npz``: Columnar numpy arrays in an ``.npz`` archive, with one row per box:
+  ``boxes`` (N, 4), ``scores`` (N,), ``class_ids`` (N,), and ``image_index`` (N,),
+  which indexes into the ``filenames`` array. Each metric is a scalar array
+  named ``metrics_<name>``, and each stage time is one named
+  ``metrics_stage_times_sec_<stage>``, so that no array needs pickling.
+
+All of them map one-to-one onto ``InferenceJsonOutput``, see ``decode``.
+"""
+
+import enum
+import io
+import json
+from typing import Any
+
+import numpy as np
+
+from skysealand import inference
+
+try:
+    import msgpack
+except ImportError:  # Optional dependency, only needed for the msgpack format.
+    msgpack = None
+
+
+class OutputFormat(enum.StrEnum):
+    JSON = "json"
+    NDJSON = "ndjson"
+    MSGPACK = "msgpack"
+    NPZ = "npz"
+
+
+MEDIA_TYPES = {
+    OutputFormat.JSON: "application/json",
+    OutputFormat.NDJSON: "application/x-ndjson",
+    OutputFormat.MSGPACK: "application/msgpack",
+    OutputFormat.NPZ: "application/x-npz",
+}
+
+_METRICS_PREFIX = "metrics_"
+# Metrics that are dicts of scalars, which are stored as one array per key.
+_NESTED_METRICS = ("stage_times_sec",)
+
+
+def to_columnar(output: inference.InferenceJsonOutput) -> dict[str, np.ndarray]:
+    """
+    Flattens the inference output into one array per field, with one row per box.
+
+    Args:
+        output: The inference output to flatten.
+
+    Returns:
+        The arrays that are stored in the ``npz`` format.
+    """
+    detections = [
+        (image_index, det)
+        for image_index, result in enumerate(output["results"])
+        for det in result["inference"]
+    ]
+    arrays = {
+        "filenames": np.array([r["filename"] for r in output["results"]], dtype=np.str_),
+        "boxes": np.array([det["bbox"] for _, det in detections], dtype=np.float64).reshape(-1, 4),
+        "scores": np.array([det["confidence"] for _, det in detections], dtype=np.float64),
+        "class_ids": np.array([det["class_id"] for _, det in detections], dtype=np.int64),
+        "image_index": np.array([i for i, _ in detections], dtype=np.int64),
+    }
+    for name, value in output["metrics"].items():
+        if name in _NESTED_METRICS:
+            for key, nested_value in value.items():  # pyright: ignore [reportAttributeAccessIssue]
+                arrays[f"{_METRICS_PREFIX}{name}_{key}"] = np.array(nested_value)
+        else:
+            arrays[_METRICS_PREFIX + name] = np.array(value)
+    return arrays
+
+
+def from_columnar(arrays: dict[str, np.ndarray]) -> inference.InferenceJsonOutput:
+    """
+    The inverse of ``to_columnar``.
+
+    Args:
+        arrays: The arrays that are stored in the ``npz`` format.
+
+    Returns:
+        The inference output that the arrays were made from.
+    """
+    results: list[inference.SingleInferenceJsonOutput] = [
+        {"filename": str(name), "inference": []} for name in arrays["filenames"].tolist()
+    ]
+    for box, score, class_id, image_index in zip(
+        arrays["boxes"].tolist(),
+        arrays["scores"].tolist(),
+        arrays["class_ids"].tolist(),
+        arrays["image_index"].tolist(),
+        strict=True,
+    ):
+        results[image_index]["inference"].append(
+            {"class_id": class_id, "confidence": score, "bbox": tuple(box)}
+        )
+
+    metrics: Any = {}
+    for name, value in arrays.items():
+        if not name.startswith(_METRICS_PREFIX):
+            continue
+        name = name.removeprefix(_METRICS_PREFIX)  # noqa: PLW2901
+        nested = next((n for n in _NESTED_METRICS if name.startswith(f"{n}_")), None)
+        if nested is None:
+            metrics[name] = value.item()
+        else:
+            metrics.setdefault(nested, {})[name.removeprefix(f"{nested}_")] = value.item()
+    return {"results": results, "metrics": metrics}
+
+
+def encode_ndjson_lines(results: list[inference.SingleInferenceJsonOutput]) -> str:
+    """Encodes each of the given results as a line of ndjson."""
+    return "".join(json.dumps(result) + "\n" for result in results)
+
+
+def _decode_ndjson(data: bytes) -> inference.InferenceJsonOutput:
+    results: list[inference.SingleInferenceJsonOutput] = []
+    metrics: Any = {"num_images": 0, "inference_time_sec": 0.0}
+    for line in data.splitlines():
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        if "metrics" not in record:
+            results.append(record)
+            continue
+        for name, value in record["metrics"].items():
+            if name in ("num_images", "inference_time_sec"):
+                metrics[name] += value
+            else:
+                metrics[name] = value
+    return {"results": results, "metrics": metrics}
+
+
+def _require_msgpack():
+    if msgpack is None:
+        raise ValueError("The msgpack output format requires the `msgpack` package.")
+    return msgpack
+
+
+def encode(output: inference.InferenceJsonOutput, output_format: OutputFormat) -> bytes:
+    """
+    Encodes the inference output in the given format.
+
+    Args:
+        output: The inference output to encode.
+        output_format: The format to encode the output in.
+
+    Returns:
+        The encoded output.
+    """
+    if output_format == OutputFormat.JSON:
+        return json.dumps(output).encode()
+    if output_format == OutputFormat.NDJSON:
+        metrics_line = json.dumps({"metrics": output["metrics"]}) + "\n"
+        return (encode_ndjson_lines(output["results"]) + metrics_line).encode()
+    if output_format == OutputFormat.MSGPACK:
+        return _require_msgpack().packb(output)
+    if output_format == OutputFormat.NPZ:
+        buf = io.BytesIO()
+        np.savez_compressed(buf, **to_columnar(output))
+        return buf.getvalue()
+    raise ValueError(f"Unknown output format: {output_format}")
+
+
+def decode(data: bytes, output_format: OutputFormat) -> inference.InferenceJsonOutput:
+    """
+    Decodes inference output that was encoded with ``encode``.
+
+    Args:
+        data: The encoded output.
+        output_format: The format that the output was encoded in.
+
+    Returns:
+        The inference output, with bounding boxes as tuples like the original.
+    """
+    if output_format == OutputFormat.NPZ:
+        with np.load(io.BytesIO(data)) as npz:
+            return from_columnar(dict(npz))
+
+    if output_format == OutputFormat.JSON:
+        output = json.loads(data)
+    elif output_format == OutputFormat.NDJSON:
+        output = _decode_ndjson(data)
+    elif output_format == OutputFormat.MSGPACK:
+        output = _require_msgpack().unpackb(data)
+    else:
+        raise ValueError(f"Unknown output format: {output_format}")
+
+    for result in output["results"]:
+        for det in result["inference"]:
+            det["bbox"] = tuple(det["bbox"])
+    return output
+
+
+def negotiate_format(accept: str | None) -> OutputFormat:
+    """
+    Picks the output format for an HTTP ``Accept`` header.
+
+    The most preferred media type that we support wins. Json is used when there is
+    no header or when none of the accepted media types are supported, which includes
+    msgpack if the optional ``msgpack`` package is not installed.
+
+    Args:
+        accept: The value of the ``Accept`` header of the request, if any.
+
+    Returns:
+        The format to encode the response in.
+    """
+    if not accept:
+        return OutputFormat.JSON
+
+    by_media_type = {
+        media_type: fmt
+        for fmt, media_type in MEDIA_TYPES.items()
+        if fmt != OutputFormat.MSGPACK or msgpack is not None
+    }
+    candidates: list[tuple[float, int, OutputFormat]] = []
+    for position, item in enumerate(accept.split(",")):
+        media_type, *params = (part.strip() for part in item.split(";"))
+        quality = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if media_type.lower() in by_media_type and quality > 0:
+            candidates.append((-quality, position, by_media_type[media_type.lower()]))
+
+    return min(candidates)[2] if candidates else OutputFormat.JSON
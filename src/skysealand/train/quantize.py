@@ -0,0 +1,211 @@
+"""
+Quantizes a trained model to INT8 with ONNX Runtime, for faster inference on CPU-only machines.
+
+The quantized model is an ``.onnx`` file, so it is served by ``backends.OnnxBackend``
+just like any other exported model.
+"""
+
+import enum
+import logging
+import pathlib
+import random
+import time
+from typing import TypedDict
+
+import numpy as np
+from ultralytics import YOLO  # pyright: ignore [reportPrivateImportUsage]
+
+from skysealand import backends, inference
+from skysealand.dataset import index
+
+try:
+    import onnx
+    from onnxruntime import quantization
+except ImportError:  # Optional dependencies, only needed for quantizing.
+    onnx = None
+    quantization = None
+
+logger = logging.getLogger(__name__)
+
+
+class QuantizationMode(enum.StrEnum):
+    # Weights are quantized ahead of time and activations on the fly. Needs no data.
+    DYNAMIC = "dynamic"
+    # Weights and activations are quantized ahead of time, calibrated on training images.
+    STATIC = "static"
+
+
+def _sample_images(
+    dataset_config_path: pathlib.Path, split: str, num_images: int, seed: int = 42
+) -> list[pathlib.Path]:
+    with index.open_index(dataset_config_path) as dataset_index:
+        paths = dataset_index.image_paths(split)
+    if not paths:
+        raise ValueError(f"No images found in the {split} split of {dataset_config_path}")
+    return random.Random(seed).sample(paths, min(num_images, len(paths)))
+
+
+class _CalibrationDataReader:
+    """Feeds letterboxed training images to ONNX Runtime's calibration, one at a time."""
+
+    def __init__(self, image_paths: list[pathlib.Path], input_name: str, image_size: int):
+        self._paths = iter(image_paths)
+        self._input_name = input_name
+        self._image_size = image_size
+
+    def get_next(self) -> dict[str, np.ndarray] | None:
+        for path in self._paths:
+            images, _ = inference.load_images(path, skip_errors=True)
+            if not images:
+                continue
+            padded, _, _ = backends.letterbox(images[0], (self._image_size, self._image_size))
+            batch = padded[None].transpose(0, 3, 1, 2).astype(np.float32) / 255
+            return {self._input_name: batch}
+        return None
+
+
+def _head_nodes_to_exclude(model_path: pathlib.Path) -> list[str]:
+    """
+    Finds the nodes of the detection head that decode the boxes.
+
+    These mix pixel coordinates with class probabilities in a single tensor,
+    which loses almost all of its precision in INT8, so they are left in FP32.
+    Only the convolutions of the head are quantized.
+    """
+    graph = onnx.load(str(model_path)).graph  # pyright: ignore [reportOptionalMemberAccess]
+    output_names = {output.name for output in graph.output}
+    head_prefix = next(
+        node.name.rsplit("/", 1)[0] + "/"
+        for node in graph.node
+        if output_names.intersection(node.output)
+    )
+    return [
+        node.name
+        for node in graph.node
+        if node.name.startswith(head_prefix)
+        and "/cv2." not in node.name
+        and "/cv3." not in node.name
+    ]
+
+
+def quantize(  # noqa: PLR0913
+    model_path: pathlib.Path,
+    mode: QuantizationMode = QuantizationMode.STATIC,
+    *,
+    dataset_config_path: pathlib.Path = pathlib.Path("data/data.yaml"),
+    num_calibration_images: int = 100,
+    image_size: int = inference.MODEL_IMAGE_SIZE,
+    output_path: pathlib.Path | None = None,
+) -> pathlib.Path:
+    """
+    Quantizes the given model to INT8.
+
+    Args:
+        model_path: The path to the trained ``.pt`` model, or a model that was
+            already exported to ``.onnx``.
+        mode: Whether to quantize statically or dynamically, see ``QuantizationMode``.
+        dataset_config_path: The path to the config summary yaml file for the dataset,
+            whose training split is sampled for static calibration.
+        num_calibration_images: The number of training images to calibrate with.
+        image_size: The size of the images that the model was trained on.
+        output_path: Where to write the quantized model.
+            Defaults to next to the exported model, ending in ``.int8.onnx``.
+
+    Returns:
+        The path to the quantized model.
+    """
+    if quantization is None or onnx is None:
+        raise ValueError("Quantizing requires the `onnx` and `onnxruntime` packages.")
+
+    onnx_path = (
+        model_path
+        if model_path.suffix == ".onnx"
+        else backends.export_onnx(model_path, image_size=image_size)
+    )
+    if output_path is None:
+        output_path = onnx_path.with_suffix(".int8.onnx")
+
+    logger.info("Quantizing %s (%s) to %s ...", onnx_path, mode.value, output_path)
+    if mode == QuantizationMode.DYNAMIC:
+        quantization.quantize_dynamic(
+            onnx_path, output_path, weight_type=quantization.QuantType.QUInt8
+        )
+        return output_path
+
+    calibration_paths = _sample_images(dataset_config_path, "train", num_calibration_images)
+    logger.info("Calibrating with %d training images ...", len(calibration_paths))
+    input_name = onnx.load(str(onnx_path)).graph.input[0].name
+    quantization.quantize_static(
+        onnx_path,
+        output_path,
+        _CalibrationDataReader(calibration_paths, input_name, image_size),
+        quant_format=quantization.QuantFormat.QDQ,
+        activation_type=quantization.QuantType.QUInt8,
+        weight_type=quantization.QuantType.QInt8,
+        per_channel=True,
+        nodes_to_exclude=_head_nodes_to_exclude(onnx_path),
+    )
+    return output_path
+
+
+class ModelReport(TypedDict):
+    model_path: str
+    map50: float
+    images_per_sec: float
+
+
+def _images_per_sec(model_path: pathlib.Path, images: list[np.ndarray], batch_size: int) -> float:
+    backend = backends.OnnxBackend(model_path)
+    # Warm up, so that one-off setup is not counted.
+    backend.detect(images[:batch_size])
+
+    start = time.perf_counter()
+    for i in range(0, len(images), batch_size):
+        backend.detect(images[i : i + batch_size])
+    return len(images) / (time.perf_counter() - start)
+
+
+def evaluate(
+    model_path: pathlib.Path,
+    dataset_config_path: pathlib.Path = pathlib.Path("data/data.yaml"),
+    num_speed_images: int = 64,
+    batch_size: int = 16,
+) -> ModelReport:
+    """
+    Measures the accuracy and CPU throughput of an ``.onnx`` model.
+
+    Args:
+        model_path: The path to the ``.onnx`` model.
+        dataset_config_path: The path to the config summary yaml file for the dataset.
+            Accuracy is measured on the validation split.
+        num_speed_images: The number of validation images to time the model on.
+        batch_size: The number of images to run through the model at once when timing it.
+
+    Returns:
+        The mAP@0.5 on the validation split and the number of images per second.
+    """
+    logger.info("Evaluating %s ...", model_path)
+    metrics = YOLO(str(model_path), task="detect").val(
+        data=str(dataset_config_path), batch=1, plots=False
+    )
+
+    speed_paths = _sample_images(dataset_config_path, "val", num_speed_images)
+    images, _ = inference.load_images(*speed_paths, skip_errors=True)
+    return {
+        "model_path": str(model_path),
+        "map50": float(metrics.box.map50),
+        "images_per_sec": _images_per_sec(model_path, images, batch_size),
+    }
+
+
+def format_report(reports: list[ModelReport]) -> str:
+    """Lays out the reports of several models as a table, relative to the first one."""
+    baseline = reports[0]
+    lines = [f"{'model':<40} {'mAP@0.5':>10} {'images/sec':>12} {'speedup':>8}"]
+    for report in reports:
+        speedup = report["images_per_sec"] / baseline["images_per_sec"]
+        lines.append(
+            f"{report['model_path']:<40} {report['map50']:>10.4f} "
+            f"{report['images_per_sec']:>12.2f} {speedup:>7.2f}x"
+        )
+    return "\n".join(lines)
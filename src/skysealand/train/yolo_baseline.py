@@ -3,16 +3,28 @@ A utility script for training a simple, baseline YOLO model on the dataset.
 """
 
 import logging
+import pathlib
 import random
 
 import numpy as np
 import torch
 from ultralytics import YOLO  # pyright: ignore [reportPrivateImportUsage]
 
+from skysealand.dataset import index, load
+
 logger = logging.getLogger(__name__)
 
+DATA_CONFIG = pathlib.Path("data/data.yaml")
+
 
 def train():
+    # Check the dataset before spending any time on the model.
+    class_names = load.load_dataset_config(DATA_CONFIG).get("names")
+    with index.open_index(DATA_CONFIG) as dataset_index:
+        if dataset_index.num_images("train") == 0:
+            raise ValueError(f"No training images found for {DATA_CONFIG}")
+        logger.info("Training on:\n%s", index.format_summary(dataset_index, class_names))
+
     # Load pretrained YOLOv8-nano model
     model = YOLO("yolov8n.pt")
 
@@ -25,7 +37,7 @@ def train():
 
     # Train the model
     model.train(
-        data="data/data.yaml",
+        data=str(DATA_CONFIG),
         epochs=25,
         imgsz=640,
         batch=16,
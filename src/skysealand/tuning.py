@@ -0,0 +1,312 @@
+"""
+Execution profiles, which set how many threads and workers inference uses on a machine.
+
+PyTorch and ONNX Runtime use every core by default, which oversubscribes the machine
+as soon as several models or worker processes run on it. An ``ExecutionProfile``
+sets the thread counts, batch size and decode parallelism instead. It is loaded with
+``load_profile`` from a json file and ``SKYSEALAND_*`` environment variables, and
+``tune`` finds the profile with the highest throughput on this machine within a
+latency budget.
+"""
+
+import dataclasses
+import functools
+import json
+import logging
+import os
+import pathlib
+import tempfile
+from collections.abc import Callable, Mapping
+from typing import Any, TypedDict
+
+import numpy as np
+import torch
+
+from skysealand import backends, bench, inference
+
+logger = logging.getLogger(__name__)
+
+# The json file to load the profile from, if no path is given.
+PROFILE_PATH_ENV = "SKYSEALAND_PROFILE"
+# Each field of the profile can also be set with ``SKYSEALAND_<FIELD>``,
+# e.g. ``SKYSEALAND_TORCH_THREADS=4``, which takes precedence over the file.
+_ENV_PREFIX = "SKYSEALAND_"
+
+# The p95 latency of a batch that ``tune`` stays within.
+LATENCY_BUDGET_MS = 500.0
+TUNE_BATCH_SIZES = (1, 4, 8, 16)
+TUNE_DECODE_WORKERS = (1, 2, 4, 8)
+# The width of the synthetic images that ``tune`` runs on, see ``bench.synthetic_image``.
+TUNE_RESOLUTION = 1280
+TUNE_REPEATS = 5
+
+
+@dataclasses.dataclass(frozen=True)
+class ExecutionProfile:
+    """
+    How many threads and workers to run inference with.
+
+    Args:
+        torch_threads: The threads that each model runs its operators on, for both
+            PyTorch and ONNX Runtime. If None, then all of the cores are used,
+            or an even share of them for each worker process.
+        torch_interop_threads: The threads that PyTorch runs independent operators on.
+            If None, then PyTorch picks.
+        batch_size: The most images to run through the model at once.
+        decode_workers: The number of threads that decode images.
+        inference_processes: If positive, each model runs in this many worker processes.
+    """
+
+    torch_threads: int | None = None
+    torch_interop_threads: int | None = None
+    batch_size: int = 16
+    decode_workers: int = 4
+    inference_processes: int = 0
+
+    def __post_init__(self):
+        for field in dataclasses.fields(self):
+            value = getattr(self, field.name)
+            minimum = 0 if field.name == "inference_processes" else 1
+            if value is not None and value < minimum:
+                raise ValueError(f"{field.name} must be at least {minimum}, got {value}")
+
+    def model_threads(self) -> int | None:
+        """The threads that each model should run its operators on."""
+        if self.torch_threads is not None or self.inference_processes == 0:
+            return self.torch_threads
+        return max(1, (os.cpu_count() or 1) // self.inference_processes)
+
+
+def _parse_env_value(name: str, value: str) -> int | None:
+    if value.lower() in {"", "none"}:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f"{name} must be an integer, got {value!r}") from None
+
+
+def load_profile(
+    path: pathlib.Path | None = None, environ: Mapping[str, str] = os.environ
+) -> ExecutionProfile:
+    """
+    Loads an execution profile from a json file and the environment.
+
+    Args:
+        path: The json file with the fields of the profile, e.g. one written by ``tune``.
+            If None, then the file in ``SKYSEALAND_PROFILE`` is used, if it is set.
+        environ: The environment variables, where ``SKYSEALAND_<FIELD>`` overrides
+            the field of the file.
+
+    Returns:
+        The profile. Fields that are set nowhere keep their defaults.
+    """
+    if path is None and environ.get(PROFILE_PATH_ENV):
+        path = pathlib.Path(environ[PROFILE_PATH_ENV])
+
+    values: dict[str, Any] = {}
+    if path is not None:
+        values = json.loads(path.read_text())
+        if not isinstance(values, dict):
+            raise ValueError(f"The execution profile in {path} must be a json object")
+        field_names = {field.name for field in dataclasses.fields(ExecutionProfile)}
+        unknown = set(values) - field_names
+        if unknown:
+            raise ValueError(f"Unknown execution profile fields in {path}: {sorted(unknown)}")
+
+    for field in dataclasses.fields(ExecutionProfile):
+        name = _ENV_PREFIX + field.name.upper()
+        if name in environ:
+            values[field.name] = _parse_env_value(name, environ[name])
+
+    profile = ExecutionProfile(**values)
+    logger.info("Execution profile: %s", profile)
+    return profile
+
+
+def save_profile(profile: ExecutionProfile, path: pathlib.Path):
+    path.write_text(json.dumps(dataclasses.asdict(profile), indent=2) + "\n")
+
+
+def apply_profile(profile: ExecutionProfile):
+    """
+    Sets PyTorch's thread counts in this process.
+
+    The inter-op threads can only be set before PyTorch first runs operators in parallel,
+    so apply the profile before loading any model.
+    """
+    threads = profile.model_threads()
+    if threads is not None:
+        torch.set_num_threads(threads)
+    if profile.torch_interop_threads is not None:
+        try:
+            torch.set_num_interop_threads(profile.torch_interop_threads)
+        except RuntimeError as e:
+            logger.warning("Unable to set the inter-op threads: %s", e)
+
+
+class TuneTrial(TypedDict):
+    torch_threads: int
+    batch_size: int
+    images_per_sec: float
+    # The latency of running one batch through the model.
+    p95_ms: float
+
+
+class DecodeTrial(TypedDict):
+    decode_workers: int
+    images_per_sec: float
+
+
+class TuneReport(TypedDict):
+    latency_budget_ms: float
+    trials: list[TuneTrial]
+    decode_trials: list[DecodeTrial]
+    profile: dict[str, int | None]
+
+
+def candidate_thread_counts(num_cpus: int) -> tuple[int, ...]:
+    """The powers of two below the number of cores, and the number of cores itself."""
+    counts = {num_cpus}
+    count = 1
+    while count < num_cpus:
+        counts.add(count)
+        count *= 2
+    return tuple(sorted(counts))
+
+
+def best_trial(trials: list[TuneTrial], latency_budget_ms: float) -> TuneTrial:
+    """
+    Picks the trial with the highest throughput whose p95 latency is within the budget.
+
+    If none of them is, then the trial with the lowest latency is picked instead.
+    """
+    if not trials:
+        raise ValueError("There are no trials to pick from")
+    within_budget = [trial for trial in trials if trial["p95_ms"] <= latency_budget_ms]
+    if not within_budget:
+        logger.warning(
+            "No setting is within the latency budget of %.0fms, using the fastest one",
+            latency_budget_ms,
+        )
+        return min(trials, key=lambda trial: trial["p95_ms"])
+    return max(within_budget, key=lambda trial: trial["images_per_sec"])
+
+
+def tune(  # noqa: PLR0913
+    model_path: pathlib.Path,
+    *,
+    latency_budget_ms: float = LATENCY_BUDGET_MS,
+    inference_processes: int = 0,
+    thread_counts: tuple[int, ...] | None = None,
+    batch_sizes: tuple[int, ...] = TUNE_BATCH_SIZES,
+    decode_workers: tuple[int, ...] = TUNE_DECODE_WORKERS,
+    resolution: int = TUNE_RESOLUTION,
+    repeats: int = TUNE_REPEATS,
+    model_loader: Callable[..., Any] = backends.load_backend,
+) -> tuple[ExecutionProfile, TuneReport]:
+    """
+    Finds the execution profile with the highest throughput on this machine
+    whose batches stay within a latency budget, on synthetic images.
+
+    Every combination of thread count and batch size is timed, then the number of
+    decode threads is picked separately, since decoding runs alongside the model.
+
+    Args:
+        model_path: The model to tune for.
+        latency_budget_ms: The most that the p95 latency of running one batch may be.
+        inference_processes: The number of worker processes that the model will run in.
+            Each of them gets an even share of the cores, so fewer thread counts are tried.
+        thread_counts: The thread counts to try. If None, then the powers of two up to
+            each process's share of the cores.
+        batch_sizes: The batch sizes to try.
+        decode_workers: The numbers of decode threads to try.
+        resolution: The width of the synthetic images.
+        repeats: How many times each setting is timed.
+        model_loader: Loads the model from its path with a ``num_threads`` keyword.
+
+    Returns:
+        The best profile, and the timings of every setting that was tried.
+    """
+    if thread_counts is None:
+        cpus_per_process = (os.cpu_count() or 1) // max(inference_processes, 1)
+        thread_counts = candidate_thread_counts(max(1, cpus_per_process))
+
+    original_threads = torch.get_num_threads()
+    trials: list[TuneTrial] = []
+    decode_trials: list[DecodeTrial] = []
+    try:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            paths = bench.write_synthetic_images(
+                pathlib.Path(tmp_dir), max(batch_sizes), resolution
+            )
+            images, filenames = inference.load_images(*paths)
+
+            for num_threads in thread_counts:
+                torch.set_num_threads(num_threads)
+                model = model_loader(model_path, num_threads=num_threads)
+                for batch_size in batch_sizes:
+                    run = functools.partial(
+                        inference.run_model_with_timing,
+                        model,
+                        images[:batch_size],
+                        filenames[:batch_size],
+                    )
+                    durations = bench.time_calls(run, repeats)
+                    trial: TuneTrial = {
+                        "torch_threads": num_threads,
+                        "batch_size": batch_size,
+                        "images_per_sec": batch_size * len(durations) / sum(durations),
+                        "p95_ms": float(np.percentile(durations, 95) * 1000),
+                    }
+                    logger.info("Tune trial: %s", trial)
+                    trials.append(trial)
+
+            best = best_trial(trials, latency_budget_ms)
+            for num_workers in decode_workers:
+                load = functools.partial(
+                    inference.load_images, *paths[: best["batch_size"]], num_workers=num_workers
+                )
+                durations = bench.time_calls(load, repeats)
+                decode_trials.append(
+                    {
+                        "decode_workers": num_workers,
+                        "images_per_sec": best["batch_size"] * len(durations) / sum(durations),
+                    }
+                )
+    finally:
+        torch.set_num_threads(original_threads)
+
+    best_decode = max(decode_trials, key=lambda trial: trial["images_per_sec"])
+    profile = ExecutionProfile(
+        torch_threads=best["torch_threads"],
+        batch_size=best["batch_size"],
+        decode_workers=best_decode["decode_workers"],
+        inference_processes=inference_processes,
+    )
+    report: TuneReport = {
+        "latency_budget_ms": latency_budget_ms,
+        "trials": trials,
+        "decode_trials": decode_trials,
+        "profile": dataclasses.asdict(profile),
+    }
+    return profile, report
+
+
+def format_report(report: TuneReport) -> str:
+    """Lays out the trials as a table, followed by the chosen profile."""
+    lines = [f"{'threads':>7} {'batch':>5} {'img/sec':>8} {'p95 ms':>8}"]
+    for trial in report["trials"]:
+        within_budget = trial["p95_ms"] <= report["latency_budget_ms"]
+        lines.append(
+            f"{trial['torch_threads']:>7} {trial['batch_size']:>5} "
+            f"{trial['images_per_sec']:>8.2f} {trial['p95_ms']:>8.0f}"
+            + ("" if within_budget else "  (over budget)")
+        )
+    lines.append(f"{'decode':>7} {'img/sec':>14}")
+    lines.extend(
+        f"{trial['decode_workers']:>7} {trial['images_per_sec']:>14.2f}"
+        for trial in report["decode_trials"]
+    )
+    lines.append(f"Profile: {json.dumps(report['profile'])}")
+    return "\n".join(lines)
@@ -0,0 +1,241 @@
+"""
+Inference on video files, with frames streamed through the model in batches.
+
+Frames are decoded on a background thread into a bounded queue, see ``pipeline.prefetch``,
+so decoding overlaps with the model. Frames can be thinned out before they reach the model:
+
+- ``stride``: Only every ``stride``-th frame is decoded at all, the others are skipped.
+- ``diff_threshold``: Frames that barely differ from the last frame that was run
+  through the model, going by a tiny grayscale thumbnail, reuse its detections.
+
+One ndjson line is written per frame as soon as its detections are known,
+with the frame's index and timestamp, followed by a final line with the metrics.
+"""
+
+import dataclasses
+import logging
+import pathlib
+from collections.abc import Iterable, Iterator
+
+import cv2
+import numpy as np
+
+from skysealand import inference, pipeline
+
+logger = logging.getLogger(__name__)
+
+# How many decoded frames may wait for the model.
+MAX_QUEUED_FRAMES = 64
+# The size of the grayscale thumbnails that frames are compared by.
+_THUMBNAIL_SIZE = (64, 36)
+
+
+class FrameResult(inference.SingleInferenceJsonOutput):
+    frame_index: int
+    timestamp_sec: float
+    # Whether the detections were copied from an earlier frame instead of run.
+    reused: bool
+
+
+@dataclasses.dataclass
+class Frame:
+    """A decoded video frame."""
+
+    index: int
+    timestamp_sec: float
+    # The RGB frame, or None once it is known that it won't be run through the model.
+    image: np.ndarray | None
+    # How much the width and height of ``image`` were scaled down from the original frame.
+    scale: inference.ImageScale = (1.0, 1.0)
+    # Whether the frame is close enough to the last run frame to reuse its detections.
+    reuse: bool = False
+
+
+def read_frames(
+    video_path: pathlib.Path,
+    stride: int = 1,
+    target_size: int | None = inference.MODEL_IMAGE_SIZE,
+) -> Iterator[Frame]:
+    """
+    Decodes the frames of a video file.
+
+    Args:
+        video_path: The path to the video file, in any format that OpenCV can read.
+        stride: Decode only every ``stride``-th frame, starting with the first.
+            The frames in between are skipped without being decoded.
+        target_size: If given, frames are shrunk so that their longer side is this long,
+            since the model shrinks them to that anyway. If None, then they are kept as is.
+
+    Yields:
+        The decoded frames, in order.
+    """
+    if stride < 1:
+        raise ValueError(f"stride must be positive, got {stride}")
+    capture = cv2.VideoCapture(str(video_path))
+    if not capture.isOpened():
+        raise ValueError(f"Unable to open video: {video_path}")
+
+    fps = capture.get(cv2.CAP_PROP_FPS)
+    logger.info("Reading video %s | fps=%.2f | stride=%d", video_path, fps, stride)
+    try:
+        index = 0
+        while capture.grab():
+            if index % stride == 0:
+                ok, bgr = capture.retrieve()
+                if not ok:
+                    logger.warning("Unable to decode frame %d of %s, skipping.", index, video_path)
+                else:
+                    timestamp_sec = capture.get(cv2.CAP_PROP_POS_MSEC) / 1000
+                    if timestamp_sec == 0 and index > 0 and fps > 0:
+                        timestamp_sec = index / fps
+                    image, scale = _shrink(cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB), target_size)
+                    yield Frame(index, timestamp_sec, image, scale)
+            index += 1
+    finally:
+        capture.release()
+
+
+def _shrink(image: np.ndarray, target_size: int | None) -> tuple[np.ndarray, inference.ImageScale]:
+    height, width = image.shape[:2]
+    if target_size is None or max(height, width) <= target_size:
+        return image, (1.0, 1.0)
+    ratio = target_size / max(height, width)
+    new_width, new_height = max(1, round(width * ratio)), max(1, round(height * ratio))
+    shrunk = cv2.resize(image, (new_width, new_height), interpolation=cv2.INTER_AREA)
+    return shrunk, (width / new_width, height / new_height)
+
+
+def thumbnail(image: np.ndarray) -> np.ndarray:
+    """A tiny grayscale copy of the image to cheaply compare frames by."""
+    gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+    return cv2.resize(gray, _THUMBNAIL_SIZE, interpolation=cv2.INTER_AREA).astype(np.float32)
+
+
+def frame_difference(a: np.ndarray, b: np.ndarray) -> float:
+    """The mean absolute difference between two thumbnails, from 0 (same) to 1."""
+    return float(np.abs(a - b).mean() / 255)
+
+
+def mark_reused_frames(frames: Iterable[Frame], diff_threshold: float) -> Iterator[Frame]:
+    """
+    Marks the frames that differ from the last frame to be run by less than the threshold,
+    and drops their images.
+
+    Args:
+        frames: The frames, in order.
+        diff_threshold: The largest ``frame_difference`` at which a frame reuses the
+            detections of the last frame that is run through the model.
+
+    Yields:
+        The frames, in order.
+    """
+    reference = None
+    for frame in frames:
+        assert frame.image is not None
+        current = thumbnail(frame.image)
+        if reference is not None and frame_difference(reference, current) < diff_threshold:
+            frame.image = None
+            frame.reuse = True
+        else:
+            reference = current
+        yield frame
+
+
+def run_video_inference(  # noqa: PLR0913
+    run_batch: pipeline.RunBatch,
+    video_path: pathlib.Path,
+    writer: pipeline.NdjsonResultWriter,
+    *,
+    batch_size: int = 16,
+    stride: int = 1,
+    diff_threshold: float | None = None,
+    max_queued_frames: int = MAX_QUEUED_FRAMES,
+    target_size: int | None = inference.MODEL_IMAGE_SIZE,
+) -> inference.InferenceMetaData:
+    """
+    Runs inference on the frames of a video, one batch of frames at a time.
+
+    Args:
+        run_batch: The function that runs the model on a batch of images,
+            e.g. ``functools.partial(inference.run_model_with_timing, model)``.
+        video_path: The path to the video file.
+        writer: Where to write one result per frame, as soon as it is known.
+        batch_size: The number of frames to run through the model at once.
+        stride: Only run every ``stride``-th frame, see ``read_frames``.
+            Skipped frames get no result.
+        diff_threshold: If given, frames that differ from the last run frame by less than
+            this reuse its detections, see ``mark_reused_frames``. They still get a result.
+        max_queued_frames: The number of decoded frames that may wait for the model.
+        target_size: The size that the frames are going to be resized to by the model.
+
+    Returns:
+        The metadata about the inference over all of the frames.
+    """
+    if batch_size < 1:
+        raise ValueError(f"batch_size must be positive, got {batch_size}")
+    frames: Iterable[Frame] = read_frames(video_path, stride, target_size)
+    if diff_threshold is not None:
+        frames = mark_reused_frames(frames, diff_threshold)
+
+    filename = video_path.name
+    metrics: inference.InferenceMetaData = {
+        "num_images": 0,
+        "inference_time_sec": 0.0,
+        "num_frames": 0,
+        "reused_frames": 0,
+    }
+    # The frames that wait for the next batch, along with the reused frames in between.
+    pending: list[Frame] = []
+    last_detections: list[inference.Detection] = []
+
+    def flush():
+        nonlocal last_detections
+        to_run = [frame for frame in pending if not frame.reuse]
+        detections = iter([])
+        if to_run:
+            output = run_batch(
+                [frame.image for frame in to_run],  # pyright: ignore [reportArgumentType]
+                [f"{filename}#{frame.index}" for frame in to_run],
+            )
+            rescaled = inference.rescale_results(
+                output["results"], [frame.scale for frame in to_run]
+            )
+            detections = iter(result["inference"] for result in rescaled)
+            metrics["num_images"] += output["metrics"]["num_images"]
+            metrics["inference_time_sec"] += output["metrics"]["inference_time_sec"]
+
+        results: list[FrameResult] = []
+        for frame in pending:
+            if not frame.reuse:
+                last_detections = next(detections)
+            results.append(
+                {
+                    "filename": filename,
+                    "inference": last_detections,
+                    "frame_index": frame.index,
+                    "timestamp_sec": frame.timestamp_sec,
+                    "reused": frame.reuse,
+                }
+            )
+        writer.write(results)  # pyright: ignore [reportArgumentType]
+        metrics["num_frames"] += len(results)
+        metrics["reused_frames"] += len(results) - len(to_run)
+        pending.clear()
+
+    num_to_run = 0
+    for frame in pipeline.prefetch(frames, max_queued_frames):
+        pending.append(frame)
+        if not frame.reuse:
+            num_to_run += 1
+        if num_to_run == batch_size:
+            flush()
+            num_to_run = 0
+            logger.info("Processed %d frames so far.", metrics["num_frames"])
+        elif num_to_run == 0:
+            # Reused frames after a finished batch already know their detections.
+            flush()
+    if pending:
+        flush()
+
+    writer.close(metrics)
+    return metrics
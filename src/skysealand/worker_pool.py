@@ -0,0 +1,382 @@
+"""
+A pool of inference worker processes that each hold their own copy of the model.
+
+Each worker loads the model once when it starts. Decoded images are handed to the
+workers through ``multiprocessing.shared_memory`` instead of being pickled, and only
+the (small) detection lists are sent back. Workers that crash or stop responding
+are restarted, and the batch that they were running fails with a
+``WorkerUnavailableError`` instead of waiting forever.
+"""
+
+import logging
+import multiprocessing
+import pathlib
+import queue
+import threading
+import time
+from collections.abc import Callable
+from multiprocessing import connection, shared_memory
+from multiprocessing.process import BaseProcess
+from typing import Any
+
+import numpy as np
+
+from skysealand import backends, inference
+
+logger = logging.getLogger(__name__)
+
+ModelLoader = Callable[[pathlib.Path, str], Any]
+
+# (shape, dtype string, byte offset) of each image in a shared memory block.
+_ImageLayout = tuple[tuple[int, ...], str, int]
+
+# How long to wait for a worker to load its model.
+_STARTUP_TIMEOUT_SEC = 300.0
+# How long a worker may take to run a batch before it is considered hung.
+RUN_TIMEOUT_SEC = 120.0
+
+
+class WorkerUnavailableError(RuntimeError):
+    """Raised when an inference worker process cannot answer, so the batch should be retried later."""
+
+
+class WorkerCrashedError(WorkerUnavailableError):
+    """Raised when an inference worker process dies while it is running a batch."""
+
+
+class WorkerTimeoutError(WorkerUnavailableError):
+    """Raised when an inference worker process does not answer in time."""
+
+
+def _read_shared_images(shm_name: str, layouts: list[_ImageLayout]) -> list[np.ndarray]:
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        # Copy out of the block so that nothing keeps it mapped once this returns,
+        # since the model may hold onto references to its input images.
+        return [
+            np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf, offset=offset).copy()
+            for shape, dtype, offset in layouts
+        ]
+    finally:
+        shm.close()
+
+
+def _worker_main(
+    conn: connection.Connection,
+    model_path: pathlib.Path,
+    device: str,
+    model_loader: ModelLoader,
+):
+    """The main loop of an inference worker process."""
+    try:
+        model = model_loader(model_path, device)
+    except Exception as e:
+        conn.send(("error", f"Unable to load model: {e}"))
+        return
+    conn.send(("ready", None))
+
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            return
+
+        kind = message[0]
+        if kind == "stop":
+            return
+        if kind == "ping":
+            conn.send(("pong", None))
+            continue
+
+        _, shm_name, layouts = message
+        try:
+            images = _read_shared_images(shm_name, layouts)
+            stage_times: inference.StageTimes = {}
+            detections = inference.detect(model, images, stage_times)
+        except Exception as e:
+            conn.send(("error", str(e)))
+            continue
+        conn.send(("ok", (detections, stage_times)))
+
+
+class _Worker:
+    def __init__(self, process: BaseProcess, conn: connection.Connection):
+        self.process = process
+        self.conn = conn
+
+
+class InferenceWorkerPool:
+    """
+    Runs inference on a pool of worker processes that each load the model once.
+
+    Args:
+        model_path: The path to the serialized model.
+        num_workers: The number of worker processes to start.
+        device: The device for each worker to load the model onto (defaults to CPU).
+        model_loader: The function that each worker uses to load the model.
+            It must be importable by the worker processes.
+        health_check_interval_sec: How often to check that idle workers are still responsive.
+            If None, then health checks only happen when ``check_health`` is called.
+        run_timeout_sec: How long a worker may take to run a batch. Workers that take longer
+            are restarted, and the batch fails. If None, then batches may take any time.
+    """
+
+    def __init__(  # noqa: PLR0913
+        self,
+        model_path: pathlib.Path,
+        num_workers: int = 2,
+        device: str = "cpu",
+        model_loader: ModelLoader = backends.load_backend,
+        health_check_interval_sec: float | None = 10.0,
+        *,
+        run_timeout_sec: float | None = RUN_TIMEOUT_SEC,
+    ):
+        if num_workers < 1:
+            raise ValueError(f"The pool needs at least one worker, got {num_workers}")
+
+        self.model_path = model_path
+        self.num_workers = num_workers
+        self.device = device
+        self.health_check_interval_sec = health_check_interval_sec
+        self.run_timeout_sec = run_timeout_sec
+        self._model_loader = model_loader
+        self._context = multiprocessing.get_context("spawn")
+        self._idle: queue.Queue[_Worker] = queue.Queue()
+        self._closed = threading.Event()
+        self._monitor: threading.Thread | None = None
+
+    def start(self):
+        """Starts all of the worker processes and waits for them to load their models."""
+        logger.info("Starting %d inference workers for %s ...", self.num_workers, self.model_path)
+        for _ in range(self.num_workers):
+            self._idle.put(self._start_worker())
+
+        if self.health_check_interval_sec is not None:
+            self._monitor = threading.Thread(
+                target=self._monitor_health, name="inference-pool-health", daemon=True
+            )
+            self._monitor.start()
+        logger.info("All inference workers are ready.")
+
+    def close(self):
+        """Stops all of the worker processes, waiting for running batches to finish."""
+        self._closed.set()
+        if self._monitor is not None:
+            self._monitor.join()
+            self._monitor = None
+
+        for _ in range(self.num_workers):
+            worker = self._idle.get()
+            if worker.process.is_alive():
+                worker.conn.send(("stop",))
+            worker.process.join(timeout=5)
+            if worker.process.is_alive():
+                worker.process.kill()
+            worker.conn.close()
+
+    def __enter__(self) -> "InferenceWorkerPool":
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def run(
+        self, images: list[np.ndarray], stage_times: inference.StageTimes | None = None
+    ) -> list[list[inference.Detection]]:
+        """
+        Runs the model on the given images using the next free worker.
+
+        Args:
+            images: The images to input to the model.
+            stage_times: If given, the time that the worker spent in each stage is added to it.
+
+        Returns:
+            The detections for each of the given images.
+
+        Raises:
+            WorkerUnavailableError: If the worker crashed or did not answer within
+                ``run_timeout_sec``. It is restarted in the background, so the batch
+                can be retried.
+        """
+        if self._closed.is_set():
+            raise RuntimeError("The inference worker pool is closed.")
+
+        layouts: list[_ImageLayout] = []
+        offset = 0
+        for img in images:
+            layouts.append((img.shape, img.dtype.str, offset))
+            offset += img.nbytes
+
+        shm = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+        try:
+            for img, (_, _, start) in zip(images, layouts, strict=True):
+                dst = np.ndarray(img.shape, dtype=img.dtype, buffer=shm.buf, offset=start)
+                dst[...] = img
+                del dst
+
+            worker = self._idle.get()
+            try:
+                worker.conn.send(("infer", shm.name, layouts))
+                kind, payload = self._receive(worker, timeout=self.run_timeout_sec)
+            except (WorkerUnavailableError, OSError) as e:
+                # Fail the batch right away, rather than after the model is loaded again.
+                self._restart_in_background(worker)
+                if isinstance(e, OSError):
+                    raise WorkerCrashedError(f"Lost the connection to the worker: {e}") from e
+                raise
+            except BaseException:
+                self._idle.put(worker)
+                raise
+            self._idle.put(worker)
+        finally:
+            shm.close()
+            shm.unlink()
+
+        if kind != "ok":
+            raise RuntimeError(f"Inference worker failed: {payload}")
+        detections, worker_stage_times = payload
+        if stage_times is not None:
+            stage_times.update(inference.sum_stage_times(stage_times, worker_stage_times))
+        return detections
+
+    def run_with_timing(
+        self, images: list[np.ndarray], filenames: list[str]
+    ) -> inference.InferenceJsonOutput:
+        """
+        The worker pool counterpart of ``inference.run_model_with_timing``.
+
+        Args:
+            images: The images to input to the model.
+            filenames: The names of the files that the images originated from.
+
+        Returns:
+            A json object containing the results of the inference
+            and metadata about this inference.
+        """
+        stage_times: inference.StageTimes = {}
+        inference_start = time.perf_counter()
+        detections = self.run(images, stage_times)
+        return inference.make_inference_output(
+            filenames, detections, time.perf_counter() - inference_start, stage_times
+        )
+
+    def check_health(self, timeout_sec: float = 5.0) -> int:
+        """
+        Pings every idle worker and restarts the ones that have died or do not answer.
+
+        Workers that are busy running a batch are skipped;
+        if they crash then ``run`` restarts them.
+
+        Args:
+            timeout_sec: How long to wait for each worker to answer.
+
+        Returns:
+            The number of workers that were restarted.
+        """
+        idle: list[_Worker] = []
+        while True:
+            try:
+                idle.append(self._idle.get_nowait())
+            except queue.Empty:
+                break
+
+        restarted = 0
+        for candidate in idle:
+            worker = candidate
+            healthy = False
+            if worker.process.is_alive():
+                try:
+                    worker.conn.send(("ping",))
+                    healthy = self._receive(worker, timeout=timeout_sec)[0] == "pong"
+                except (WorkerUnavailableError, OSError):
+                    healthy = False
+            if not healthy:
+                try:
+                    worker = self._restart_worker(worker)
+                    restarted += 1
+                except Exception:
+                    # Keep the dead worker in the pool so the next check tries again.
+                    logger.exception("Unable to restart inference worker")
+            self._idle.put(worker)
+
+        return restarted
+
+    def _start_worker(self) -> _Worker:
+        parent_conn, child_conn = self._context.Pipe()
+        process = self._context.Process(
+            target=_worker_main,
+            args=(child_conn, self.model_path, self.device, self._model_loader),
+            daemon=True,
+        )
+        process.start()
+        child_conn.close()
+
+        worker = _Worker(process, parent_conn)
+        kind, payload = self._receive(worker, timeout=_STARTUP_TIMEOUT_SEC)
+        if kind != "ready":
+            process.join()
+            raise RuntimeError(f"Inference worker failed to start: {payload}")
+        return worker
+
+    def _restart_worker(self, worker: _Worker) -> _Worker:
+        logger.warning(
+            "Restarting inference worker (pid=%s, exitcode=%s).",
+            worker.process.pid,
+            worker.process.exitcode,
+        )
+        if worker.process.is_alive():
+            worker.process.kill()
+        worker.process.join()
+        worker.conn.close()
+        return self._start_worker()
+
+    def _restart_in_background(self, worker: _Worker):
+        """Replaces a failed worker on another thread, and returns it to the pool when done."""
+        # Stop a hung worker now, so that it does not keep using the cores in the meantime.
+        if worker.process.is_alive():
+            worker.process.kill()
+        threading.Thread(
+            target=self._replace_worker, args=(worker,), name="inference-pool-restart", daemon=True
+        ).start()
+
+    def _replace_worker(self, worker: _Worker):
+        if not self._closed.is_set():
+            try:
+                worker = self._restart_worker(worker)
+            except Exception:
+                # Return the dead worker, so that the next health check or batch tries again.
+                logger.exception("Unable to restart inference worker")
+        self._idle.put(worker)
+
+    def _receive(self, worker: _Worker, timeout: float | None) -> tuple[str, Any]:
+        """Waits for a message from the worker, noticing if it dies in the meantime."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not worker.conn.poll(0.1):
+            if not worker.process.is_alive() and not worker.conn.poll():
+                raise WorkerCrashedError(
+                    f"Inference worker (pid={worker.process.pid}) exited "
+                    f"with code {worker.process.exitcode}"
+                )
+            if deadline is not None and time.monotonic() > deadline:
+                raise WorkerTimeoutError(
+                    f"Inference worker (pid={worker.process.pid}) did not answer "
+                    f"within {timeout} seconds"
+                )
+        try:
+            return worker.conn.recv()
+        except EOFError:
+            raise WorkerCrashedError(
+                f"Inference worker (pid={worker.process.pid}) closed its connection"
+            ) from None
+
+    def _monitor_health(self):
+        assert self.health_check_interval_sec is not None
+        while not self._closed.wait(self.health_check_interval_sec):
+            try:
+                restarted = self.check_health()
+            except Exception:
+                logger.exception("Inference worker health check failed")
+                continue
+            if restarted:
+                logger.warning("Health check restarted %d inference worker(s).", restarted)
@@ -0,0 +1,65 @@
+"""
+Benchmarks of the hot paths of inference, for pytest-benchmark.
+
+They are skipped by default. Run only these with ``pytest test/benchmarks --benchmark-only``,
+and save and compare runs with ``--benchmark-autosave`` and ``--benchmark-compare``.
+For a full sweep of settings, see ``skysealand bench``.
+"""
+
+import pytest
+from ultralytics import YOLO  # pyright: ignore [reportPrivateImportUsage]
+
+from skysealand import backends, bench, inference
+
+pytest.importorskip("pytest_benchmark")
+
+ROUNDS = 5
+
+
+@pytest.fixture(scope="module")
+def model():
+    # Untrained, so that no weights need to be downloaded. It runs just as fast.
+    return backends.UltralyticsBackend(YOLO("yolov8n.yaml"))
+
+
+@pytest.fixture(scope="module", params=[640, 1920])
+def image_paths(request, tmp_path_factory):
+    return bench.write_synthetic_images(tmp_path_factory.mktemp("images"), 8, request.param)
+
+
+@pytest.mark.parametrize("num_workers", [1, 4])
+def test_load_images(benchmark, image_paths, num_workers):
+    images, _ = benchmark.pedantic(
+        inference.load_images,
+        args=image_paths,
+        kwargs={"num_workers": num_workers},
+        rounds=ROUNDS,
+        warmup_rounds=1,
+    )
+    assert len(images) == len(image_paths)
+
+
+@pytest.mark.parametrize("batch_size", [1, 8])
+def test_run_model_with_timing(benchmark, model, image_paths, batch_size):
+    images, filenames = inference.load_images(*image_paths[:batch_size])
+
+    output = benchmark.pedantic(
+        inference.run_model_with_timing,
+        args=(model, images, filenames),
+        rounds=ROUNDS,
+        warmup_rounds=1,
+    )
+    assert output["metrics"]["num_images"] == batch_size
+
+
+@pytest.mark.parametrize("batch_size", [1, 16])
+def test_process_ultralytics_yolo_batched_detections(benchmark, batch_size):
+    results = bench.synthetic_results(batch_size, 640)
+
+    detections = benchmark.pedantic(
+        inference.process_ultralytics_yolo_batched_detections,
+        args=(results,),
+        rounds=ROUNDS,
+        warmup_rounds=1,
+    )
+    assert [len(dets) for dets in detections] == [bench.DETECTIONS_PER_IMAGE] * batch_size
@@ -1,8 +1,47 @@
+import io
+import pathlib
+import shutil
+from collections.abc import Callable
+
 import pytest
+from PIL import Image
 
 from skysealand import logging_setup
 
+DUMMY_DATA_DIR = pathlib.Path(__file__).parent / "dummy-data"
+BAD_DATA_DIR = pathlib.Path(__file__).parent / "dummy-data-with-errors"
+
 
 @pytest.hookimpl(tryfirst=True)
 def pytest_configure(config):
     logging_setup.setup_logging()
+
+
+@pytest.fixture
+def dummy_data_dir(tmp_path) -> pathlib.Path:
+    """A copy of the dummy dataset, so that the index and reports are not written to the tree."""
+    data_dir = tmp_path / "dummy-data"
+    shutil.copytree(DUMMY_DATA_DIR, data_dir)
+    return data_dir
+
+
+@pytest.fixture
+def bad_data_dir(tmp_path) -> pathlib.Path:
+    """A copy of the dummy dataset with errors, see ``dummy_data_dir``."""
+    data_dir = tmp_path / "dummy-data-with-errors"
+    shutil.copytree(BAD_DATA_DIR, data_dir)
+    return data_dir
+
+
+def _encode_image(
+    fmt: str = "JPEG", size: tuple[int, int] = (32, 32), color: str | tuple[int, ...] = "blue"
+) -> bytes:
+    buf = io.BytesIO()
+    Image.new("RGB", size, color=color).save(buf, format=fmt)
+    return buf.getvalue()
+
+
+@pytest.fixture
+def make_image_bytes() -> Callable[..., bytes]:
+    """Encodes a blank image, e.g. ``make_image_bytes("PNG", size=(64, 48), color="red")``."""
+    return _encode_image
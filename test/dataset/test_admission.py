@@ -0,0 +1,81 @@
+import asyncio
+import io
+
+import httpx
+import pytest
+from fastapi import FastAPI, Request, UploadFile
+
+from skysealand import admission
+
+
+def test_read_limited():
+    async def read(max_bytes):
+        return await admission.read_limited(
+            UploadFile(io.BytesIO(b"x" * 100), filename="a.jpg"), max_bytes
+        )
+
+    assert asyncio.run(read(100)) == b"x" * 100
+    with pytest.raises(admission.UploadTooLargeError, match=r"'a\.jpg'"):
+        asyncio.run(read(99))
+
+
+def test_check_total_pixels(make_image_bytes):
+    uploads = [
+        ("a.jpg", make_image_bytes(size=(100, 50))),
+        ("b.jpg", make_image_bytes(size=(10, 10))),
+        ("c.txt", b"not an image"),
+    ]
+
+    admission.check_total_pixels(uploads, 5100)
+    with pytest.raises(admission.UploadTooLargeError, match="5100 pixels"):
+        admission.check_total_pixels(uploads, 5099)
+
+
+def _limited_app(controller: admission.AdmissionController, release: asyncio.Event) -> FastAPI:
+    app = FastAPI()
+
+    @app.post("/infer")
+    async def infer(request: Request):
+        body = await request.body()
+        await release.wait()
+        return {"size": len(body)}
+
+    app.add_middleware(
+        admission.AdmissionMiddleware, get_controller=lambda: controller, path="/infer"
+    )
+    return app
+
+
+def test_admission_middleware():
+    rejections = []
+    controller = admission.AdmissionController(
+        max_in_flight=1, max_request_bytes=1000, on_reject=rejections.append
+    )
+
+    async def chunks():
+        for _ in range(5):
+            yield b"x" * 300
+
+    async def main():
+        release = asyncio.Event()
+        transport = httpx.ASGITransport(app=_limited_app(controller, release))
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            too_long = await client.post("/infer", content=b"x" * 1001)
+            streamed = await client.post("/infer", content=chunks())
+
+            first = asyncio.create_task(client.post("/infer", content=b"x"))
+            while controller.in_flight == 0:
+                await asyncio.sleep(0.01)
+            busy = await client.post("/infer", content=b"x")
+            release.set()
+            return too_long, streamed, busy, await first
+
+    too_long, streamed, busy, first = asyncio.run(main())
+
+    assert too_long.status_code == 413
+    assert streamed.status_code == 413
+    assert busy.status_code == 503
+    assert int(busy.headers["retry-after"]) >= 1
+    assert first.json() == {"size": 1}
+    assert rejections == ["too_large", "too_large", "saturated"]
+    assert controller.in_flight == 0
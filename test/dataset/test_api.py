@@ -0,0 +1,285 @@
+import json
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+from skysealand import api, inference, serialization, worker_pool
+
+# Images this tall make the fake backend act like a crashed worker process.
+CRASH_HEIGHT = 13
+
+
+class FakeBackend:
+    """Finds one box around each whole image, with the class id of the model it was loaded as."""
+
+    def __init__(self, class_id: int, batches: list[int]):
+        self.class_id = class_id
+        self.batches = batches
+
+    def detect(self, images, stage_times=None):
+        if any(img.shape[0] == CRASH_HEIGHT for img in images):
+            raise worker_pool.WorkerCrashedError("Inference worker (pid=1) exited with code 1")
+        self.batches.append(len(images))
+        with inference.time_stage(stage_times, "forward"):
+            pass
+        return [
+            {
+                "boxes": np.array([[0, 0, img.shape[1], img.shape[0]]], dtype=np.float32),
+                "scores": np.array([0.5], dtype=np.float32),
+                "class_ids": np.array([self.class_id]),
+            }
+            for img in images
+        ]
+
+
+@pytest.fixture
+def batches() -> list[int]:
+    """The sizes of the batches that the models were run on, not counting warm up."""
+    return []
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch, batches):
+    model_paths = {name: tmp_path / f"{name}.pt" for name in ("default", "other", "new")}
+    for class_id, path in enumerate(model_paths.values()):
+        path.write_bytes(bytes([class_id]))
+
+    def load_backend(model_path, device="cpu", num_threads=None):
+        return FakeBackend(list(model_paths.values()).index(model_path), batches)
+
+    monkeypatch.setattr(api.backends, "load_backend", load_backend)
+    monkeypatch.setattr(
+        api, "MODELS", {"default": model_paths["default"], "other": model_paths["other"]}
+    )
+    monkeypatch.setattr(api, "WARMUP_BATCH_SIZES", ())
+    monkeypatch.setattr(api, "INFERENCE_PROCESSES", 0)
+    monkeypatch.setattr(api, "CACHE_DIR", None)
+    monkeypatch.setattr(api, "ADMIN_TOKEN", "secret")
+    monkeypatch.setattr(api, "MAX_FILES_PER_REQUEST", 3)
+    monkeypatch.setattr(api, "MAX_IN_FLIGHT_REQUESTS", 4)
+    # Start from scratch, rather than from the state of another test.
+    monkeypatch.setattr(api, "_registry", None)
+    monkeypatch.setattr(api, "_admission", None)
+    monkeypatch.setattr(api, "_execution", None)
+    monkeypatch.setattr(api, "_batchers", {})
+    monkeypatch.setattr(api, "_caches", {})
+
+    with TestClient(api.app) as client:
+        client.model_paths = model_paths  # pyright: ignore [reportAttributeAccessIssue]
+        yield client
+
+
+def _files(*images: bytes) -> list[tuple[str, tuple[str, bytes, str]]]:
+    return [("files", (f"{i}.jpg", data, "image/jpeg")) for i, data in enumerate(images)]
+
+
+def test_infer_json(client, make_image_bytes):
+    response = client.post(
+        "/infer", files=_files(make_image_bytes(), make_image_bytes(size=(32, 16), color="red"))
+    )
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/json"
+    assert "forward;dur=" in response.headers["Server-Timing"]
+    output = response.json()
+    assert [r["filename"] for r in output["results"]] == ["0.jpg", "1.jpg"]
+    assert output["results"][0]["inference"] == [
+        {"class_id": 0, "confidence": 0.5, "bbox": [0.0, 0.0, 32.0, 32.0]}
+    ]
+    assert output["results"][1]["inference"][0]["bbox"] == [0.0, 0.0, 32.0, 16.0]
+    assert output["metrics"]["num_images"] == 2
+    assert "forward" in output["metrics"]["stage_times_sec"]
+
+
+@pytest.mark.parametrize(
+    "output_format", [serialization.OutputFormat.MSGPACK, serialization.OutputFormat.NPZ]
+)
+def test_infer_binary_formats(client, output_format, make_image_bytes):
+    if output_format == serialization.OutputFormat.MSGPACK:
+        pytest.importorskip("msgpack")
+    files = _files(make_image_bytes(), make_image_bytes(size=(32, 16), color="red"))
+    expected = client.post("/infer", files=files).json()
+
+    response = client.post(
+        "/infer", files=files, headers={"Accept": serialization.MEDIA_TYPES[output_format]}
+    )
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == serialization.MEDIA_TYPES[output_format]
+    output = serialization.decode(response.content, output_format)
+    assert json.loads(json.dumps(output["results"])) == expected["results"]
+    # Answered from the cache, so it has no model stages.
+    assert set(output["metrics"]["stage_times_sec"]) == {"read", "decode"}
+
+
+def test_infer_falls_back_to_json_without_msgpack(client, monkeypatch, make_image_bytes):
+    monkeypatch.setattr(serialization, "msgpack", None)
+
+    response = client.post(
+        "/infer", files=_files(make_image_bytes()), headers={"Accept": "application/msgpack"}
+    )
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/json"
+    assert response.json()["metrics"]["num_images"] == 1
+
+
+def test_infer_answers_repeated_images_from_the_cache(client, batches, make_image_bytes):
+    image = make_image_bytes()
+
+    first = client.post("/infer", files=_files(image)).json()
+    second = client.post("/infer", files=_files(image, image)).json()
+
+    assert batches == [1]
+    assert second["metrics"]["cache_hits"] == 2
+    assert second["results"][0]["inference"] == first["results"][0]["inference"]
+    stats = client.get("/cache/stats").json()
+    assert stats["hits"] == 2
+    assert stats["misses"] == 1
+
+
+def test_infer_does_not_hash_the_model(client, monkeypatch, make_image_bytes):
+    def fail_to_hash(model_path):
+        raise AssertionError("The model was fingerprinted when it was loaded")
+
+    monkeypatch.setattr(api.inference, "model_fingerprint", fail_to_hash)
+
+    assert client.post("/infer", files=_files(make_image_bytes())).status_code == 200
+    assert client.get("/cache/stats").json()["misses"] == 1
+
+
+def test_infer_tiled(client, make_image_bytes):
+    response = client.post(
+        "/infer?tile_size=64&tile_overlap=16", files=_files(make_image_bytes(size=(200, 60)))
+    )
+
+    assert response.status_code == 200
+    output = response.json()
+    assert output["metrics"]["num_tiles"] > 1
+    assert [r["filename"] for r in output["results"]] == ["0.jpg"]
+    # The boxes of overlapping tiles are in the coordinates of the whole image.
+    for det in output["results"][0]["inference"]:
+        assert 0 <= det["bbox"][0] < det["bbox"][2] <= 200
+
+
+def test_infer_picks_the_model_by_name(client, make_image_bytes):
+    response = client.post("/infer?model=other", files=_files(make_image_bytes()))
+
+    assert response.json()["results"][0]["inference"][0]["class_id"] == 1
+    assert client.post("/infer?model=missing", files=_files(make_image_bytes())).status_code == 404
+    assert client.get("/batching/stats?model=missing").status_code == 404
+    assert client.get("/cache/stats?model=missing").status_code == 404
+
+
+def test_infer_rejects_bad_requests(client, make_image_bytes):
+    not_an_image = [("files", ("a.jpg", b"not an image", "image/jpeg"))]
+    assert client.post("/infer", files=not_an_image).status_code == 400
+
+    too_many = client.post("/infer", files=_files(*[make_image_bytes()] * 4))
+    assert too_many.status_code == 413
+    assert "limit of 3 files" in too_many.json()["detail"]
+
+
+def _multipart_body(boundary: str, *images: bytes) -> bytes:
+    parts = [
+        f"--{boundary}\r\n"
+        f'Content-Disposition: form-data; name="files"; filename="{i}.jpg"\r\n'
+        "Content-Type: image/jpeg\r\n\r\n".encode()
+        + data
+        + b"\r\n"
+        for i, data in enumerate(images)
+    ]
+    return b"".join(parts) + f"--{boundary}--\r\n".encode()
+
+
+@pytest.mark.parametrize(("num_files", "file_bytes"), [(10, 1000), (1, 40_000)])
+def test_infer_rejects_uploads_over_the_limits_while_they_stream_in(
+    client, monkeypatch, num_files, file_bytes
+):
+    monkeypatch.setattr(api, "MAX_FILE_BYTES", 10_000)
+    body = _multipart_body("limits", *[b"\xff" * file_bytes] * num_files)
+    chunks = [body[start : start + 4096] for start in range(0, len(body), 4096)]
+    received = []
+    sent = []
+
+    async def receive():
+        received.append(chunks[len(received)])
+        return {
+            "type": "http.request",
+            "body": received[-1],
+            "more_body": len(received) < len(chunks),
+        }
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": "/infer",
+        "raw_path": b"/infer",
+        "root_path": "",
+        "query_string": b"",
+        "headers": [(b"content-type", b"multipart/form-data; boundary=limits")],
+        "client": ("testclient", 50000),
+        "server": ("testserver", 80),
+    }
+    client.portal.call(api.app, scope, receive, send)  # pyright: ignore [reportOptionalMemberAccess]
+
+    assert sent[0]["status"] == 413
+    # Turned away as soon as the limit was crossed, without reading the rest of the body.
+    assert len(received) < len(chunks)
+
+
+def test_infer_is_unavailable_while_saturated(client, make_image_bytes):
+    controller = api._get_admission()
+    for _ in range(api.MAX_IN_FLIGHT_REQUESTS):  # pyright: ignore [reportArgumentType]
+        assert controller.try_acquire()
+    try:
+        response = client.post("/infer", files=_files(make_image_bytes()))
+    finally:
+        for _ in range(api.MAX_IN_FLIGHT_REQUESTS):  # pyright: ignore [reportArgumentType]
+            controller.release(0.0)
+
+    assert response.status_code == 503
+    assert "Retry-After" in response.headers
+    assert client.post("/infer", files=_files(make_image_bytes())).status_code == 200
+
+
+def test_infer_is_unavailable_when_a_worker_crashes(client, make_image_bytes):
+    response = client.post("/infer", files=_files(make_image_bytes(size=(64, CRASH_HEIGHT))))
+
+    assert response.status_code == 503
+    assert "Retry-After" in response.headers
+
+
+def test_swap_models(client, make_image_bytes):
+    assert [info["name"] for info in client.get("/models").json()] == ["default", "other"]
+
+    new_path = client.model_paths["new"]
+    url = f"/admin/models/default?model_path={new_path}"
+    assert client.post(url).status_code == 403
+    assert client.post(url, headers={"X-Admin-Token": "wrong"}).status_code == 403
+    response = client.post(url, headers={"X-Admin-Token": "secret"})
+
+    assert response.status_code == 200
+    assert response.json()["name"] == "default"
+    output = client.post("/infer", files=_files(make_image_bytes())).json()
+    assert output["results"][0]["inference"][0]["class_id"] == 2
+
+
+def test_stats_and_metrics(client, make_image_bytes):
+    client.post("/infer", files=_files(make_image_bytes()))
+
+    stats = client.get("/batching/stats").json()
+    assert stats["num_requests"] == 1
+    assert stats["num_images"] == 1
+
+    metrics = client.get("/metrics")
+    assert metrics.status_code == 200
+    assert 'skysealand_request_seconds_count{status="200"}' in metrics.text
+    assert "skysealand_images_total" in metrics.text
@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+from ultralytics import YOLO  # pyright: ignore [reportPrivateImportUsage]
+
+from skysealand import backends, boxes, inference
+
+
+def test_nms_drops_overlapping_boxes_of_the_same_class():
+    xyxy = np.array(
+        [[0, 0, 10, 10], [1, 1, 10, 10], [20, 20, 30, 30], [0, 0, 10, 10]], dtype=np.float32
+    )
+    scores = np.array([0.9, 0.8, 0.7, 0.6], dtype=np.float32)
+    class_ids = np.array([0, 0, 0, 1])
+
+    assert boxes.nms(xyxy, scores, 0.5).tolist() == [0, 2]
+    assert boxes.batched_nms(xyxy, scores, class_ids, 0.5).tolist() == [0, 2, 3]
+
+
+def test_pairwise_iou():
+    a = np.array([[0, 0, 10, 10]], dtype=np.float32)
+    b = np.array([[0, 0, 10, 10], [5, 0, 15, 10], [20, 20, 30, 30]], dtype=np.float32)
+
+    np.testing.assert_allclose(boxes.pairwise_iou(a, b), [[1.0, 1 / 3, 0.0]])
+
+
+@pytest.mark.parametrize(("stride", "expected_shape"), [(None, (64, 64, 3)), (32, (32, 64, 3))])
+def test_letterbox(stride, expected_shape):
+    image = np.zeros((30, 60, 3), dtype=np.uint8)
+
+    padded, scale, padding = backends.letterbox(image, (64, 64), stride)
+
+    assert padded.shape == expected_shape
+    assert scale == (64 / 60, 32 / 30)
+    assert padding == (0, (expected_shape[0] - 32) // 2)
+
+
+def test_ultralytics_backend_converts_to_bgr():
+    class DummyYOLO:
+        def __call__(self, images, **kwargs):
+            self.images = images
+            return []
+
+    model = DummyYOLO()
+    image = np.zeros((4, 4, 3), dtype=np.uint8)
+    image[..., 0] = 255
+
+    backends.UltralyticsBackend(model).detect([image])
+
+    assert model.images[0][0, 0].tolist() == [0, 0, 255]
+
+
+def test_onnx_backend_matches_ultralytics(tmp_path, monkeypatch):
+    pytest.importorskip("onnx")
+    pytest.importorskip("onnxruntime")
+
+    # An untrained model has very low confidences, so keep almost everything.
+    confidence_threshold = 5e-5
+    monkeypatch.chdir(tmp_path)
+    model = YOLO("yolov8n.yaml")
+    onnx_path = model.export(format="onnx", dynamic=True)
+
+    rng = np.random.default_rng(0)
+    images = [rng.integers(0, 255, (480, 640, 3), dtype=np.uint8) for _ in range(2)]
+    images.append(rng.integers(0, 255, (300, 500, 3), dtype=np.uint8))
+
+    ours = backends.OnnxBackend(onnx_path, confidence_threshold=confidence_threshold)
+    reference = backends.UltralyticsBackend(
+        YOLO(onnx_path, task="detect"), confidence_threshold=confidence_threshold
+    )
+    for batch in (images[:2], images):
+        expected = [inference.columnar_to_detections(c) for c in reference.detect(batch)]
+        actual = [inference.columnar_to_detections(c) for c in ours.detect(batch)]
+
+        assert sum(len(dets) for dets in expected) > 0
+        for actual_dets, expected_dets in zip(actual, expected, strict=True):
+            assert len(actual_dets) == len(expected_dets)
+            for a, e in zip(
+                sorted(actual_dets, key=lambda d: -d["confidence"]),
+                sorted(expected_dets, key=lambda d: -d["confidence"]),
+                strict=True,
+            ):
+                assert a["class_id"] == e["class_id"]
+                assert a["confidence"] == pytest.approx(e["confidence"], rel=1e-4)
+                assert a["bbox"] == pytest.approx(e["bbox"], abs=1e-2)
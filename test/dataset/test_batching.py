@@ -0,0 +1,96 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from skysealand import batching, inference
+
+
+class RecordingRunBatch:
+    def __init__(self):
+        self.batch_sizes = []
+
+    def __call__(self, images, filenames) -> inference.InferenceJsonOutput:
+        self.batch_sizes.append(len(images))
+        return {
+            "results": [{"filename": name, "inference": []} for name in filenames],
+            "metrics": {
+                "num_images": len(images),
+                "inference_time_sec": 0.0,
+                "stage_times_sec": {"forward": 0.5},
+            },
+        }
+
+
+def _images(n):
+    return [np.zeros((8, 8, 3), dtype=np.uint8) for _ in range(n)]
+
+
+def test_concurrent_requests_share_a_batch():
+    run_batch = RecordingRunBatch()
+
+    async def main():
+        batcher = batching.MicroBatcher(run_batch, max_batch_size=8, max_wait_ms=50)
+        outputs = await asyncio.gather(
+            batcher.submit(_images(1), ["a.jpg"]),
+            batcher.submit(_images(2), ["b.jpg", "c.jpg"]),
+            batcher.submit(_images(1), ["d.jpg"]),
+        )
+        stats = batcher.stats()
+        await batcher.close()
+        return outputs, stats
+
+    outputs, stats = asyncio.run(main())
+
+    assert run_batch.batch_sizes == [4]
+    assert [[r["filename"] for r in o["results"]] for o in outputs] == [
+        ["a.jpg"],
+        ["b.jpg", "c.jpg"],
+        ["d.jpg"],
+    ]
+    assert [o["metrics"]["num_images"] for o in outputs] == [1, 2, 1]
+    assert outputs[0]["metrics"]["batch_fill_ratio"] == 0.5
+    assert outputs[0]["metrics"]["queue_time_sec"] >= 0
+    assert all(o["metrics"].get("stage_times_sec") == {"forward": 0.5} for o in outputs)
+    assert stats["num_batches"] == 1
+    assert stats["num_requests"] == 3
+    assert stats["mean_batch_fill_ratio"] == 0.5
+
+
+def test_batches_respect_max_batch_size():
+    run_batch = RecordingRunBatch()
+
+    async def main():
+        batcher = batching.MicroBatcher(run_batch, max_batch_size=3, max_wait_ms=50)
+        await asyncio.gather(
+            *(batcher.submit(_images(2), [f"{i}a.jpg", f"{i}b.jpg"]) for i in range(3))
+        )
+        await batcher.close()
+
+    asyncio.run(main())
+
+    assert run_batch.batch_sizes == [2, 2, 2]
+
+
+def test_batch_errors_propagate_to_every_request():
+    def failing_run_batch(images, filenames):
+        raise ValueError("bad batch")
+
+    async def main():
+        batcher = batching.MicroBatcher(failing_run_batch, max_batch_size=4, max_wait_ms=10)
+        results = await asyncio.gather(
+            batcher.submit(_images(1), ["a.jpg"]),
+            batcher.submit(_images(1), ["b.jpg"]),
+            return_exceptions=True,
+        )
+        await batcher.close()
+        return results
+
+    results = asyncio.run(main())
+
+    assert all(isinstance(r, ValueError) for r in results)
+
+
+def test_invalid_batcher_config():
+    with pytest.raises(ValueError, match="max_batch_size"):
+        batching.MicroBatcher(RecordingRunBatch(), max_batch_size=0)
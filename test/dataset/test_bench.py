@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from skysealand import bench
+
+
+def test_write_synthetic_images(tmp_path):
+    paths = bench.write_synthetic_images(tmp_path, 2, 320)
+
+    assert len(paths) == 2
+    with Image.open(paths[0]) as image:
+        assert image.size == (320, 240)
+
+
+def test_summarize():
+    result = bench.summarize("load_images", {"batch_size": 2}, [0.1] * 9 + [1.0], num_images=2)
+
+    assert result["images_per_sec"] == pytest.approx(20 / 1.9)
+    np.testing.assert_allclose(result["p50_ms"], 100)
+    assert result["p99_ms"] > result["p95_ms"] > result["p50_ms"]
+
+
+def _report(images_per_sec: float) -> bench.BenchmarkReport:
+    return {
+        "environment": {},
+        "results": [
+            {
+                "benchmark": "load_images",
+                "params": {"batch_size": 1},
+                "images_per_sec": images_per_sec,
+                "p50_ms": 1.0,
+                "p95_ms": 1.0,
+                "p99_ms": 1.0,
+            }
+        ],
+    }
+
+
+def test_compare_finds_regressions():
+    assert bench.compare(_report(100), _report(95)) == []
+    assert bench.compare(_report(100), _report(50)) == [
+        "load_images {'batch_size': 1}: 100.0 -> 50.0 images/sec (-50%)"
+    ]
@@ -0,0 +1,121 @@
+import functools
+import io
+
+import pytest
+
+from skysealand import inference, pipeline
+
+DETECTIONS: list[inference.Detection] = [
+    {"class_id": 1, "confidence": 0.5, "bbox": (1.0, 2.0, 3.0, 4.0)}
+]
+
+
+def test_cache_counts_hits_and_misses():
+    cache = inference.DetectionCache("model")
+    key = cache.key(b"image")
+
+    assert cache.get(key) is None
+    cache.put(key, DETECTIONS)
+    assert cache.get(key) == DETECTIONS
+
+    stats = cache.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+    assert stats["memory_entries"] == 1
+
+
+def test_cache_evicts_least_recently_used():
+    cache = inference.DetectionCache("model", max_memory_bytes=2000)
+    for i in range(3):
+        cache.put(str(i), DETECTIONS)
+    cache.get("0")
+    cache.put("3", DETECTIONS)
+
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["memory_bytes"] <= 2000
+    assert cache.get("1") is None
+    assert cache.get("0") == DETECTIONS
+
+
+def test_disk_tier_survives_a_new_cache(tmp_path):
+    inference.DetectionCache("model", disk_dir=tmp_path).put("key", DETECTIONS)
+
+    assert inference.DetectionCache("model", disk_dir=tmp_path).get("key") == DETECTIONS
+    assert inference.DetectionCache("other-model", disk_dir=tmp_path).get("key") is None
+
+
+def test_model_fingerprint_changes_with_weights(tmp_path):
+    weights = tmp_path / "model.pt"
+    weights.write_bytes(b"weights")
+    before = inference.model_fingerprint(weights)
+    weights.write_bytes(b"new weights")
+
+    assert inference.model_fingerprint(weights) != before
+
+
+def test_prepare_cached_batch_decodes_duplicates_once(make_image_bytes):
+    cache = inference.DetectionCache("model")
+    red, blue = make_image_bytes(color=(255, 0, 0)), make_image_bytes(color=(0, 0, 255))
+    cache.put(cache.key(blue), DETECTIONS)
+
+    batch = inference.prepare_cached_batch(cache, [("a.jpg", red), ("b.jpg", blue), ("c.jpg", red)])
+
+    assert batch.filenames == ["a.jpg", "b.jpg", "c.jpg"]
+    assert len(batch.images) == 1
+    assert batch.cache_hits == 2
+
+    computed = inference.make_inference_output(batch.image_keys, [[]], 0.1)
+    output = inference.complete_cached_batch(cache, batch, computed)
+
+    assert [r["inference"] for r in output["results"]] == [[], DETECTIONS, []]
+    assert output["metrics"]["num_images"] == 3
+    assert output["metrics"].get("cache_hits") == 2
+    assert cache.get(cache.key(red)) == []
+
+
+def test_prepare_cached_batch_skips_invalid_images(make_image_bytes):
+    cache = inference.DetectionCache("model")
+    named_data = [("bad.jpg", b"not an image"), ("good.jpg", make_image_bytes(color=(0, 0, 0)))]
+
+    with pytest.raises(ValueError, match=r"Invalid image 'bad\.jpg'"):
+        inference.prepare_cached_batch(cache, named_data)
+
+    batch = inference.prepare_cached_batch(cache, named_data, skip_errors=True)
+    assert batch.filenames == ["good.jpg"]
+    assert len(batch.images) == 1
+
+
+class DummyResult:
+    boxes = None
+
+
+class DummyModel:
+    def __init__(self):
+        self.num_images = 0
+
+    def __call__(self, images):
+        self.num_images += len(images)
+        return [DummyResult() for _ in images]
+
+
+def test_streaming_inference_with_cache(tmp_path, make_image_bytes):
+    paths = []
+    for i in range(4):
+        paths.append(tmp_path / f"{i}.jpg")
+        paths[-1].write_bytes(make_image_bytes(color=(0, 0, 0) if i % 2 else (255, 255, 255)))
+
+    model = DummyModel()
+    cache = inference.DetectionCache("model")
+    run_batch = functools.partial(inference.run_model_with_timing, model)
+    for _ in range(2):
+        metrics = pipeline.run_streaming_inference(
+            run_batch,  # pyright: ignore [reportArgumentType]
+            paths,
+            pipeline.JsonResultWriter(io.StringIO()),
+            batch_size=4,
+            cache=cache,
+        )
+
+    assert model.num_images == 2
+    assert metrics["num_images"] == 4
+    assert metrics.get("cache_hits") == 4
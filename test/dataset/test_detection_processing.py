@@ -1,20 +1,21 @@
 import pathlib
 
 import numpy as np
+import torch
 
 from skysealand import inference
 
 
-class DummyBox:
-    def __init__(self):
-        self.cls = np.array([2])
-        self.conf = np.array([0.75])
-        self.xyxy = np.array([[1, 2, 3, 4]])
+class DummyBoxes:
+    def __init__(self, num_boxes=1):
+        self.cls = np.array([2.0] * num_boxes)
+        self.conf = np.array([0.75] * num_boxes)
+        self.xyxy = np.array([[1, 2, 3, 4]] * num_boxes).reshape(-1, 4)
 
 
 class DummyResult:
     def __init__(self, num_boxes=1):
-        self.boxes = [DummyBox() for _ in range(num_boxes)]
+        self.boxes = DummyBoxes(num_boxes)
 
 
 def test_process_single_result():
@@ -39,6 +40,37 @@ def test_process_empty_boxes():
     assert output == [[]]
 
 
+def test_process_torch_results():
+    boxes = DummyBoxes(num_boxes=3)
+    boxes.cls = torch.tensor([0.0, 1.0, 3.0])
+    boxes.conf = torch.tensor([0.9, 0.5, 0.25])
+    boxes.xyxy = torch.arange(12, dtype=torch.float32).reshape(3, 4)
+    result = DummyResult(num_boxes=0)
+    result.boxes = boxes
+
+    output = inference.process_ultralytics_yolo_batched_detections([result])
+
+    assert [det["class_id"] for det in output[0]] == [0, 1, 3]
+    assert output[0][2] == {
+        "class_id": 3,
+        "confidence": 0.25,
+        "bbox": (8.0, 9.0, 10.0, 11.0),
+    }
+
+
+def test_process_columnar():
+    results = [DummyResult(num_boxes=2), DummyResult(num_boxes=0)]
+
+    output = inference.process_ultralytics_yolo_batched_detections_columnar(results)
+
+    assert output[0]["boxes"].shape == (2, 4)
+    assert output[0]["boxes"].dtype == np.float32
+    assert output[0]["scores"].tolist() == [0.75, 0.75]
+    assert output[0]["class_ids"].tolist() == [2, 2]
+    assert output[1]["boxes"].shape == (0, 4)
+    assert inference.columnar_to_detections(output[1]) == []
+
+
 class DummyModel:
     def __call__(self, images):
         # Return one dummy "result" per image
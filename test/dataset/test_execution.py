@@ -0,0 +1,76 @@
+import asyncio
+import io
+import time
+
+import pytest
+from fastapi import UploadFile
+
+from skysealand import batching, execution
+
+
+def test_read_uploads():
+    upload = UploadFile(filename="a.jpg", file=io.BytesIO(b"abc"))
+
+    assert asyncio.run(execution.read_uploads(upload)) == [("a.jpg", b"abc")]
+
+
+@pytest.mark.parametrize("kind", ["thread", "process"])
+def test_decode_keeps_order(kind, make_image_bytes):
+    layer = execution.ExecutionLayer(decode_workers=2, decode_executor=kind)
+    data = [
+        ("a.jpg", make_image_bytes(size=(16, 8))),
+        ("b.png", make_image_bytes(fmt="PNG", size=(4, 4))),
+        ("c.jpg", make_image_bytes(size=(8, 16))),
+    ]
+    try:
+        images, names, scales = asyncio.run(layer.decode(data))
+    finally:
+        layer.shutdown()
+
+    assert names == ["a.jpg", "b.png", "c.jpg"]
+    assert [img.shape for img in images] == [(8, 16, 3), (4, 4, 3), (16, 8, 3)]
+    assert scales == [(1.0, 1.0)] * 3
+
+
+def test_decode_errors(make_image_bytes):
+    layer = execution.ExecutionLayer(decode_workers=1)
+    data = [("ok.jpg", make_image_bytes()), ("bad.jpg", b"not an image")]
+    try:
+        with pytest.raises(ValueError, match=r"Invalid image 'bad\.jpg'"):
+            asyncio.run(layer.decode(data))
+        _, names, _ = asyncio.run(layer.decode(data, skip_errors=True))
+    finally:
+        layer.shutdown()
+
+    assert names == ["ok.jpg"]
+
+
+def test_inference_does_not_block_event_loop():
+    def slow_run_batch(images, filenames):
+        time.sleep(0.2)
+        return {
+            "results": [{"filename": name, "inference": []} for name in filenames],
+            "metrics": {"num_images": len(images), "inference_time_sec": 0.2},
+        }
+
+    async def main():
+        layer = execution.ExecutionLayer(decode_workers=1)
+        batcher = batching.MicroBatcher(
+            slow_run_batch, max_wait_ms=0, executor=layer.inference_executor
+        )
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        ticker = asyncio.create_task(tick())
+        await batcher.submit([], [])
+        ticker.cancel()
+        await batcher.close()
+        layer.shutdown()
+        return ticks
+
+    assert asyncio.run(main()) > 5
@@ -38,7 +38,7 @@ def test_load_images_from_paths(tmp_path):
     images, names = inference.load_images(img1, img2)
 
     assert len(images) == 2
-    assert names == ["a.jpg", "b.png"]
+    assert names == [str(img1), str(img2)]
 
 
 def test_load_images_skips_invalid_when_configured(tmp_path):
@@ -51,7 +51,7 @@ def test_load_images_skips_invalid_when_configured(tmp_path):
     images, names = inference.load_images(valid, invalid, skip_errors=True)
 
     assert len(images) == 1
-    assert names == ["ok.jpg"]
+    assert names == [str(valid)]
 
 
 def test_load_images_raises_on_invalid_by_default(tmp_path):
@@ -62,22 +62,102 @@ def test_load_images_raises_on_invalid_by_default(tmp_path):
         inference.load_images(bad)
 
 
-def make_image_bytes(fmt="JPEG", size=(32, 32)):
-    img = Image.new("RGB", size, color="blue")
-    buf = io.BytesIO()
-    img.save(buf, format=fmt)
-    return buf.getvalue()
-
-
-def make_upload_file(filename="test.jpg", fmt="JPEG"):
-    data = make_image_bytes(fmt=fmt)
+def make_upload_file(data: bytes, filename="test.jpg"):
     return UploadFile(filename=filename, file=io.BytesIO(data))
 
 
-def test_load_images_from_uploadfile():
-    upload = make_upload_file()
+def test_load_images_from_uploadfile(make_image_bytes):
+    upload = make_upload_file(make_image_bytes())
 
     images, names = inference.load_images(upload)
 
     assert len(images) == 1
     assert names == ["test.jpg"]
+
+
+def test_load_images_in_parallel_keeps_order(tmp_path):
+    paths = []
+    for i in range(8):
+        paths.append(tmp_path / f"{i}.jpg")
+        Image.new("RGB", (8 + i, 8)).save(paths[-1])
+    (tmp_path / "bad.jpg").write_text("not an image")
+    paths.insert(3, tmp_path / "bad.jpg")
+
+    images, names = inference.load_images(*paths, skip_errors=True, num_workers=4)
+
+    assert names == [str(tmp_path / f"{i}.jpg") for i in range(8)]
+    assert [img.shape[1] for img in images] == [8 + i for i in range(8)]
+
+    with pytest.raises(ValueError, match=r"Invalid image '.*bad\.jpg"):
+        inference.load_images(*paths, num_workers=4)
+
+
+def test_load_images_with_mmap(tmp_path):
+    path = tmp_path / "a.png"
+    Image.new("RGB", (8, 4)).save(path)
+    empty = tmp_path / "empty.jpg"
+    empty.touch()
+
+    images, names = inference.load_images(path, empty, skip_errors=True, use_mmap=True)
+
+    assert names == [str(path)]
+    assert images[0].shape == (4, 8, 3)
+
+
+def test_decode_reduces_large_jpegs(make_image_bytes):
+    data = make_image_bytes(size=(2600, 1400))
+
+    arr, scale = inference._decode_image(data, target_size=640)
+
+    assert arr.shape == (700, 1300, 3)
+    assert scale == (2.0, 2.0)
+
+
+def test_decoded_images_are_writable(make_image_bytes):
+    arr, _ = inference._decode_image(make_image_bytes(size=(32, 32)), target_size=640)
+
+    arr[0, 0] = 255
+    assert arr.flags.writeable
+
+
+def test_decode_keeps_pngs_at_full_resolution(make_image_bytes):
+    arr, scale = inference._decode_image(make_image_bytes(fmt="PNG", size=(1400, 1400)), 640)
+
+    assert arr.shape == (1400, 1400, 3)
+    assert scale == (1.0, 1.0)
+
+
+def test_decode_rejects_truncated_images():
+    noise = np.random.default_rng(0).integers(0, 255, (256, 256, 3), dtype=np.uint8)
+    buf = io.BytesIO()
+    Image.fromarray(noise).save(buf, format="JPEG")
+    data = buf.getvalue()
+
+    with pytest.raises(OSError, match="truncated"):
+        inference._decode_image(data[: len(data) // 2])
+
+
+def test_load_reduced_images(tmp_path):
+    path = tmp_path / "big.jpg"
+    Image.new("RGB", (1400, 2800)).save(path)
+
+    images, names, scales = inference.load_reduced_images(path, target_size=640)
+
+    assert names == [str(path)]
+    assert images[0].shape == (1400, 700, 3)
+    assert scales == [(2.0, 2.0)]
+
+
+def test_rescale_results():
+    results: list[inference.SingleInferenceJsonOutput] = [
+        {
+            "filename": "a.jpg",
+            "inference": [{"class_id": 1, "confidence": 0.5, "bbox": (1, 2, 3, 4)}],
+        },
+        {"filename": "b.jpg", "inference": []},
+    ]
+
+    rescaled = inference.rescale_results(results, [(2.0, 4.0), (8.0, 8.0)])
+
+    assert rescaled[0]["inference"][0]["bbox"] == (2.0, 8.0, 6.0, 16.0)
+    assert rescaled[1] == results[1]
@@ -0,0 +1,62 @@
+import pathlib
+
+import pytest
+from PIL import Image
+
+from skysealand.dataset import index
+
+
+@pytest.fixture
+def data_dir(bad_data_dir) -> pathlib.Path:
+    # An image of another format, and a label file without an image.
+    Image.new("RGB", (64, 48)).save(bad_data_dir / "test" / "images" / "extra.PNG")
+    (bad_data_dir / "test" / "labels" / "extra.txt").write_text("1 0.5 0.5 0.1 0.1\n")
+    (bad_data_dir / "test" / "labels" / "orphan.txt").write_text("")
+    return bad_data_dir
+
+
+def test_index_records_the_dataset(data_dir):
+    with index.open_index(data_dir / "dummy-data.yaml") as dataset_index:
+        assert dataset_index.num_images() == 4
+        assert dataset_index.num_images("test") == 2
+        assert len(dataset_index.pairs("train")) == 1
+        assert len(dataset_index.missing_annotation("train")) == 1
+        assert dataset_index.missing_image("test") == [str(data_dir / "test/labels/orphan.txt")]
+        assert dataset_index.class_histogram("test") == {1: 2, 2: 26, 100: 1}
+        assert dataset_index.class_histogram() == {1: 2, 2: 26, 3: 2, 100: 1}
+
+        extra = next(
+            image for image in dataset_index.images("test") if image["image_path"].stem == "extra"
+        )
+        assert (extra["width"], extra["height"], extra["num_boxes"]) == (64, 48, 1)
+        assert [path.name for path in dataset_index.image_paths(more_boxes_than=10)] == [
+            "sample_01049.jpg"
+        ]
+
+    assert (data_dir / index.INDEX_NAME).exists()
+
+
+def test_index_refreshes_only_what_changed(data_dir, monkeypatch):
+    config_path = data_dir / "dummy-data.yaml"
+    index.open_index(config_path).close()
+
+    read = []
+    image_dimensions = index._image_dimensions
+
+    def recording_image_dimensions(path):
+        read.append(pathlib.Path(path).name)
+        return image_dimensions(path)
+
+    monkeypatch.setattr(index, "_image_dimensions", recording_image_dimensions)
+
+    (data_dir / "test" / "labels" / "extra.txt").write_text("3 0.5 0.5 0.1 0.1\n" * 3)
+    (data_dir / "test" / "images" / "sample_01049.jpg").unlink()
+
+    with index.open_index(config_path) as dataset_index:
+        assert read == ["extra.PNG"]
+        assert dataset_index.image_paths("test") == [data_dir / "test" / "images" / "extra.PNG"]
+        assert dataset_index.class_histogram("test") == {3: 3}
+        assert sorted(dataset_index.missing_image("test")) == [
+            str(data_dir / "test/labels/orphan.txt"),
+            str(data_dir / "test/labels/sample_01049.txt"),
+        ]
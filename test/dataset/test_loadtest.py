@@ -0,0 +1,62 @@
+import asyncio
+
+import httpx
+import pytest
+from fastapi import FastAPI, File, HTTPException, UploadFile
+
+from skysealand import loadtest
+
+
+def _level(concurrency: int, requests_per_sec: float) -> loadtest.LevelResult:
+    return loadtest.summarize_level(
+        [0.1] * 10,
+        {"200": 10},
+        concurrency=concurrency,
+        rate=None,
+        elapsed_sec=10 / requests_per_sec,
+        images_per_request=1,
+    )
+
+
+def test_saturation_point():
+    levels = [_level(1, 10), _level(2, 19), _level(4, 20), _level(8, 30)]
+
+    assert loadtest.saturation_point(levels) == 2
+    assert loadtest.saturation_point(levels[:2]) is None
+
+
+def _echo_app() -> FastAPI:
+    """Fails every request with more than one file, and answers the rest."""
+    app = FastAPI()
+
+    @app.post("/infer")
+    async def infer(files: list[UploadFile] = File(...)):
+        if len(files) > 1:
+            raise HTTPException(status_code=400)
+        return {"filename": files[0].filename, "size": len(await files[0].read())}
+
+    return app
+
+
+@pytest.mark.parametrize(("rate", "images_per_request"), [(None, 1), (50.0, 2)])
+def test_run_level(rate, images_per_request):
+    uploads = loadtest.synthetic_uploads((64,), num_images=2)
+
+    async def main():
+        async with httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=_echo_app()), base_url="http://test"
+        ) as client:
+            payloads = loadtest._Payloads(uploads, images_per_request, unique=True)
+            return await loadtest.run_level(
+                client, payloads, concurrency=2, duration_sec=0.2, rate=rate
+            )
+
+    result = asyncio.run(main())
+
+    assert result["num_requests"] > 0
+    if images_per_request == 1:
+        assert result["num_errors"] == 0
+        assert result["p99_ms"] >= result["p50_ms"] > 0
+    else:
+        assert result["statuses"] == {"400": result["num_requests"]}
+        assert result["error_rate"] == 1.0
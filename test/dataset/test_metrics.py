@@ -0,0 +1,51 @@
+import pytest
+
+from skysealand import inference, metrics
+
+
+def test_histogram_renders_cumulative_buckets():
+    registry = metrics.Registry()
+    histogram = registry.histogram("latency_seconds", "Latency.", ("stage",), buckets=(0.1, 1.0))
+
+    histogram.observe(0.05, stage="decode")
+    histogram.observe(0.5, stage="decode")
+    histogram.observe(5.0, stage="decode")
+
+    assert registry.render().splitlines() == [
+        "# HELP latency_seconds Latency.",
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{stage="decode",le="0.1"} 1',
+        'latency_seconds_bucket{stage="decode",le="1.0"} 2',
+        'latency_seconds_bucket{stage="decode",le="+Inf"} 3',
+        'latency_seconds_sum{stage="decode"} 5.55',
+        'latency_seconds_count{stage="decode"} 3',
+    ]
+
+
+def test_counter_and_gauge():
+    counter = metrics.Counter("images_total", "Images.")
+    gauge = metrics.Gauge("in_flight", "In flight.")
+
+    counter.inc(3)
+    gauge.inc()
+    gauge.inc()
+    gauge.dec()
+
+    assert counter.value() == 3
+    assert "in_flight 1.0" in gauge.render()
+    with pytest.raises(ValueError, match="only go up"):
+        counter.inc(-1)
+    with pytest.raises(ValueError, match="labels"):
+        counter.inc(status="200")
+
+
+def test_time_stage_accumulates():
+    stage_times: inference.StageTimes = {}
+
+    with inference.time_stage(stage_times, "decode"):
+        pass
+    with inference.time_stage(stage_times, "decode"):
+        pass
+
+    assert list(stage_times) == ["decode"]
+    assert inference.sum_stage_times(stage_times, {"forward": 1.0})["forward"] == 1.0
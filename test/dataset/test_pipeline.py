@@ -0,0 +1,195 @@
+import functools
+import io
+import json
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from skysealand import inference, pipeline, serialization
+
+
+def test_iter_batches():
+    assert list(pipeline.iter_batches(range(5), 2)) == [[0, 1], [2, 3], [4]]
+    assert list(pipeline.iter_batches([], 2)) == []
+
+
+def test_prefetch_keeps_order():
+    assert list(pipeline.prefetch(iter(range(10)), max_prefetch=2)) == list(range(10))
+
+
+def test_prefetch_reraises_errors():
+    def failing():
+        yield 1
+        raise RuntimeError("boom")
+
+    consumed = []
+    with pytest.raises(RuntimeError, match="boom"):
+        for item in pipeline.prefetch(failing()):
+            consumed.append(item)
+
+    assert consumed == [1]
+
+
+@pytest.mark.parametrize("num_results", [0, 1, 3])
+def test_json_writer_matches_json_dump(num_results):
+    results: list[inference.SingleInferenceJsonOutput] = [
+        {
+            "filename": f"{i}.jpg",
+            "inference": [{"class_id": i, "confidence": 0.5, "bbox": (1.0, 2.0, 3.0, 4.0)}],
+        }
+        for i in range(num_results)
+    ]
+    metrics: inference.InferenceMetaData = {"num_images": num_results, "inference_time_sec": 0.1}
+
+    buf = io.StringIO()
+    writer = pipeline.JsonResultWriter(buf)
+    writer.write(results[:1])
+    writer.write(results[1:])
+    writer.close(metrics)
+
+    assert buf.getvalue() == json.dumps({"results": results, "metrics": metrics}, indent=4)
+
+
+class DummyResult:
+    boxes = None
+
+
+class DummyModel:
+    def __init__(self):
+        self.batch_sizes = []
+
+    def __call__(self, images):
+        self.batch_sizes.append(len(images))
+        return [DummyResult() for _ in images]
+
+
+def test_run_streaming_inference(tmp_path):
+    paths = []
+    for i in range(5):
+        paths.append(tmp_path / f"{i}.jpg")
+        Image.new("RGB", (8, 8)).save(paths[-1])
+    (tmp_path / "bad.jpg").write_text("not an image")
+    paths.insert(2, tmp_path / "bad.jpg")
+
+    model = DummyModel()
+    buf = io.StringIO()
+    metrics = pipeline.run_streaming_inference(
+        functools.partial(inference.run_model_with_timing, model),  # pyright: ignore [reportArgumentType]
+        paths,
+        pipeline.JsonResultWriter(buf),
+        batch_size=2,
+    )
+
+    output = json.loads(buf.getvalue())
+    assert [r["filename"] for r in output["results"]] == [
+        str(tmp_path / f"{i}.jpg") for i in range(5)
+    ]
+    assert output["metrics"]["num_images"] == metrics["num_images"] == 5
+    assert model.batch_sizes == [2, 1, 2]
+
+
+class TileCountingBackend:
+    """Finds nothing, and records how many decoded images were held in memory at each batch."""
+
+    def __init__(self):
+        self.batch_sizes = []
+        self.num_decoded = 0
+        self.num_written = 0
+        self.in_memory = []
+
+    def detect(self, images, stage_times=None):
+        self.batch_sizes.append(len(images))
+        self.in_memory.append(self.num_decoded - self.num_written)
+        empty = np.zeros((0,), dtype=np.float32)
+        return [{"boxes": empty.reshape(0, 4), "scores": empty, "class_ids": empty} for _ in images]
+
+
+def test_tiled_streaming_inference_decodes_one_image_at_a_time(tmp_path, monkeypatch):
+    paths = []
+    for i in range(8):
+        paths.append(tmp_path / f"{i}.png")
+        Image.new("RGB", (300, 200)).save(paths[-1])
+    model = TileCountingBackend()
+    load_reduced_images = inference.load_reduced_images
+
+    def counting_load_reduced_images(*args, **kwargs):
+        images, filenames, scales = load_reduced_images(*args, **kwargs)
+        model.num_decoded += len(images)
+        return images, filenames, scales
+
+    monkeypatch.setattr(inference, "load_reduced_images", counting_load_reduced_images)
+
+    class CountingWriter(pipeline.JsonResultWriter):
+        def write(self, results):
+            model.num_written += len(results)
+            super().write(results)
+
+    buf = io.StringIO()
+    metrics = pipeline.run_tiled_streaming_inference(
+        model, paths, CountingWriter(buf), tile_size=128, overlap=16, batch_size=4, max_prefetch=1
+    )
+
+    assert metrics["num_images"] == 8
+    # Each image has 3 x 2 tiles, which are batched on their own.
+    assert model.batch_sizes == [4, 2] * 8
+    # The image being run, the one waiting for the model, and the one being decoded.
+    assert max(model.in_memory) <= 3
+    output = json.loads(buf.getvalue())
+    assert [r["filename"] for r in output["results"]] == [str(path) for path in paths]
+
+
+def test_ndjson_resume(tmp_path):
+    paths = []
+    for i in range(4):
+        paths.append(tmp_path / f"{i}.jpg")
+        Image.new("RGB", (8, 8)).save(paths[-1])
+    output_path = tmp_path / "out.ndjson"
+    run_batch = functools.partial(inference.run_model_with_timing, DummyModel())
+
+    with pipeline.open_result_writer(output_path, serialization.OutputFormat.NDJSON) as writer:
+        pipeline.run_streaming_inference(run_batch, paths[:2], writer)  # pyright: ignore [reportArgumentType]
+    # Simulate a run that crashed part way through writing a line.
+    with output_path.open("a") as f:
+        f.write(f'{{"filename": "{paths[2]}", "infer')
+
+    completed = pipeline.read_completed_filenames(output_path)
+    assert completed == {str(paths[0]), str(paths[1])}
+
+    with pipeline.open_result_writer(
+        output_path, serialization.OutputFormat.NDJSON, append=True
+    ) as writer:
+        pipeline.run_streaming_inference(
+            run_batch,  # pyright: ignore [reportArgumentType]
+            [p for p in paths if str(p) not in completed],
+            writer,
+        )
+
+    output = serialization.decode(output_path.read_bytes(), serialization.OutputFormat.NDJSON)
+    assert [r["filename"] for r in output["results"]] == [str(p) for p in paths]
+    assert output["metrics"]["num_images"] == 4
+
+
+def test_ndjson_resume_tells_apart_images_with_the_same_name(tmp_path):
+    paths = [tmp_path / "a" / "0.jpg", tmp_path / "b" / "0.jpg"]
+    for path in paths:
+        path.parent.mkdir()
+        Image.new("RGB", (8, 8)).save(path)
+    output_path = tmp_path / "out.ndjson"
+    run_batch = functools.partial(inference.run_model_with_timing, DummyModel())
+
+    with pipeline.open_result_writer(output_path, serialization.OutputFormat.NDJSON) as writer:
+        pipeline.run_streaming_inference(run_batch, paths[:1], writer)  # pyright: ignore [reportArgumentType]
+
+    completed = pipeline.read_completed_filenames(output_path)
+    assert [p for p in paths if str(p) not in completed] == paths[1:]
+
+
+def test_only_ndjson_can_be_appended(tmp_path):
+    with (
+        pytest.raises(ValueError, match="Only ndjson"),
+        pipeline.open_result_writer(
+            tmp_path / "out.json", serialization.OutputFormat.JSON, append=True
+        ),
+    ):
+        pass
@@ -0,0 +1,51 @@
+import pathlib
+
+import numpy as np
+import pytest
+from ultralytics import YOLO  # pyright: ignore [reportPrivateImportUsage]
+
+from skysealand import backends
+from skysealand.train import quantize
+
+
+@pytest.fixture
+def onnx_model_path(tmp_path, monkeypatch) -> pathlib.Path:
+    pytest.importorskip("onnx")
+    pytest.importorskip("onnxruntime")
+    monkeypatch.chdir(tmp_path)
+    return pathlib.Path(YOLO("yolov8n.yaml").export(format="onnx", dynamic=True))
+
+
+@pytest.mark.parametrize("mode", list(quantize.QuantizationMode))
+def test_quantized_model_can_be_served(onnx_model_path, dummy_data_dir, mode):
+    int8_path = quantize.quantize(
+        onnx_model_path,
+        mode,
+        dataset_config_path=dummy_data_dir / "dummy-data.yaml",
+        num_calibration_images=1,
+    )
+
+    assert int8_path.name == "yolov8n.int8.onnx"
+    backend = backends.load_backend(int8_path)
+    detections = backend.detect([np.zeros((48, 64, 3), dtype=np.uint8)])
+    assert len(detections) == 1
+
+
+def test_box_decoding_is_not_quantized(onnx_model_path):
+    excluded = quantize._head_nodes_to_exclude(onnx_model_path)
+
+    assert excluded
+    assert all("/cv2." not in name and "/cv3." not in name for name in excluded)
+    assert any("/dfl/" in name for name in excluded)
+
+
+def test_format_report():
+    report = quantize.format_report(
+        [
+            {"model_path": "fp32.onnx", "map50": 0.5, "images_per_sec": 10.0},
+            {"model_path": "int8.onnx", "map50": 0.48, "images_per_sec": 25.0},
+        ]
+    )
+
+    assert "2.50x" in report
+    assert "0.4800" in report
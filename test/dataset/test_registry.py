@@ -0,0 +1,94 @@
+import pathlib
+import threading
+
+import pytest
+
+from skysealand import inference, registry
+
+
+class Recorder:
+    def __init__(self):
+        self.loaded = []
+        self.warm_up_batches = []
+
+    def load(self, model_path, device):
+        self.loaded.append((model_path, device))
+        return f"model from {model_path}"
+
+    def run(self, model, images):
+        self.warm_up_batches.append((model, len(images), images[0].shape))
+
+
+def test_load_warms_up_the_model():
+    recorder = Recorder()
+    models = registry.ModelRegistry(recorder.load, recorder.run, warmup_batch_sizes=(1, 4))
+
+    new, old = models.load("detector", pathlib.Path("a.pt"))
+
+    assert old is None
+    assert new.model == "model from a.pt"
+    assert recorder.warm_up_batches == [
+        ("model from a.pt", 1, (640, 640, 3)),
+        ("model from a.pt", 4, (640, 640, 3)),
+    ]
+    assert models.get() is new
+    assert models.get("detector") is new
+
+
+def test_load_fingerprints_the_weights(tmp_path):
+    weights = tmp_path / "a.pt"
+    weights.write_bytes(b"weights")
+    models = registry.ModelRegistry(Recorder().load, warmup_batch_sizes=())
+
+    first, _ = models.load("detector", weights)
+    weights.write_bytes(b"new weights")
+    second, _ = models.load("detector", weights)
+
+    assert first.fingerprint != second.fingerprint
+    assert second.fingerprint == inference.model_fingerprint(weights)
+
+
+def test_unknown_model():
+    models = registry.ModelRegistry(Recorder().load, warmup_batch_sizes=())
+    models.load("detector", pathlib.Path("a.pt"))
+
+    with pytest.raises(ValueError, match="Unknown model 'other'"), models.acquire("other"):
+        pass
+
+
+def test_requests_finish_on_the_version_they_started_on():
+    models = registry.ModelRegistry(Recorder().load, warmup_batch_sizes=())
+    first, _ = models.load("detector", pathlib.Path("a.pt"))
+
+    with models.acquire() as version:
+        second, replaced = models.load("detector", pathlib.Path("b.pt"))
+
+        assert version is first
+        assert replaced is first
+        assert models.get() is second
+        assert first.in_flight == 1
+        assert not first.drain(timeout=0.01)
+
+    assert first.in_flight == 0
+    assert first.drain(timeout=0)
+    assert [v.info()["model_path"] for v in models.versions()] == ["b.pt"]
+
+
+def test_drain_waits_for_requests_in_other_threads():
+    models = registry.ModelRegistry(Recorder().load, warmup_batch_sizes=())
+    version, _ = models.load("detector", pathlib.Path("a.pt"))
+    acquired = threading.Event()
+    release = threading.Event()
+
+    def request():
+        with models.acquire():
+            acquired.set()
+            release.wait()
+
+    thread = threading.Thread(target=request)
+    thread.start()
+    acquired.wait()
+    release.set()
+
+    assert version.drain(timeout=5)
+    thread.join()
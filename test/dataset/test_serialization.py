@@ -0,0 +1,86 @@
+import io
+
+import numpy as np
+import pytest
+
+from skysealand import inference, serialization
+
+OUTPUT: inference.InferenceJsonOutput = {
+    "results": [
+        {
+            "filename": "a.jpg",
+            "inference": [
+                {"class_id": 2, "confidence": 0.42855, "bbox": (1028.77, 417.98, 1210.35, 538.37)},
+                {"class_id": 0, "confidence": 0.5, "bbox": (0.0, 1.0, 2.0, 3.0)},
+            ],
+        },
+        {"filename": "empty.jpg", "inference": []},
+        {
+            "filename": "b.png",
+            "inference": [
+                {"class_id": 13, "confidence": 0.25, "bbox": (0.2129, 0.0, 245.4, 193.5)}
+            ],
+        },
+    ],
+    "metrics": {"num_images": 3, "inference_time_sec": 0.28876129999844125},
+}
+
+
+@pytest.mark.parametrize("output_format", list(serialization.OutputFormat))
+def test_round_trip(output_format):
+    encoded = serialization.encode(OUTPUT, output_format)
+
+    assert serialization.decode(encoded, output_format) == OUTPUT
+
+
+@pytest.mark.parametrize("output_format", list(serialization.OutputFormat))
+def test_round_trip_with_stage_times(output_format):
+    output: inference.InferenceJsonOutput = {
+        "results": OUTPUT["results"],
+        "metrics": {
+            **OUTPUT["metrics"],
+            "stage_times_sec": {"decode": 0.01, "forward": 0.2, "postprocess": 0.003},
+        },
+    }
+    encoded = serialization.encode(output, output_format)
+
+    assert serialization.decode(encoded, output_format) == output
+    if output_format == serialization.OutputFormat.NPZ:
+        # Readable without unpickling anything.
+        with np.load(io.BytesIO(encoded)) as npz:
+            assert npz["metrics_stage_times_sec_forward"].item() == 0.2
+
+
+def test_columnar_layout():
+    arrays = serialization.to_columnar(OUTPUT)
+
+    assert arrays["filenames"].tolist() == ["a.jpg", "empty.jpg", "b.png"]
+    assert arrays["boxes"].shape == (3, 4)
+    assert arrays["class_ids"].tolist() == [2, 0, 13]
+    assert arrays["image_index"].tolist() == [0, 0, 2]
+    assert arrays["metrics_num_images"].item() == 3
+
+
+@pytest.mark.parametrize(
+    ("accept", "expected"),
+    [
+        (None, serialization.OutputFormat.JSON),
+        ("*/*", serialization.OutputFormat.JSON),
+        ("application/msgpack", serialization.OutputFormat.MSGPACK),
+        ("text/html, application/x-npz", serialization.OutputFormat.NPZ),
+        ("application/msgpack;q=0.5, application/x-npz;q=0.9", serialization.OutputFormat.NPZ),
+        ("application/msgpack;q=0, application/json", serialization.OutputFormat.JSON),
+    ],
+)
+def test_negotiate_format(accept, expected):
+    assert serialization.negotiate_format(accept) == expected
+
+
+def test_negotiate_format_without_msgpack(monkeypatch):
+    monkeypatch.setattr(serialization, "msgpack", None)
+
+    assert serialization.negotiate_format("application/msgpack") == serialization.OutputFormat.JSON
+    assert (
+        serialization.negotiate_format("application/msgpack, application/x-npz;q=0.5")
+        == serialization.OutputFormat.NPZ
+    )
@@ -0,0 +1,86 @@
+import numpy as np
+import pytest
+
+from skysealand import inference
+
+
+def test_tile_images_are_overlapping_views():
+    image = np.zeros((1000, 1500, 3), dtype=np.uint8)
+    small = np.zeros((100, 200, 3), dtype=np.uint8)
+
+    tiled = inference.tile_images([image, small], tile_size=640, overlap=64)
+
+    assert tiled.offsets == [(0, 0), (576, 0), (860, 0), (0, 360), (576, 360), (860, 360), (0, 0)]
+    assert tiled.image_indices == [0, 0, 0, 0, 0, 0, 1]
+    assert all(tile.shape == (640, 640, 3) for tile in tiled.tiles[:6])
+    assert tiled.tiles[6].shape == small.shape
+    assert all(np.shares_memory(tile, image) for tile in tiled.tiles[:6])
+
+
+@pytest.mark.parametrize("overlap", [-1, 640])
+def test_tile_images_rejects_bad_overlap(overlap):
+    with pytest.raises(ValueError, match="overlap"):
+        inference.tile_images([np.zeros((8, 8, 3), dtype=np.uint8)], tile_size=640, overlap=overlap)
+
+
+def test_merge_tile_detections_maps_to_image_and_merges_seams():
+    tiled = inference.TiledImages(
+        tiles=[np.zeros(0)] * 3,
+        offsets=[(0, 0), (100, 0), (0, 0)],
+        image_indices=[0, 0, 1],
+        num_images=2,
+    )
+    tile_detections: list[list[inference.Detection]] = [
+        [{"class_id": 0, "confidence": 0.9, "bbox": (110.0, 0.0, 150.0, 40.0)}],
+        [
+            {"class_id": 0, "confidence": 0.8, "bbox": (11.0, 0.0, 50.0, 40.0)},
+            {"class_id": 1, "confidence": 0.7, "bbox": (11.0, 0.0, 50.0, 40.0)},
+        ],
+        [],
+    ]
+
+    merged = inference.merge_tile_detections(tiled, tile_detections)
+
+    assert merged[1] == []
+    assert [(d["class_id"], d["confidence"]) for d in merged[0]] == [(0, 0.9), (1, 0.7)]
+    assert merged[0][1]["bbox"] == (111.0, 0.0, 150.0, 40.0)
+
+
+class TileBackend:
+    """Finds one box in the top left corner of every tile."""
+
+    def __init__(self):
+        self.batch_sizes = []
+
+    def detect(self, images, stage_times=None):
+        self.batch_sizes.append(len(images))
+        if stage_times is not None:
+            stage_times["forward"] = stage_times.get("forward", 0.0) + 1.0
+        return [
+            {
+                "boxes": np.array([[10, 10, 20, 20]], dtype=np.float32),
+                "scores": np.array([0.5], dtype=np.float32),
+                "class_ids": np.array([3]),
+            }
+            for _ in images
+        ]
+
+
+def test_run_tiled_model_with_timing():
+    model = TileBackend()
+    images = [np.zeros((1000, 1500, 3), dtype=np.uint8), np.zeros((50, 50, 3), dtype=np.uint8)]
+
+    output = inference.run_tiled_model_with_timing(
+        model, images, ["big.jpg", "small.jpg"], tile_size=640, max_tiles_per_batch=4
+    )
+
+    assert model.batch_sizes == [4, 3]
+    assert output["metrics"]["num_images"] == 2
+    assert output["metrics"].get("num_tiles") == 7
+    assert output["metrics"].get("stage_times_sec", {}).get("forward") == 2.0
+    big, small = output["results"]
+    assert big["filename"] == "big.jpg"
+    assert sorted(d["bbox"][:2] for d in big["inference"]) == sorted(
+        (x + 10.0, y + 10.0) for x in (0, 576, 860) for y in (0, 360)
+    )
+    assert [d["bbox"] for d in small["inference"]] == [(10.0, 10.0, 20.0, 20.0)]
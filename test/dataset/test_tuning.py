@@ -0,0 +1,100 @@
+import json
+import time
+
+import numpy as np
+import pytest
+
+from skysealand import tuning
+
+
+def test_load_profile_from_file_and_environment(tmp_path):
+    path = tmp_path / "profile.json"
+    path.write_text(json.dumps({"torch_threads": 2, "batch_size": 8}))
+
+    profile = tuning.load_profile(
+        environ={"SKYSEALAND_PROFILE": str(path), "SKYSEALAND_BATCH_SIZE": "4"}
+    )
+
+    assert profile == tuning.ExecutionProfile(torch_threads=2, batch_size=4)
+    assert tuning.load_profile(environ={}) == tuning.ExecutionProfile()
+
+
+def test_load_profile_rejects_bad_values(tmp_path):
+    path = tmp_path / "profile.json"
+    path.write_text(json.dumps({"threads": 2}))
+
+    with pytest.raises(ValueError, match="Unknown execution profile fields"):
+        tuning.load_profile(path, environ={})
+    with pytest.raises(ValueError, match="SKYSEALAND_DECODE_WORKERS must be an integer"):
+        tuning.load_profile(environ={"SKYSEALAND_DECODE_WORKERS": "many"})
+    with pytest.raises(ValueError, match="batch_size must be at least 1"):
+        tuning.ExecutionProfile(batch_size=0)
+
+
+def test_model_threads_share_the_cores_between_processes(monkeypatch):
+    monkeypatch.setattr(tuning.os, "cpu_count", lambda: 8)
+
+    assert tuning.ExecutionProfile().model_threads() is None
+    assert tuning.ExecutionProfile(inference_processes=4).model_threads() == 2
+    assert tuning.ExecutionProfile(torch_threads=3, inference_processes=4).model_threads() == 3
+
+
+def test_candidate_thread_counts():
+    assert tuning.candidate_thread_counts(1) == (1,)
+    assert tuning.candidate_thread_counts(6) == (1, 2, 4, 6)
+
+
+def _trial(threads, batch_size, images_per_sec, p95_ms) -> tuning.TuneTrial:
+    return {
+        "torch_threads": threads,
+        "batch_size": batch_size,
+        "images_per_sec": images_per_sec,
+        "p95_ms": p95_ms,
+    }
+
+
+def test_best_trial_stays_within_the_latency_budget():
+    trials = [_trial(1, 1, 10, 100), _trial(1, 8, 30, 300), _trial(2, 16, 50, 600)]
+
+    assert tuning.best_trial(trials, latency_budget_ms=500) == trials[1]
+    assert tuning.best_trial(trials, latency_budget_ms=50) == trials[0]
+
+
+class SleepingBackend:
+    """Takes longer per image with fewer threads."""
+
+    def __init__(self, num_threads):
+        self.num_threads = num_threads
+
+    def detect(self, images, stage_times=None):
+        time.sleep(0.002 * len(images) / self.num_threads)
+        return [
+            {
+                "boxes": np.zeros((0, 4), dtype=np.float32),
+                "scores": np.zeros(0, dtype=np.float32),
+                "class_ids": np.zeros(0, dtype=np.int64),
+            }
+            for _ in images
+        ]
+
+
+def test_tune(tmp_path):
+    profile, report = tuning.tune(
+        tmp_path / "model.pt",
+        latency_budget_ms=1000,
+        thread_counts=(1, 2),
+        batch_sizes=(1, 2),
+        decode_workers=(1, 2),
+        resolution=64,
+        repeats=2,
+        model_loader=lambda _, num_threads: SleepingBackend(num_threads),
+    )
+
+    assert len(report["trials"]) == 4
+    assert len(report["decode_trials"]) == 2
+    assert profile.torch_threads == 2
+    assert profile.decode_workers in {1, 2}
+    assert report["profile"]["torch_threads"] == 2
+
+    tuning.save_profile(profile, tmp_path / "profile.json")
+    assert tuning.load_profile(tmp_path / "profile.json", environ={}) == profile
@@ -1,12 +1,17 @@
+import functools
+import os
 import pathlib
 
-from skysealand.dataset import validation
+import numpy as np
+import pytest
+from PIL import Image
 
+from skysealand.dataset import index, manifest, validation
 
-def test_validate_all_data():
-    good_data_dir = pathlib.Path(__file__).parent / "dummy-data"
+
+def test_validate_all_data(dummy_data_dir, bad_data_dir):
     good_report = validation.validate_all_data(
-        dataset_config_path=good_data_dir / "dummy-data.yaml",
+        dataset_config_path=dummy_data_dir / "dummy-data.yaml",
         report_path=None,
     )
     assert good_report == {
@@ -30,7 +35,6 @@ def test_validate_all_data():
         },
     }
 
-    bad_data_dir = pathlib.Path(__file__).parent / "dummy-data-with-errors"
     bad_report = validation.validate_all_data(
         dataset_config_path=bad_data_dir / "dummy-data.yaml",
         report_path=None,
@@ -48,3 +52,218 @@ def test_validate_all_data():
         "corrupt_images": [],
         "annotation_errors": {},
     }
+
+
+def test_parallel_validation_matches_serial(bad_data_dir):
+    serial_report = validation.validate_all_data(
+        dataset_config_path=bad_data_dir / "dummy-data.yaml", report_path=None, jobs=1
+    )
+    parallel_report = validation.validate_all_data(
+        dataset_config_path=bad_data_dir / "dummy-data.yaml", report_path=None, jobs=2
+    )
+    assert parallel_report == serial_report
+
+
+def test_image_checks_match_on_the_dummy_data(bad_data_dir):
+    verify_report = validation.validate_all_data(
+        dataset_config_path=bad_data_dir / "dummy-data.yaml", report_path=None
+    )
+    for image_check, deep_sample in [
+        (validation.ImageCheck.PROBE, 1.0),
+        (validation.ImageCheck.DEEP, 1.0),
+        (validation.ImageCheck.DEEP, 0.5),
+    ]:
+        report = validation.validate_all_data(
+            dataset_config_path=bad_data_dir / "dummy-data.yaml",
+            report_path=None,
+            image_check=image_check,
+            deep_sample=deep_sample,
+        )
+        assert report == verify_report
+
+
+@pytest.mark.parametrize("image_format", ["JPEG", "PNG", "WEBP"])
+def test_probe_detects_truncated_images(tmp_path, image_format):
+    path = tmp_path / f"image.{image_format.lower()}"
+    rng = np.random.default_rng(0)
+    Image.fromarray(rng.integers(0, 256, (48, 64, 3), dtype=np.uint8)).save(path, image_format)
+
+    assert validation._validate_image(path, validation.ImageCheck.PROBE) == (64, 48, "")
+
+    path.write_bytes(path.read_bytes()[:-100])
+    _, _, error = validation._validate_image(path, validation.ImageCheck.PROBE)
+    assert error == f"Truncated {image_format} image"
+    _, _, error = validation._validate_image(path, validation.ImageCheck.DEEP)
+    assert error
+
+
+def test_probe_accepts_jpeg_trailers(tmp_path):
+    path = tmp_path / "image.jpg"
+    Image.new("RGB", (64, 48)).save(path, "JPEG")
+    path.write_bytes(path.read_bytes() + b"maker trailer" * 20)
+
+    for image_check in validation.ImageCheck:
+        assert validation._validate_image(path, image_check) == (64, 48, "")
+
+
+def test_probe_rejects_other_files(tmp_path):
+    path = tmp_path / "image.jpg"
+    path.write_bytes(b"not an image at all")
+
+    _, _, error = validation._validate_image(path, validation.ImageCheck.PROBE)
+
+    assert error.startswith("Not a JPEG, PNG, WEBP image")
+
+
+def test_deep_sample_is_stable():
+    paths = [pathlib.Path(f"images/{i:05}.jpg") for i in range(1000)]
+
+    sampled = [path for path in paths if validation._is_sampled(path, 0.1)]
+
+    assert 50 < len(sampled) < 150
+    assert sampled == [path for path in paths if validation._is_sampled(path, 0.1)]
+    assert all(validation._is_sampled(path, 1.0) for path in paths)
+
+
+def test_validate_all_pairs_keeps_the_order(dummy_data_dir):
+    pairs = [
+        (
+            dummy_data_dir / "train" / "images" / "sample_00001.jpg",
+            dummy_data_dir / "train" / "labels" / "sample_00001.txt",
+            None,
+        ),
+        (dummy_data_dir / "missing.jpg", dummy_data_dir / "missing.txt", None),
+    ] * 3
+
+    results = validation._validate_all_pairs(
+        pairs, functools.partial(validation._validate_pairs, num_classes=4), jobs=2, chunk_size=1
+    )
+
+    assert [corrupt is None for corrupt, _ in results] == [True, False] * 3
+
+
+def test_incremental_validation(bad_data_dir, monkeypatch):
+    config_path = bad_data_dir / "dummy-data.yaml"
+    report_path = bad_data_dir / "validation_report.json"
+    full_report = validation.validate_all_data(config_path, report_path)
+    assert (bad_data_dir / "validation_manifest.json").exists()
+
+    validated = []
+    validate_image = validation._validate_image
+
+    def recording_validate_image(image_path, *args):
+        validated.append(image_path.name)
+        return validate_image(image_path, *args)
+
+    monkeypatch.setattr(validation, "_validate_image", recording_validate_image)
+
+    assert validation.validate_all_data(config_path, report_path) == full_report
+    assert validated == []
+
+    # Fix the malformed line, and make sure that the change is seen even on coarse clocks.
+    ann_path = pathlib.Path(next(iter(full_report["train"]["annotation_errors"])))
+    lines = ann_path.read_text().splitlines()
+    lines[2] = "0 0.5 0.5 0.1 0.1"
+    ann_path.write_text("\n".join(lines) + "\n")
+    os.utime(ann_path, ns=(0, 0))
+
+    report = validation.validate_all_data(config_path, report_path)
+    assert validated == [ann_path.stem + ".jpg"]
+    assert report["train"]["annotation_errors"] == {}
+    assert report["test"] == full_report["test"]
+
+
+def test_reuse_entry_compares_hashes_of_touched_files(tmp_path):
+    image_path, label_path = tmp_path / "a.jpg", tmp_path / "a.txt"
+    image_path.write_bytes(b"image")
+    label_path.write_text("0 0.5 0.5 0.1 0.1\n")
+    entry: manifest.ManifestEntry = {
+        "image": manifest.file_state(image_path, hash_contents=True),
+        "label": manifest.file_state(label_path, hash_contents=True),
+        "corrupt": None,
+        "annotation_errors": [],
+    }
+    assert manifest.reuse_entry(entry, image_path, label_path) == entry
+
+    os.utime(label_path, ns=(0, 0))
+    assert manifest.reuse_entry(entry, image_path, label_path) is None
+    assert manifest.reuse_entry(entry, image_path, label_path, hash_contents=True) is not None
+
+    label_path.write_text("1 0.5 0.5 0.1 0.1\n")
+    assert manifest.reuse_entry(entry, image_path, label_path, hash_contents=True) is None
+
+
+def _line_by_line_errors(ann_path, img_width, img_height, num_classes):
+    """The checks of ``_validate_annotation`` one line at a time, as they were first written."""
+    errors = []
+    for i, line in enumerate(ann_path.read_text().splitlines(keepends=True)):
+        parts = line.strip().split()
+        if len(parts) != 5:
+            errors.append(f"Line {i}: malformed")
+            continue
+        class_id, x, y, w, h = map(float, parts)
+        if not (0 <= class_id < num_classes):
+            errors.append(f"Line {i}: invalid class {class_id}")
+        if w <= 0 or h <= 0:
+            errors.append(f"Line {i}: zero or negative area")
+        if (
+            (x - w / 2) * img_width < 0
+            or (y - h / 2) * img_height < 0
+            or (x + w / 2) * img_width > img_width
+            or (y + h / 2) * img_height > img_height
+        ):
+            errors.append(f"Line {i}: bbox out of bounds")
+    return errors
+
+
+def test_validate_annotations_matches_line_by_line_checks(tmp_path):
+    rng = np.random.default_rng(0)
+    ann_paths, widths, heights = [], [], []
+    for file_index in range(20):
+        lines = []
+        for _ in range(rng.integers(0, 30)):
+            class_id = rng.integers(-1, 6)
+            x, y, w, h = rng.uniform(-0.2, 1.2, 4).round(3)
+            kind = rng.integers(0, 10)
+            if kind == 0:
+                lines.append(f"{class_id} {x} {y} {w}")
+            elif kind == 1:
+                lines.append("")
+            elif kind == 2:
+                lines.append(f"{class_id} nan {y} {w} {h}")
+            else:
+                lines.append(f"{class_id} {x} {y} {w} {h}")
+        ann_path = tmp_path / f"{file_index}.txt"
+        ann_path.write_text("\n".join(lines))
+        ann_paths.append(ann_path)
+        widths.append(int(rng.integers(1, 2000)))
+        heights.append(int(rng.integers(1, 2000)))
+
+    errors = validation._validate_annotations(ann_paths, widths, heights, num_classes=4)
+
+    assert errors == [
+        _line_by_line_errors(ann_path, width, height, 4)
+        for ann_path, width, height in zip(ann_paths, widths, heights, strict=True)
+    ]
+    assert any(errors)
+
+
+def test_validation_uses_the_shared_dataset_index(tmp_path, bad_data_dir, monkeypatch):
+    report_dir = tmp_path / "reports"
+    report_dir.mkdir()
+    expected = validation.validate_all_data(bad_data_dir / "dummy-data.yaml", report_path=None)
+
+    # The image sizes come from the index, so probing does not open the images again.
+    def fail_to_open(*args, **kwargs):
+        raise AssertionError("Image.open should not be called")
+
+    monkeypatch.setattr(validation.Image, "open", fail_to_open)
+    report = validation.validate_all_data(
+        bad_data_dir / "dummy-data.yaml",
+        report_dir / "validation_report.json",
+        image_check=validation.ImageCheck.PROBE,
+    )
+
+    assert report == expected
+    assert (bad_data_dir / index.INDEX_NAME).exists()
+    assert not (report_dir / index.INDEX_NAME).exists()
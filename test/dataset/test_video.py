@@ -0,0 +1,92 @@
+import json
+
+import cv2
+import numpy as np
+import pytest
+
+from skysealand import inference, pipeline, video
+
+FPS = 10
+
+
+@pytest.fixture
+def video_path(tmp_path):
+    """A 10 fps video of 8 frames where a square moves on frames 0, 1 and 5."""
+    path = tmp_path / "clip.avi"
+    writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*"MJPG"), FPS, (128, 96))
+    positions = [0, 40, 40, 40, 40, 80, 80, 80]
+    for x in positions:
+        frame = np.zeros((96, 128, 3), dtype=np.uint8)
+        frame[20:60, x : x + 40] = 255
+        writer.write(frame)
+    writer.release()
+    return path
+
+
+def test_read_frames(video_path):
+    frames = list(video.read_frames(video_path, stride=3, target_size=64))
+
+    assert [frame.index for frame in frames] == [0, 3, 6]
+    np.testing.assert_allclose([frame.timestamp_sec for frame in frames], [0.0, 0.3, 0.6])
+    assert frames[0].image is not None
+    assert frames[0].image.shape == (48, 64, 3)
+    assert frames[0].scale == (2.0, 2.0)
+
+
+def test_read_frames_of_missing_video(tmp_path):
+    with pytest.raises(ValueError, match="Unable to open video"):
+        list(video.read_frames(tmp_path / "missing.avi"))
+
+
+def test_mark_reused_frames(video_path):
+    frames = video.mark_reused_frames(video.read_frames(video_path), diff_threshold=0.02)
+
+    assert [frame.reuse for frame in frames] == [
+        False,
+        False,
+        True,
+        True,
+        True,
+        False,
+        True,
+        True,
+    ]
+
+
+class RecordingRunBatch:
+    def __init__(self):
+        self.batches = []
+
+    def __call__(self, images, filenames):
+        self.batches.append(filenames)
+        detections = [
+            [{"class_id": 0, "confidence": 0.5, "bbox": (float(i), 0.0, 10.0, 10.0)}]
+            for i in range(len(images))
+        ]
+        return inference.make_inference_output(filenames, detections, 0.1)
+
+
+def test_run_video_inference(video_path, tmp_path):
+    run_batch = RecordingRunBatch()
+    output_path = tmp_path / "inference.ndjson"
+
+    with output_path.open("w") as f:
+        metrics = video.run_video_inference(
+            run_batch,
+            video_path,
+            pipeline.NdjsonResultWriter(f),
+            batch_size=2,
+            diff_threshold=0.02,
+        )
+
+    assert run_batch.batches == [["clip.avi#0", "clip.avi#1"], ["clip.avi#5"]]
+    lines = [json.loads(line) for line in output_path.read_text().splitlines()[:-1]]
+    assert [line["frame_index"] for line in lines] == list(range(8))
+    assert [line["reused"] for line in lines] == [False, False, True, True, True, False, True, True]
+    # Reused frames get the detections of the last frame that was run.
+    assert lines[3]["inference"] == lines[1]["inference"]
+    assert lines[7]["inference"] == lines[5]["inference"]
+    assert lines[1]["timestamp_sec"] == pytest.approx(0.1)
+    assert metrics["num_images"] == 3
+    assert metrics["num_frames"] == 8
+    assert metrics["reused_frames"] == 5
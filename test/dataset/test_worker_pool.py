@@ -0,0 +1,139 @@
+import os
+import pathlib
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from skysealand import worker_pool
+
+
+class ShapeBoxes:
+    def __init__(self, img):
+        self.cls = np.array([img.shape[2]])
+        self.conf = np.array([img.mean() / 255])
+        self.xyxy = np.array([[0, 0, img.shape[1], img.shape[0]]])
+
+
+class ShapeResult:
+    def __init__(self, img):
+        self.boxes = ShapeBoxes(img)
+
+
+class ShapeModel:
+    """Reports the shape and brightness of each image so we can check what the worker saw."""
+
+    def __call__(self, images):
+        if any(img.shape[0] == 13 for img in images):
+            os._exit(1)
+        if any(img.shape[0] == 17 for img in images):
+            time.sleep(60)
+        return [ShapeResult(img) for img in images]
+
+
+def load_shape_model(model_path, device):
+    return ShapeModel()
+
+
+@pytest.fixture(scope="module")
+def pool():
+    with worker_pool.InferenceWorkerPool(
+        pathlib.Path("model.pt"),
+        num_workers=2,
+        model_loader=load_shape_model,
+        health_check_interval_sec=None,
+        run_timeout_sec=5.0,
+    ) as pool:
+        yield pool
+
+
+def test_images_are_handed_to_workers(pool):
+    images = [
+        np.full((10, 20, 3), 255, dtype=np.uint8),
+        np.zeros((30, 5, 3), dtype=np.uint8),
+    ]
+
+    output = pool.run_with_timing(images, ["a.jpg", "b.jpg"])
+
+    assert output["metrics"]["num_images"] == 2
+    assert [r["filename"] for r in output["results"]] == ["a.jpg", "b.jpg"]
+    assert output["results"][0]["inference"] == [
+        {"class_id": 3, "confidence": 1.0, "bbox": (0.0, 0.0, 20.0, 10.0)}
+    ]
+    assert output["results"][1]["inference"][0]["bbox"] == (0.0, 0.0, 5.0, 30.0)
+
+
+def _wait_for_idle_workers(pool):
+    """Waits until the workers that failed have been restarted in the background."""
+    deadline = time.monotonic() + 60
+    while pool._idle.qsize() < pool.num_workers:
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+
+
+def test_crashed_workers_are_restarted(pool):
+    with pytest.raises(worker_pool.WorkerCrashedError):
+        pool.run([np.zeros((13, 13, 3), dtype=np.uint8)])
+
+    # The pool should still have all of its workers.
+    _wait_for_idle_workers(pool)
+    for _ in range(pool.num_workers):
+        assert len(pool.run([np.zeros((4, 4, 3), dtype=np.uint8)])) == 1
+
+
+def test_hung_workers_are_restarted(pool):
+    with pytest.raises(worker_pool.WorkerTimeoutError):
+        pool.run([np.zeros((17, 17, 3), dtype=np.uint8)])
+
+    _wait_for_idle_workers(pool)
+    for _ in range(pool.num_workers):
+        assert len(pool.run([np.zeros((4, 4, 3), dtype=np.uint8)])) == 1
+
+
+def test_failed_batches_do_not_wait_for_the_restart(pool, monkeypatch):
+    restarting = threading.Event()
+    restarted = threading.Event()
+    start_worker = pool._start_worker
+
+    def slow_start_worker():
+        restarting.set()
+        restarted.wait()
+        return start_worker()
+
+    monkeypatch.setattr(pool, "_start_worker", slow_start_worker)
+
+    with pytest.raises(worker_pool.WorkerCrashedError):
+        pool.run([np.zeros((13, 13, 3), dtype=np.uint8)])
+
+    assert restarting.wait(5)
+    # The other worker keeps answering while the crashed one is replaced.
+    assert len(pool.run([np.zeros((4, 4, 3), dtype=np.uint8)])) == 1
+    restarted.set()
+    _wait_for_idle_workers(pool)
+
+
+def test_workers_that_fail_to_restart_are_left_to_the_health_check(pool, monkeypatch):
+    def fail_to_start_worker():
+        raise RuntimeError("Inference worker failed to start: no model")
+
+    monkeypatch.setattr(pool, "_start_worker", fail_to_start_worker)
+
+    with pytest.raises(worker_pool.WorkerCrashedError):
+        pool.run([np.zeros((13, 13, 3), dtype=np.uint8)])
+
+    _wait_for_idle_workers(pool)
+    monkeypatch.undo()
+    assert pool.check_health() == 1
+
+
+def test_health_check_restarts_dead_workers(pool):
+    assert pool.check_health() == 0
+
+    worker = pool._idle.get()
+    worker.process.kill()
+    worker.process.join()
+    pool._idle.put(worker)
+
+    assert pool.check_health() == 1
+    assert pool.check_health() == 0